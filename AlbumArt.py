@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Album art for the OLED display, kept ready so showing it when the track changes costs nothing.
+
+Each track's art is fetched from the sonos once, in the background, and made into a small 1-bit (black and white)
+thumbnail, dithered with Floyd-Steinberg so it still looks like the cover on the OLED.  Only the thumbnails are kept,
+in a disk cache (album_art_cache) with a byte budget; when it is full the least recently used ones are removed.  The
+most recently used are also kept in memory.  Getting a thumbnail never goes to the network or does any image
+processing, if it isn't ready yet there is just no art.
+
+The art for the next few tracks in the queue is fetched before they play, and the art for the current track when it
+changes, from the ZoneStateCache and QueueMirror updates.
+
+Classes:
+    AlbumArtCache:      the cache, and the background fetcher
+
+Functions:
+    art_url:            the url the sonos serves a track's art from
+"""
+
+import collections
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+import urllib.parse
+import requests
+import SonosUtils
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Image.Dither is new in Pillow 9.1, older versions only have the constant on Image
+FLOYDSTEINBERG = getattr(Image, 'Dither', Image).FLOYDSTEINBERG
+
+
+def art_url(ip, uri):
+    """
+    :return:    the url of the album art for a track, from the sonos unit at ip.  The same url the sonos gives as the
+                album art of the current track.
+    :rtype:     str
+    """
+    return "http://" + ip + ":1400/getaa?s=1&u=" + urllib.parse.quote(uri, safe='')
+
+
+class AlbumArtCache:
+    """
+    Thumbnails of album art, by track uri.
+
+    Methods:
+        - get               the thumbnail for a track, if we have it.  No network, no image processing
+        - prefetch          fetches a track's art in the background, if we don't have it
+        - prefetch_upcoming fetches the art for the next tracks in a QueueMirror
+        - follow            prefetches from the ZoneStateCache updates
+    """
+
+    def __init__(self, cache_dir = 'album_art_cache', max_bytes = 1000000, size = (64, 64), memory_items = 32,
+                 ahead = 3, timeout = 5, missing_retry = 3600, error_retry = 60):
+        """
+        :param cache_dir:       directory the thumbnails are saved in
+        :type cache_dir:        str
+        :param max_bytes:       most bytes of thumbnails to keep on disk; a 64 x 64 thumbnail is 512 bytes
+        :type max_bytes:        int
+        :param size:            width and height of the thumbnails in pixels
+        :type size:             tuple
+        :param memory_items:    number of thumbnails to keep in memory as well
+        :type memory_items:     int
+        :param ahead:           number of tracks after the one playing to fetch the art for
+        :type ahead:            int
+        :param timeout:         seconds to wait for the sonos to send the art
+        :type timeout:          float
+        :param missing_retry:   seconds before asking again for art the sonos says it doesn't have (404, or not an
+                                image)
+        :type missing_retry:    float
+        :param error_retry:     seconds before asking again after a timeout or network error
+        :type error_retry:      float
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = tuple(size)
+        self.memory_items = memory_items
+        self.ahead = ahead
+        self.timeout = timeout
+        self.missing_retry = missing_retry
+        self.error_retry = error_retry
+        self.lock = threading.Lock()
+        self.memory = collections.OrderedDict()     # key: thumbnail image, most recently used last
+        self.files = collections.OrderedDict()      # key: bytes on disk, most recently used last
+        self.total_bytes = 0
+        self.pending = set()                        # keys waiting to be fetched
+        self.missing = {}                           # key: time we can ask again, so we don't keep asking
+        self.fetches = queue.Queue()
+        self.load_index()
+        fetcher = threading.Thread(target=self.fetch_loop, name='album art', daemon=True)
+        fetcher.start()
+
+    def key(self, uri):
+        # the size is part of the key, so changing it doesn't use thumbnails of the old size
+        return hashlib.sha1((uri + "@{}x{}".format(*self.size)).encode('utf-8')).hexdigest()
+
+    def file_name(self, key):
+        return os.path.join(self.cache_dir, key + ".1bit")
+
+    def load_index(self):
+        """
+        Finds the thumbnails already on disk, oldest used first.  Used thumbnails have their modified time updated, so
+        this is the least recently used order.
+        """
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".1bit")]
+        except OSError:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            self.files[entry.name[:-len(".1bit")]] = entry.stat().st_size
+            self.total_bytes += entry.stat().st_size
+        print("Album art cache has", len(self.files), "thumbnails,", self.total_bytes, "bytes")
+
+    def get(self, uri):
+        """
+        :param uri:     uri of the track
+        :type uri:      str
+        :return:        the 1-bit thumbnail for the track, None if we don't have it (yet)
+        :rtype:         PIL.Image
+        """
+        if not uri:
+            return None
+        key = self.key(uri)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.files.move_to_end(key)
+                return self.memory[key]
+            if key not in self.files:
+                return None
+            self.files.move_to_end(key)
+        try:
+            with open(self.file_name(key), 'rb') as file:
+                image = Image.frombytes('1', self.size, file.read())
+            # so it is recently used next time we start
+            os.utime(self.file_name(key))
+        except (OSError, ValueError) as e:
+            print("Could not read album art thumbnail:", e)
+            with self.lock:
+                self.total_bytes -= self.files.pop(key, 0)
+            return None
+        self.remember(key, image)
+        return image
+
+    def remember(self, key, image):
+        with self.lock:
+            self.memory[key] = image
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def prefetch(self, uri, url):
+        """
+        Fetches the art for a track in the background, if we don't have it already.  Returns right away.
+
+        :param uri:     uri of the track
+        :type uri:      str
+        :param url:     url of the album art
+        :type url:      str
+        """
+        if not uri or not url:
+            return
+        key = self.key(uri)
+        with self.lock:
+            if key in self.files or key in self.pending or self.missing.get(key, 0) > time.time():
+                return
+            self.missing.pop(key, None)
+            self.pending.add(key)
+        self.fetches.put((key, url))
+
+    def prefetch_upcoming(self, queue_mirror):
+        """
+        Fetches the art for the next tracks in the queue.
+
+        :param queue_mirror:    the jukebox's QueueMirror
+        :type queue_mirror:     object
+        """
+        ip = queue_mirror.unit.ip_address
+        for uri, title, artist in queue_mirror.upcoming(self.ahead):
+            self.prefetch(uri, art_url(ip, uri))
+
+    def follow(self, zone_state, queue_mirror = None):
+        """
+        Prefetches from the ZoneStateCache updates; the art for the current track when the track changes, and the
+        art for the next tracks in queue_mirror when the queue moves on or changes.
+
+        :param zone_state:      the ZoneStateCache
+        :type zone_state:       object
+        :param queue_mirror:    the jukebox's QueueMirror, or None
+        :type queue_mirror:     object
+        """
+        def track_changed(unit, track):
+            if track:
+                url = track.get('album_art', '')
+                if url.startswith('/'):
+                    # events give the path on the sonos
+                    url = "http://" + unit.ip_address + ":1400" + url
+                self.prefetch(track.get('uri', ''), url)
+
+        def queue_changed(unit, value):
+            if unit.ip_address == queue_mirror.unit.ip_address:
+                self.prefetch_upcoming(queue_mirror)
+
+        zone_state.add_listener('track', track_changed)
+        if queue_mirror is not None:
+            zone_state.add_listener('queue_position', queue_changed)
+            zone_state.add_listener('queue_length', queue_changed)
+
+    def fetch_loop(self):
+        """
+        Runs in the fetcher thread, fetches one image at a time so the sonos isn't swamped.
+        """
+        while True:
+            key, url = self.fetches.get()
+            try:
+                response = requests.get(url, timeout=self.timeout)
+                response.raise_for_status()
+                image = self.make_thumbnail(response.content)
+                self.save(key, image)
+                self.remember(key, image)
+            except requests.HTTPError as e:
+                # the sonos sends 404 for a track with no art (ie radio), anything else could be gone next time
+                print("Could not get album art", url, ":", e)
+                not_found = e.response is not None and e.response.status_code == 404
+                self.retry_later(key, self.missing_retry if not_found else self.error_retry)
+            except UnidentifiedImageError as e:
+                # whatever the sonos sent, it isn't album art
+                print("No album art", url, ":", e)
+                self.retry_later(key, self.missing_retry)
+            except (requests.RequestException, OSError, ValueError) as e:
+                # timed out or the sonos didn't answer, try again soon
+                print("Could not get album art", url, ":", e)
+                self.retry_later(key, self.error_retry)
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+
+    def retry_later(self, key, seconds):
+        with self.lock:
+            self.missing[key] = time.time() + seconds
+
+    def make_thumbnail(self, data):
+        """
+        :param data:    the album art image, jpeg or png
+        :type data:     bytes
+        :return:        1-bit thumbnail of the art, Floyd-Steinberg dithered
+        :rtype:         PIL.Image
+        """
+        image = Image.open(io.BytesIO(data)).convert('L')
+        image = ImageOps.fit(image, self.size)
+        # stretch the greys across the whole range first, dark covers come out black otherwise
+        image = ImageOps.autocontrast(image)
+        return image.convert('1', dither=FLOYDSTEINBERG)
+
+    def save(self, key, image):
+        """
+        Saves a thumbnail, then removes the least recently used ones until we are in the byte budget.
+        """
+        data = image.tobytes()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        SonosUtils.atomic_write(self.file_name(key), data)
+        evicted = []
+        with self.lock:
+            self.total_bytes += len(data) - self.files.get(key, 0)
+            self.files[key] = len(data)
+            self.files.move_to_end(key)
+            while self.total_bytes > self.max_bytes and len(self.files) > 1:
+                old_key, old_bytes = self.files.popitem(last=False)
+                self.total_bytes -= old_bytes
+                self.memory.pop(old_key, None)
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.file_name(old_key))
+            except OSError:
+                pass
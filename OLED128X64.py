@@ -152,6 +152,45 @@ class OLED:
         except Exception as e:
             print("Error writing to OLED display: ", e)
 
+    def display_art(self, art, line1, line2 = ""):
+        """
+        Displays album art on the left, with the title over two lines and the artist on the right.  The art is a
+        thumbnail from AlbumArt.AlbumArtCache, already 1-bit and the right size, so it is just pasted in.
+
+        :param art:     1-bit album art thumbnail, no higher than the display
+        :type art:      PIL.Image
+        :param line1:   title
+        :type line1:    str
+        :param line2:   artist
+        :type line2:    str
+        """
+        try:
+            if self.is_busy:
+                print("Display is is_busy")
+                return
+            self.is_busy = True
+            # characters that fit beside the art
+            text_x = art.width + 2
+            text_chars = int(self.char_wide * (self.width - text_x) / self.width)
+            title_lines = SonosUtils.split_text(str(line1), no_lines=2, line_length=text_chars, centering_on=False)
+            lines = [SonosUtils.center_text(line, text_chars) for line in title_lines] + \
+                    [SonosUtils.center_text(line2, text_chars)]
+            print("Updating Display, with album art")
+            print(lines)
+            self.clear_display()
+            self.image.paste(art, (0, 0))
+            for number, line in enumerate(lines):
+                self.draw.text((text_x, self.top + 1 + number * (self.font_size + 4)), line, font=self.font, fill=255)
+            self.disp.image(self.image)
+            self.disp.show()
+            self.display_start_time = time.time()
+            self.is_busy = False
+            self.timed_out = False
+
+        except Exception as e:
+            print("Error writing to OLED display: ", e)
+            self.is_busy = False
+
 
 
 
@@ -17,7 +17,8 @@ class OLED:
     Can display 2 - 4 number_of_lines of text, up to 16 characters wide with decent legibility.
 
     """
-    def __init__(self, pixels_wide=128, pixels_high=32, font_size=14, lines=2, char_width = 18):
+    def __init__(self, pixels_wide=128, pixels_high=32, font_size=14, lines=2, char_width = 18, runtime = None,
+                 timeout = 600):
         # Create the I2C interface.
         i2c = busio.I2C(board.SCL, board.SDA)
         # Create the SSD1306 OLED class.
@@ -38,9 +39,16 @@ class OLED:
         self.char_wide = char_width
         self.draw = ImageDraw.Draw(self.image)
         self.display_start_time = time.time()
-        # start display time out loop in seperate thread
-        self.timer_thread = threading.Thread(target=self.display_timeout)
-        self.timer_thread.start()
+        self.timeout = timeout
+        self.busy = False
+        self.timed_out = False
+        if runtime is not None:
+            # SonosRuntime.Runtime checks the time out, no thread needed
+            runtime.every(15, self.check_timeout, name='display timeout')
+        else:
+            # start display time out loop in seperate thread
+            self.timer_thread = threading.Thread(target=self.display_timeout, args=(timeout,))
+            self.timer_thread.start()
         self.font = ImageFont.load_default()
         # todo add fonts to pi, for now use the default
         # self.font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSansCondensed.ttf', self.font_size)
@@ -105,16 +113,24 @@ class OLED:
         """
 
         while True:
-            elapsed = time.time() - self.display_start_time
-            if elapsed >= timeout:
-                self.clear_display()
-                print('display has timed out, backlight is off')
-                self.timed_out = True
-            else:
-                print('LCD timer, on time is: ', round(elapsed), ' seconds')
+            self.check_timeout(timeout)
             time.sleep(15)
         return
 
+    def check_timeout(self, timeout=None):
+        """
+        Turns off the display if it has been on for longer than timeout seconds.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        elapsed = time.time() - self.display_start_time
+        if elapsed >= timeout:
+            self.clear_display()
+            print('display has timed out, backlight is off')
+            self.timed_out = True
+        else:
+            print('LCD timer, on time is: ', round(elapsed), ' seconds')
+
     def is_busy(self):
         # Need this for compatibilty with slow displays that cannot be written to too quickly.
         return self.busy
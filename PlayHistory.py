@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+History of the wallbox selections that have been played, kept in an SQLite database.
+
+Recording a play never touches the disk or the network; record() puts the play on a queue and returns.  A background
+thread takes the plays off the queue and writes them to the database in batches, one transaction per batch.  The
+database is in WAL mode, so the history tool (history.py) can read it while the wallbox is writing to it.
+
+Classes:
+    PlayHistory:    the recorder and the database
+
+Functions:
+    connect:        opens the database, history.py uses it too
+    migrate:        updates a database made by an older version
+
+This module does not use any of the pi hardware, so it can be used off the pi.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    id              INTEGER PRIMARY KEY,
+    time            REAL,                   -- time.time() when the selection was made, NULL if not known
+    title           TEXT,
+    artist          TEXT,
+    source          TEXT,                   -- album, or playlist / favorite
+    type            TEXT,                   -- sonos_favorites, sonos_playlists or sonos_playlist_tracks, or
+                                            -- played_songs.txt if imported from the old file
+    uri             TEXT,
+    letter_number   TEXT,                   -- wallbox selection, ie B3
+    pageset         TEXT,                   -- name of the page set
+    unit            TEXT                    -- sonos unit it was played on
+);
+CREATE INDEX IF NOT EXISTS plays_time ON plays (time);
+"""
+
+COLUMNS = ('time', 'title', 'artist', 'source', 'type', 'uri', 'letter_number', 'pageset', 'unit')
+
+
+def connect(db_file):
+    """
+    :return:    a connection to the database, with the tables made if they are not there yet
+    :rtype:     sqlite3.Connection
+    """
+    # wait for the other program if it is writing, the wallbox and history.py can both write
+    connection = sqlite3.connect(db_file, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # with WAL, NORMAL only syncs at checkpoints; a power cut can lose the last few plays, never the database
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    migrate(connection)
+    return connection
+
+
+def migrate(connection):
+    """
+    Makes the time column nullable in a database made before plays could be imported without a time.  SQLite can't
+    change a column, so the table is made again with the plays copied over, ids and all (the history.py totals go by
+    the ids), in one transaction.
+
+    :param connection:  connection to the database
+    :type connection:   sqlite3.Connection
+    """
+    columns = {row[1]: row for row in connection.execute("PRAGMA table_info(plays)")}
+    # the fourth value of each row is 1 if the column is NOT NULL
+    if not columns['time'][3]:
+        return
+    print("Updating the play history database so plays can have no time")
+    table = SCHEMA.split(";")[0].replace("CREATE TABLE IF NOT EXISTS plays", "CREATE TABLE plays_new")
+    # executescript would commit part way, so each statement is run on its own.  sqlite3 only starts a transaction
+    #   itself before an INSERT, so it is started here, before the first CREATE
+    with connection:
+        connection.execute("BEGIN")
+        connection.execute("DROP TABLE IF EXISTS plays_new")
+        connection.execute(table)
+        connection.execute("INSERT INTO plays_new (id, " + ", ".join(COLUMNS) + ") SELECT id, " + ", ".join(COLUMNS) +
+                           " FROM plays")
+        connection.execute("DROP TABLE plays")
+        connection.execute("ALTER TABLE plays_new RENAME TO plays")
+        connection.execute("CREATE INDEX IF NOT EXISTS plays_time ON plays (time)")
+
+
+class PlayHistory:
+    """
+    Records plays in the background.
+
+    Methods:
+        - record        adds a play to the queue, returns right away
+        - flush         waits until everything recorded so far is written
+        - close         writes what is left and stops the writer; give it to Runtime.on_shutdown
+        - connect       opens the database, for reading
+    """
+
+    def __init__(self, db_file = 'play_history.db', batch_size = 50, flush_interval = 5):
+        """
+        :param db_file:         the SQLite database file, made if it doesn't exist
+        :type db_file:          str
+        :param batch_size:      most plays written in one transaction
+        :type batch_size:       int
+        :param flush_interval:  seconds to wait for more plays before writing the ones we have
+        :type flush_interval:   float
+        """
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.plays = queue.Queue()
+        self.written = 0
+        self.writer = threading.Thread(target=self.write_loop, name='play history', daemon=True)
+        self.writer.start()
+
+    def record(self, **play):
+        """
+        Adds a play to the queue to be written.  Never blocks.
+
+        :param play:    values for the columns in COLUMNS, time is filled in if not given
+        """
+        play.setdefault('time', time.time())
+        self.plays.put(tuple(play.get(column) for column in COLUMNS))
+
+    def flush(self):
+        """
+        Waits until every play recorded so far has been written.
+        """
+        done = threading.Event()
+        self.plays.put(done)
+        done.wait()
+
+    def close(self):
+        """
+        Writes the plays that are left and stops the writer thread.
+        """
+        self.plays.put(None)
+        self.writer.join(timeout=10)
+
+    def connect(self):
+        """
+        :return:    a connection to the database, with the tables made if they are not there yet
+        :rtype:     sqlite3.Connection
+        """
+        return connect(self.db_file)
+
+    def write_loop(self):
+        """
+        Runs in the writer thread.  Takes plays off the queue, waits up to flush_interval for more, and writes up to
+        batch_size of them in one transaction.
+        """
+        connection = self.connect()
+        running = True
+        while running:
+            batch = []
+            waiting = []            # flush() events to set once the batch is written
+            item = self.plays.get()
+            deadline = time.time() + self.flush_interval
+            while True:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiting.append(item)
+                else:
+                    batch.append(item)
+                if not running or waiting or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.plays.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    with connection:
+                        connection.executemany("INSERT INTO plays (" + ", ".join(COLUMNS) + ") VALUES (" +
+                                               ", ".join("?" * len(COLUMNS)) + ")", batch)
+                    self.written += len(batch)
+                except sqlite3.Error as e:
+                    print("Could not save play history:", e)
+            for done in waiting:
+                done.set()
+        connection.close()
@@ -9,10 +9,21 @@ requires SonosHW.py module
 Classes:
     SonosVolCtrl :          changes the volume of a sonos unit based on CW or CCW input,
                             also pauses, plays when button pushed
+    VolumeWriter:           local model of each unit's volume; adds up volume changes from the encoder and sends
+                            them to the unit as one SetVolume, reconciles the model with what the unit reports
     PlayStateLED:           changes colour of a tricolour LED depending on the playstate of a sonos unit.  Subclass of
                             SonosHW.TriColourLED.
     SonosDisplayUpdater:    updates the two line displays and playstate playstate_led when the sonos track changes
+    PollScheduler:          works out how often SonosDisplayUpdater polls the sonos unit when events are not available
     SonosUnits:             all the sonos units, Methods for getting units, selecting active unit
+    ZoneStateCache:         transport state, track, volume, mute and group of every unit, kept up to date in the
+                            background so it can be read without going to the network
+    WallboxPlayer:          plays the wallbox selections from the current page set
+    PagesetSnapshot:        one resolved wallbox page set, swapped in whole when the page set changes
+    LazyPageset:            a wallbox page set that resolves each section the first time it is played
+    SelectionPlan:          the uri and metadata to send to the sonos for one wallbox selection
+    QueueMirror:            our own copy of the active unit's queue, for the jukebox
+    LibraryWatcher:         tells the WallboxPlayer which sonos favorites and playlists have changed
     
 Imports:
     soco               soco.SoCo project
@@ -26,9 +37,15 @@ import time
 import SonosHW
 import random
 import SonosUtils
+import PlayHistory
 import threading
 import datetime
 import json
+import queue
+import types
+import concurrent.futures
+import bisect
+from soco.data_structures import to_didl_string
 # import board
 # from jsoncomment import JsonComment
 
@@ -78,15 +95,134 @@ class PlaystateLED(SonosHW.TriColorLED):
             print('error in playstate playstate_led')
 
 
+class PollScheduler:
+    """
+    Works out how long SonosDisplayUpdater waits between polls when it can't get sonos events.
+
+    While a track is playing we poll every slow seconds (at most), then poll tightly (every fast seconds) just before
+    the track is expected to end so the new track shows up quickly.  While stopped, or when the display has timed out,
+    the interval backs off exponentially up to max_stopped or max_timed_out.  Any local input (encoder, button,
+    wallbox) calls poke, which wakes the updater and polls fast for fast_period seconds.
+    """
+
+    def __init__(self, fast=1, slow=15, end_lead=3, backoff=2, max_stopped=60, max_timed_out=300, fast_period=20):
+        """
+        :param fast:            seconds between polls near the end of a track and after local input
+        :type fast:             float
+        :param slow:            longest time between polls while a track is playing, seconds
+        :type slow:             float
+        :param end_lead:        start polling fast this many seconds before the track is expected to end
+        :type end_lead:         float
+        :param backoff:         multiply the interval by this each poll while stopped
+        :type backoff:          float
+        :param max_stopped:     longest interval while stopped, seconds
+        :type max_stopped:      float
+        :param max_timed_out:   longest interval when stopped and the display is timed out, seconds
+        :type max_timed_out:    float
+        :param fast_period:     how long to poll fast after local input, seconds
+        :type fast_period:      float
+        """
+        self.fast = fast
+        self.slow = slow
+        self.end_lead = end_lead
+        self.backoff = backoff
+        self.max_stopped = max_stopped
+        self.max_timed_out = max_timed_out
+        self.fast_period = fast_period
+        self.interval = fast
+        self.fast_until = 0
+        self.poke_wake_time = 0                 # last time poke woke the updater
+        # wake counts the wakes, wait returns when there has been one since it last returned; so a wake while we
+        #   are polling (not waiting) isn't lost, the next wait returns straight away
+        self.condition = threading.Condition()
+        self.wakes = 0
+        self.seen_wakes = 0
+        self.wakers = []                        # functions called by wake, ie PeriodicJob.wake when using the runtime
+        self.polls = 0                          # number of times we have polled, to see how many calls we save
+
+    def next_interval(self, playing, position=None, duration=None, timed_out=False):
+        """
+        Calculates the time until the next poll.
+
+        :param playing:     True if the unit is playing
+        :type playing:      bool
+        :param position:    position in the current track, seconds.  None if not known (radio stations)
+        :type position:     int
+        :param duration:    duration of the current track, seconds. None if not known
+        :type duration:     int
+        :param timed_out:   True if the display has timed out
+        :type timed_out:    bool
+        :return:            seconds to wait before the next poll
+        :rtype:             float
+        """
+        self.polls += 1
+        if time.time() < self.fast_until:
+            # something happened locally, the sonos is probably about to change
+            self.interval = self.fast
+        elif timed_out or not playing:
+            # back off exponentially, nothing much is going to happen
+            max_interval = self.max_timed_out if timed_out else self.max_stopped
+            self.interval = min(max(self.interval, self.fast) * self.backoff, max_interval)
+        elif position is None or not duration:
+            # radio station or stream, we don't know when the track will change
+            self.interval = self.slow
+        else:
+            time_left = duration - position
+            if time_left <= self.end_lead:
+                self.interval = self.fast
+            else:
+                # wake up just before the end of the track, but not later than slow
+                self.interval = max(self.fast, min(self.slow, time_left - self.end_lead))
+        return self.interval
+
+    def wait(self, interval):
+        """
+        Sleeps until the next poll, or until poke is called.  Returns straight away if it has been called since the
+        last wait.
+
+        :param interval:    seconds to wait
+        :type interval:     float
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.wakes != self.seen_wakes, timeout=interval)
+            self.seen_wakes = self.wakes
+
+    def wake(self):
+        """
+        Cuts the current wait short, or the next one if we aren't waiting.  Can be called from any thread.
+        """
+        with self.condition:
+            self.wakes += 1
+            self.condition.notify_all()
+        for waker in self.wakers:
+            waker()
+
+    def poke(self):
+        """
+        Called on local input, polls fast for a while.  Wakes the updater at most once every fast seconds, so spinning
+        the encoder (a poke for every detent) doesn't have it polling back to back.
+        """
+        now = time.time()
+        self.fast_until = now + self.fast_period
+        self.interval = self.fast
+        if now - self.poke_wake_time >= self.fast:
+            self.poke_wake_time = now
+            self.wake()
+
+
 class SonosDisplayUpdater:
     """
     Displays the title and artist of the current track when it changes, updates the playstate LED as well
 
-
-    NON twisted version, uses loop to check event listener for changes
+    Uses the AVTransport and RenderingControl events of the active unit so that changes are pushed to us as they
+    happen.  The subscriptions are the ZoneStateCache's (units.zone_state), it passes the events on to us, so the
+    units don't have to send every event twice; we follow SonosUnits.active_unit and ignore the events from the other
+    units.  If the events can't be delivered (firewall, event listener can't start, etc) we
+    fall back to polling the unit, and try the events again every event_retry seconds.
     """
 
-    def __init__(self, units, display, playstate_led, weather_update, led_timeout = 1800):
+    def __init__(self, units, display, playstate_led, weather_update, led_timeout = 1800, use_events = True,
+                 event_timeout = 10, event_retry = 600, poll_scheduler = None, runtime = None, album_art = None):
         """
         :param units:                   sonos units
         :type units:                    object
@@ -94,17 +230,42 @@ class SonosDisplayUpdater:
         :type display:                  object
         :param playstate_led:           volume knob playstate_led - shows playstate
         :type playstate_led:            object
+        :param use_events:              if True subscribe to sonos events, otherwise poll the active unit
+        :type use_events:               bool
+        :param event_timeout:           seconds to wait for the first event after subscribing before deciding that
+                                        events can't get through to us
+        :type event_timeout:            int
+        :param event_retry:             seconds to wait before trying events again after they have failed
+        :type event_retry:              int
+        :param poll_scheduler:          works out the time between checks when we are polling, default PollScheduler
+        :type poll_scheduler:           object
+        :param runtime:                 SonosRuntime.Runtime to run the checks on, if None we use our own thread
+        :type runtime:                  object
+        :param album_art:               AlbumArt.AlbumArtCache, if not None and the display can show images the album
+                                        art is shown with the track
+        :type album_art:                object
         """
         self.units = units
         self.device = units.active_unit
         self.display = display
         self.playstate_led = playstate_led
         self.weather_update = weather_update
+        self.album_art = album_art
         self.playing = False                        # attribute, tells other defs if sonos unit is playing or is stopped
 
         self.led_timeout = led_timeout
-        listening_loop = threading.Thread(target=self.check_for_sonos_changes)
-        listening_loop.start()
+        self.use_events = use_events
+        self.event_timeout = event_timeout
+        self.event_retry = event_retry
+        self.scheduler = poll_scheduler if poll_scheduler is not None else PollScheduler()
+        self.track_position = None                  # position and duration of the current track, when polling
+        self.track_duration = None
+        self.events = queue.Queue()                 # events from the zone state cache's subscriptions
+        self.subscribed_unit = None                 # unit we are using the events of, None if we are polling
+        self.events_failed_time = 0                 # time events last failed, we poll for a while after that
+        self.first_event_deadline = 0               # time the first event has to come by after subscribing
+        self.volume = None                          # volume of the active unit, from the RenderingControl events
+        self.muted = None
 
         self.old_playing = False
         self.old_track_meta = ""
@@ -113,11 +274,24 @@ class SonosDisplayUpdater:
         self.old_playstate =""
         self.track_info = []
 
+        if use_events:
+            units.zone_state.add_event_listener(self.event_received)
+        # start the loop last, it uses the attributes above
+        if runtime is not None:
+            job = runtime.every(self.next_interval, self.check_once, first_delay=5, name='display updater')
+            # events and local input wake the job up
+            self.scheduler.wakers.append(job.wake)
+        else:
+            listening_loop = threading.Thread(target=self.check_for_sonos_changes)
+            listening_loop.start()
+
 
     def check_for_sonos_changes(self):
         """
         Loops and checks to see if playstate has changed or if track has changed.
         Runs in it's own thread, which is started in the class __init__
+
+        Uses the sonos events when we can get them, otherwise polls the active unit.
         :return:
         :rtype:
         """
@@ -128,38 +302,187 @@ class SonosDisplayUpdater:
         while True:
             # loop continuously to listen for change in transport state or track title
             try:
-                # set the playing property.
-                # get playstate of current device
-                self.device = self.units.active_unit
-                self.playstate = self.device.get_current_transport_info()['current_transport_state']
-                # set playing attribute.
-                if self.playstate == "STOPPED" or self.playstate == "PAUSED_PLAYBACK":
-                    self.playing = False
+                if self.events_available():
+                    # wait for the next event, times out so that we notice if the active unit has changed
+                    self.wait_for_event(timeout=2)
                 else:
-                    self.playing = True
-                # print("Playing?: ", self.playing)
-                track_meta = self.device.get_current_track_info()["metadata"]
-                #print(self.device.get_current_track_info())
-                #print("------------------------------------------------------------")
-                # if playstate or track has changed then update display and playstate_led
-                if self.playstate != self.old_playstate or track_meta != self.old_track_meta:
-                    print("Old:", self.old_playing, 'New: ', self.playing)
-                    print("Old track: ", self.old_track_meta, 'New Track: ', track_meta)
-                    self.display_new_track_info()
-                    self.old_playstate = self.playstate
-                    self.old_track_meta = track_meta
-                    self.track_changed_time = time.time()
-                    # update led colour to reflect current playstate
-                    self.playstate_led.show_playstate(self.playstate)
-                    self.first_time = True
-                # wait a few seconds before checking playstate again
-                time.sleep(5)
+                    self.poll_sonos()
+                    # wait before checking playstate again, how long depends on what the unit is doing
+                    interval = self.scheduler.next_interval(self.playing, self.track_position, self.track_duration,
+                                                            self.display.timed_out)
+                    self.scheduler.wait(interval)
                 if self.display.timed_out and not self.playing:
                     self.playstate_led.change_led('off')
 
             except Exception as e:
                 print('There was an error in check for sonos changes:', e)
 
+    def check_once(self):
+        """
+        One pass of the checks, used when the updater is run by the runtime.  Processes all the events that are
+        waiting, or polls the unit if we can't get events.
+        """
+        if self.events_available():
+            while self.wait_for_event(timeout=0):
+                pass
+        else:
+            self.poll_sonos()
+        if self.display.timed_out and not self.playing:
+            self.playstate_led.change_led('off')
+
+    def next_interval(self):
+        """
+        :return:    seconds until check_once should run again (events wake it up sooner)
+        :rtype:     float
+        """
+        if self.subscribed_unit is not None:
+            # only have to check now and then that the active unit has not changed
+            return 2
+        return self.scheduler.next_interval(self.playing, self.track_position, self.track_duration,
+                                            self.display.timed_out)
+
+    def event_received(self, event):
+        """
+        Called by the zone state cache for each event from its subscriptions.  Queues the events from the unit we are
+        following and wakes the updater.
+        """
+        subscribed_unit = self.subscribed_unit
+        if subscribed_unit is not None and event.service.soco.ip_address == subscribed_unit.ip_address:
+            self.events.put(event)
+            self.scheduler.wake()
+
+    def events_available(self):
+        """
+        Makes sure we are getting the events of the active unit from the zone state cache.  Follows the active unit
+        when it changes, and has the cache subscribe again if soco could not renew its subscriptions.
+
+        :return:        True if we are getting events from the active unit, False if we have to poll
+        :rtype:         bool
+        """
+        if not self.use_events:
+            return False
+        self.device = self.units.active_unit
+        zone_state = self.units.zone_state
+        if self.subscribed_unit is self.device and zone_state.is_subscribed(self.device):
+            if zone_state.got_event(self.device) or time.time() < self.first_event_deadline:
+                return True
+            # sonos sends the current state as soon as we subscribe, if that did not get to us then nothing will
+            print("Sonos events not available, polling instead: no event received within", self.event_timeout,
+                  "seconds")
+            self.stop_events()
+            self.events_failed_time = time.time()
+            return False
+        if time.time() - self.events_failed_time < self.event_retry:
+            # events failed recently, keep polling for now
+            return False
+        self.stop_events()
+        print("Using events from", zone_state.player_name(self.device))
+        # only subscribes if the cache isn't already
+        if not zone_state.subscribe(self.device):
+            print("Sonos events not available, polling instead")
+            self.events_failed_time = time.time()
+            return False
+        self.subscribed_unit = self.device
+        # don't wait here for the first event, that would hold up a worker; the next passes check it came
+        self.first_event_deadline = time.time() + self.event_timeout
+        # the cache may already have had the event sonos sends when it subscribes, so start from the state it has
+        try:
+            track_meta = zone_state.track(self.device)['metadata']
+            if hasattr(track_meta, 'to_dict'):
+                track_meta = track_meta.to_dict()
+            self.update_sonos_state(zone_state.transport_state(self.device), track_meta)
+        except Exception as e:
+            print("Could not get the state of", self.device.ip_address, e)
+        return True
+
+    def stop_events(self):
+        """
+        Stops using the events, and throws away any still waiting in the queue.  The subscriptions are the zone state
+        cache's, so they are left alone.
+        """
+        self.subscribed_unit = None
+        while not self.events.empty():
+            self.events.get_nowait()
+
+    def wait_for_event(self, timeout):
+        """
+        Waits for an event from the subscriptions and processes it.
+
+        :param timeout:     seconds to wait for an event
+        :type timeout:      float
+        :return:            True if an event from the active unit was processed
+        :rtype:             bool
+        """
+        try:
+            event = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        if self.subscribed_unit is None or event.service.soco.ip_address != self.subscribed_unit.ip_address:
+            # left over from the unit we were following before
+            return False
+        variables = event.variables
+        if event.service.service_type == "RenderingControl":
+            # the zone state cache has already put the volume in the cache, for the volume model
+            if 'volume' in variables:
+                self.volume = int(variables['volume']['Master'])
+            if 'mute' in variables:
+                self.muted = variables['mute']['Master'] == '1'
+        else:
+            playstate = variables.get('transport_state', self.playstate)
+            track_meta = variables.get('current_track_meta_data', self.old_track_meta)
+            if hasattr(track_meta, 'to_dict'):
+                # compare the track metadata as a dictionary, the didl objects don't compare by value
+                track_meta = track_meta.to_dict()
+            self.update_sonos_state(playstate, track_meta)
+        return True
+
+    def poll_sonos(self):
+        """
+        Gets the playstate and current track from the active unit, used when we can't get events.
+        """
+        # get playstate of current device
+        self.device = self.units.active_unit
+        playstate = self.device.get_current_transport_info()['current_transport_state']
+        current_track = self.device.get_current_track_info()
+        self.units.zone_state.update(self.device, transport_state=playstate, track=current_track)
+        self.track_position = SonosUtils.time_to_seconds(current_track['position'])
+        self.track_duration = SonosUtils.time_to_seconds(current_track['duration'])
+        self.update_sonos_state(playstate, current_track["metadata"])
+
+    def poke(self):
+        """
+        Called when there is local input (encoder, button, wallbox), so that we check the sonos unit right away.
+        """
+        self.scheduler.poke()
+
+    def update_sonos_state(self, playstate, track_meta):
+        """
+        Sets the playing attribute, and updates the display and playstate led if the playstate or track has changed.
+
+        :param playstate:       sonos transport state
+        :type playstate:        str
+        :param track_meta:      metadata of the current track, only used to tell if the track has changed
+        :type track_meta:       str or dict
+        """
+        self.playstate = playstate
+        # set playing attribute.
+        if self.playstate == "STOPPED" or self.playstate == "PAUSED_PLAYBACK":
+            self.playing = False
+        else:
+            self.playing = True
+        # if playstate or track has changed then update display and playstate_led
+        if self.playstate != self.old_playstate or track_meta != self.old_track_meta:
+            print("Old:", self.old_playing, 'New: ', self.playing)
+            print("Old track: ", self.old_track_meta, 'New Track: ', track_meta)
+            self.display_new_track_info()
+            self.old_playstate = self.playstate
+            self.old_track_meta = track_meta
+            self.old_playing = self.playing
+            self.track_changed_time = time.time()
+            # update led colour to reflect current playstate
+            self.playstate_led.show_playstate(self.playstate)
+            self.first_time = True
+
     def display_new_track_info(self, show_time = False):
         """
         Displays the new track info on the display, and updates the playstate LED.  Assumes display is two line type
@@ -171,7 +494,12 @@ class SonosDisplayUpdater:
         """
         try:
             self.device = self.units.active_unit
-            self.track_info = SonosUtils.getTitleArtist(unit=self.device)
+            # the track from the events, or from the poll we have just done; only read from the unit if it is old
+            self.track_info = SonosUtils.title_artist(self.units.zone_state.track(self.device, max_age=5))
+            if self.track_info['album_art'].startswith('/'):
+                # events give the path on the sonos
+                self.track_info['album_art'] = "http://" + self.device.ip_address + ":1400" + \
+                                               self.track_info['album_art']
             print()
             print('*************** Changed *************')
             print('          ', time.asctime())
@@ -186,7 +514,16 @@ class SonosDisplayUpdater:
                     # second line will be the time (H:M) and the track artist
                 else:
                     second_line = self.track_info['track_from']
-                self.display.display_text(self.track_info['track_title'],second_line)
+                art = None
+                if self.album_art is not None and hasattr(self.display, 'display_art'):
+                    # only shows the art if it has already been fetched, otherwise fetches it for next time
+                    art = self.album_art.get(self.track_info['uri'])
+                    if art is None:
+                        self.album_art.prefetch(self.track_info['uri'], self.track_info['album_art'])
+                if art is not None:
+                    self.display.display_art(art, self.track_info['track_title'], second_line)
+                else:
+                    self.display.display_text(self.track_info['track_title'],second_line)
 
         except Exception as e:
             print('There was an error in print_event:', e)
@@ -197,7 +534,7 @@ class DisplayTimeOut:
     times out the display
     '''
 
-    def __init__(self, display, updater, timeout = 10):
+    def __init__(self, display, updater, timeout = 10, runtime = None):
         '''
         :param display:
         :type display:
@@ -205,14 +542,19 @@ class DisplayTimeOut:
         :type updater:
         :param timeout:         number of minutes display will stay on
         :type timeout:          int, minutes
+        :param runtime:         SonosRuntime.Runtime to run the timer on, if None we use our own thread
+        :type runtime:          object
         '''
         self.display = display
         self.updater = updater
         # multiply timeout by 60 to get seconds
         self.timeout = timeout * 60
-        # make threading object to run the display timer loop in
-        self.timer_thread = threading.Thread(target=self.display_timeout)
-        self.timer_thread.start()
+        if runtime is not None:
+            runtime.every(30, self.check_timeout, name='display timeout')
+        else:
+            # make threading object to run the display timer loop in
+            self.timer_thread = threading.Thread(target=self.display_timeout)
+            self.timer_thread.start()
 
     def display_timeout(self):
         '''
@@ -222,15 +564,265 @@ class DisplayTimeOut:
 
         print("Display timeout timer started")
         while True:
-            time_on = time.time() - self.display.display_start_time
-            curr_hour = datetime.datetime.now().hour
-            if (time_on > self.timeout or 23 < curr_hour < 6) and not self.updater.playing:
-                if time_on < self.timeout + 30:
-                    # only turn off the display once, don't need to keep doing it :-)
-                    print("display has been on for ",round(time_on/60)," minutes, turning it off")
-                    self.display.clear_display()
+            self.check_timeout()
             time.sleep(30)
 
+    def check_timeout(self):
+        '''
+        turns off the display if it has been on too long and nothing is playing
+        '''
+        time_on = time.time() - self.display.display_start_time
+        curr_hour = datetime.datetime.now().hour
+        if (time_on > self.timeout or 23 < curr_hour < 6) and not self.updater.playing:
+            if time_on < self.timeout + 30:
+                # only turn off the display once, don't need to keep doing it :-)
+                print("display has been on for ",round(time_on/60)," minutes, turning it off")
+                self.display.clear_display()
+
+
+
+class VolumeWriter:
+    """
+    Local model of the volume of each unit, and coalesced writes of volume changes from the rotary encoder.
+
+    Each detent changes our model of the unit's volume right away, so the display can show the new volume without
+    waiting for the network, and adds to a pending change for the unit.  window seconds after the first detent the
+    model volume is sent to the unit as one absolute SetVolume.  Detents that come in while a write is in flight are
+    sent together in the next write, and a scheduled write that finds its change already sent by an earlier one is
+    dropped.  So the speaker is never more than window plus one round trip behind the knob; the lag of each write is
+    measured and the worst one is kept in max_lag.
+
+    The model is reconciled in the background: whenever the ZoneStateCache gets a volume for a unit (from events, or
+    its polling) that is different from our model, and we are not in the middle of changing it, we take the unit's
+    volume, ie when someone has changed the volume from the phone app.
+
+    Group volume changes are coalesced the same way, then sent with one SetRelativeGroupVolume to the group
+    coordinator, or if that doesn't work, with a SetRelativeVolume to every member at the same time.  Either way the
+    whole group changes in about one round trip however many units are in it.
+    """
+
+    def __init__(self, zone_state, window = 0.15, runtime = None, settle = 2, use_group_rendering = True,
+                 fan_out_workers = 4):
+        """
+        :param zone_state:  ZoneStateCache, gives us the starting volume without a GET, and is updated after writes
+        :type zone_state:   object
+        :param window:      seconds to collect detents before writing
+        :type window:       float
+        :param runtime:     SonosRuntime.Runtime to do the writes on, if None a threading.Timer is used
+        :type runtime:      object
+        :param settle:      seconds after our last change before we take volumes reported by the unit, so we don't
+                            go back to a volume from before our writes got there
+        :type settle:       float
+        :param use_group_rendering:     if True change group volume with the coordinator's GroupRenderingControl
+        :type use_group_rendering:      bool
+        :param fan_out_workers:         most members we send volume changes to at once, if there is no runtime; with
+                                        a runtime they are sent on its io pool
+        :type fan_out_workers:          int
+        """
+        self.zone_state = zone_state
+        self.window = window
+        self.runtime = runtime
+        self.settle = settle
+        self.lock = threading.Lock()
+        self.pending = {}                   # key: {'unit', 'delta', 'first_time'} waiting to be written
+        self.model = {}                     # ip address: volume we think the unit is at
+        self.changed_time = {}              # ip address: time of our last change to the model
+        self.write_locks = {}               # key: lock, so only one write per unit (or group) is in flight
+        self.use_group_rendering = use_group_rendering
+        if runtime is not None:
+            self.fan_out = runtime.io_executor
+        else:
+            self.fan_out = concurrent.futures.ThreadPoolExecutor(max_workers=fan_out_workers,
+                                                                 thread_name_prefix='volume')
+        self.snapshots = {}                 # coordinator ip: members when we last did SnapshotGroupVolume
+        self.detents = 0                    # stats, to see how much we are saving
+        self.writes = 0
+        self.last_lag = 0
+        self.max_lag = 0
+        # reconcile our model whenever the cache hears about a volume
+        zone_state.add_listener('volume', self.reconcile)
+
+    def volume(self, unit):
+        """
+        :return:    the volume we think the unit is at, no network calls unless we have never seen its volume
+        :rtype:     int
+        """
+        with self.lock:
+            volume = self.model.get(unit.ip_address)
+        if volume is None:
+            volume = self.zone_state.volume(unit, max_age=60)
+        return volume
+
+    def change(self, unit, delta):
+        """
+        Changes the model volume of a unit right away, and schedules the write if one is not already scheduled.
+
+        :param unit:    sonos unit
+        :type unit:     soco object
+        :param delta:   change in volume, + or -
+        :type delta:    int
+        :return:        the new volume, to show on the display
+        :rtype:         int
+        """
+        current = self.volume(unit)
+        with self.lock:
+            current = self.model.get(unit.ip_address, current)
+            volume = max(0, min(100, current + delta))
+            self.model[unit.ip_address] = volume
+            self.changed_time[unit.ip_address] = time.time()
+        self.add_pending(unit.ip_address, unit, delta, self.flush)
+        return volume
+
+    def change_group(self, unit, delta):
+        """
+        Adds a volume change for every member of the unit's group, and schedules the write.
+
+        :param unit:    any unit in the group
+        :type unit:     soco object
+        :param delta:   change in volume, + or -
+        :type delta:    int
+        """
+        self.add_pending('group:' + unit.ip_address, unit, delta, self.flush_group)
+
+    def add_pending(self, key, unit, delta, flush):
+        with self.lock:
+            self.detents += 1
+            pending = self.pending.get(key)
+            if pending is not None:
+                pending['delta'] += delta
+                return
+            self.pending[key] = {'unit': unit, 'delta': delta, 'first_time': time.time()}
+        if self.runtime is not None:
+            self.runtime.call_later(self.window, flush, key)
+        else:
+            timer = threading.Timer(self.window, flush, args=(key,))
+            timer.daemon = True
+            timer.start()
+
+    def take_pending(self, key):
+        """
+        Waits for any write in flight with the same key, then takes the pending change.
+
+        :return:    the write lock (held, caller releases it) and the pending change, None if it was already sent
+        """
+        with self.lock:
+            write_lock = self.write_locks.setdefault(key, threading.Lock())
+        write_lock.acquire()
+        with self.lock:
+            # take the pending change when we get to write it, so it includes everything up to now
+            pending = self.pending.pop(key, None)
+        return write_lock, pending
+
+    def flush(self, ip_address):
+        """
+        Writes the model volume of a unit, called window seconds after the first detent.
+        """
+        write_lock, pending = self.take_pending(ip_address)
+        try:
+            if pending is None:
+                # an earlier write already sent it
+                return
+            unit = pending['unit']
+            with self.lock:
+                target = self.model.get(ip_address)
+            if target is None:
+                # model was thrown away, ie a group change, the next detent starts from the unit's volume
+                return
+            try:
+                unit.volume = target
+            except Exception as e:
+                print("Could not set volume of", ip_address, e)
+                # don't trust our model any more, start from the unit's volume next time
+                self.forget(unit)
+                return
+            self.record_write(pending, "Volume set to " + str(target))
+        finally:
+            write_lock.release()
+        self.zone_state.update(unit, volume=target)
+
+    def flush_group(self, key):
+        """
+        Writes the pending change for a group, called window seconds after the first detent.
+        """
+        write_lock, pending = self.take_pending(key)
+        try:
+            if pending is None:
+                return
+            unit = pending['unit']
+            group = self.zone_state.group(unit, max_age=60)
+            coordinator = group.coordinator
+            members = list(group.members)
+            sent = False
+            if self.use_group_rendering and len(members) > 1:
+                try:
+                    member_ips = frozenset(member.ip_address for member in members)
+                    if self.snapshots.get(coordinator.ip_address) != member_ips:
+                        # sonos needs a snapshot of the relative volumes of the members when the group has changed
+                        coordinator.groupRenderingControl.SnapshotGroupVolume([("InstanceID", 0)])
+                        self.snapshots[coordinator.ip_address] = member_ips
+                    coordinator.groupRenderingControl.SetRelativeGroupVolume(
+                        [("InstanceID", 0), ("Adjustment", pending['delta'])])
+                    sent = True
+                    for member in members:
+                        # we don't know the members' new volumes, the events will tell us
+                        self.forget(member)
+                except Exception as e:
+                    print("Group volume change not available, changing each unit:", e)
+                    self.snapshots.pop(coordinator.ip_address, None)
+            if not sent:
+                # send to all the members at once, one SetRelativeVolume each, no GETs
+                futures = {self.fan_out.submit(member.set_relative_volume, pending['delta']): member
+                           for member in members}
+                for future in concurrent.futures.as_completed(futures):
+                    member = futures[future]
+                    try:
+                        new_volume = future.result()
+                    except Exception as e:
+                        print("Could not change volume of", member.ip_address, e)
+                        self.forget(member)
+                        continue
+                    with self.lock:
+                        self.model[member.ip_address] = new_volume
+                    self.zone_state.update(member, volume=new_volume)
+            self.record_write(pending, "Group volume changed by " + str(pending['delta']))
+        finally:
+            write_lock.release()
+
+    def record_write(self, pending, message):
+        self.writes += 1
+        self.last_lag = time.time() - pending['first_time']
+        self.max_lag = max(self.max_lag, self.last_lag)
+        print(message, "lag", round(self.last_lag, 3), "s,", self.detents, "detents in", self.writes, "writes")
+
+    def reconcile(self, unit, reported_volume):
+        """
+        Called by the ZoneStateCache when it gets a volume for a unit.  If it is different from our model, and we are
+        not changing the volume ourselves, the unit is right and we take its volume.
+
+        :param unit:                sonos unit
+        :type unit:                 soco object
+        :param reported_volume:     volume the unit says it is at
+        :type reported_volume:      int
+        """
+        ip_address = unit.ip_address
+        with self.lock:
+            model_volume = self.model.get(ip_address)
+            if model_volume is None or model_volume == reported_volume:
+                return
+            write_lock = self.write_locks.get(ip_address)
+            if ip_address in self.pending or (write_lock is not None and write_lock.locked()) or \
+                    time.time() - self.changed_time.get(ip_address, 0) < self.settle:
+                # we are changing it, this is probably from before our write got there
+                return
+            self.model[ip_address] = reported_volume
+        print("Volume of", ip_address, "was changed somewhere else, now", reported_volume)
+
+    def forget(self, unit):
+        """
+        Forgets our model of the unit's volume.  The next change starts from the cached volume.
+        """
+        with self.lock:
+            self.model.pop(unit.ip_address, None)
 
 
 class SonosVolCtrl:
@@ -241,7 +833,12 @@ class SonosVolCtrl:
         and does stuff when the encoder button is pressed (also via callbacks)
     """
 
-    def __init__(self, units, updater, display, vol_ctrl_led, weather, up_increment=4, down_increment=5):
+    def __init__(self, units, updater, display, vol_ctrl_led, weather, up_increment=4, down_increment=5,
+                 runtime = None):
+        """
+        :param runtime:     SonosRuntime.Runtime to do the volume writes on, if None threads are used
+        :type runtime:      object
+        """
         self.lcd = display
         # sonos unit
         self.units = units
@@ -257,6 +854,8 @@ class SonosVolCtrl:
         self.display = display
         self.old_button_press_time = time.time()
         self.updater = updater
+        # volume changes from the encoder are added up and written together
+        self.volume_writer = VolumeWriter(units.zone_state, runtime=runtime)
 
     def change_group_volume(self, direction):
         """
@@ -270,8 +869,8 @@ class SonosVolCtrl:
         if direction == 'CW': volume_change = self.upinc
         else: volume_change = -self.downinc
 
-        for each_unit in self.units.active_unit.group:
-            each_unit.volume += volume_change
+        # changes all the members at once, in about one round trip
+        self.volume_writer.change_group(self.units.active_unit, volume_change)
 
 
     def change_volume(self, direction):
@@ -286,17 +885,19 @@ class SonosVolCtrl:
         :rtype:                 none
         """
 
+        self.updater.poke()
         if self.updater.playing:
             self.volume_changed_time = time.time()
             if direction == 'CW':
                 # direction is clockwise
-                self.units.active_unit.volume += self.upinc
+                unit_volume = self.volume_writer.change(self.units.active_unit, self.upinc)
             elif direction == 'CCW':
                 # direction is counter clockwise, volume down
                 # turn volume down more quickly than up, better for the user!
-                self.units.active_unit.volume -= self.downinc
-            # get the volume of the sonos unit
-            unit_volume = self.units.active_unit.volume
+                unit_volume = self.volume_writer.change(self.units.active_unit, -self.downinc)
+            else:
+                unit_volume = self.volume_writer.volume(self.units.active_unit)
+            # the new volume comes from our model, we don't wait for the unit
             # display the volume on the display underneath the artist and track title.
             self.display.display_text(self.updater.track_info['track_from'],
                                       self.updater.track_info['track_title'], "   Volume is: " + str(unit_volume),
@@ -311,6 +912,7 @@ class SonosVolCtrl:
         #pauses, plays, skips tracks when rotary encoder button is pressed.
         # callback from a button (usually the rotary encoder)
 
+        self.updater.poke()
         try:
             if not long_press:
                 button_interval = time.time() - self.old_button_press_time
@@ -341,36 +943,360 @@ class SonosVolCtrl:
     def pause_play(self):
         try:
             # pauses or plays the sonos unit, toggles between the two.
-            play_state = self.units.active_unit.get_current_transport_info()['current_transport_state']
+            play_state = self.units.zone_state.transport_state(self.units.active_unit, max_age=5)
             print(play_state)
             if play_state == "PAUSED_PLAYBACK" or play_state == "STOPPED":
                 self.units.active_unit.play()
+                self.units.zone_state.update(self.units.active_unit, transport_state="PLAYING")
                 print("Now Playing")
             elif play_state == "PLAYING":
                 # unit is playing, stop it
                 self.units.active_unit.pause()
+                self.units.zone_state.update(self.units.active_unit, transport_state="PAUSED_PLAYBACK")
                 print("Now Paused")
         except:
             print("could not pause or play")
 
 
 
+class ZoneStateCache:
+    """
+    Current state of every sonos unit in the household; transport state, track, volume, mute, group coordinator,
+    group members and player name.
+
+    Fed in the background, by events from each unit when we can get them, otherwise by polling every refresh_interval
+    seconds.  These are the only event subscriptions we make; anything else that wants the events (ie the
+    SonosDisplayUpdater) gets them from here with add_event_listener, so each unit only has to send them once.  Reading
+    the cache never goes to the network unless the caller asks for a live value, or the cached value
+    is older than the max_age the caller gives.  Values that come from a working event subscription are always fresh.
+
+    Each value is stored with the time it was last updated:
+        zones[ip_address][field] = (value, time)
+    """
+
+    FIELDS = ('transport_state', 'track', 'volume', 'mute', 'coordinator', 'group', 'player_name', 'queue_position',
+              'queue_length')
+
+    def __init__(self, units, refresh_interval = 30, use_events = True, runtime = None):
+        """
+        :param units:               the SonosUnits, we keep state for all of units.units
+        :type units:                object
+        :param refresh_interval:    seconds between polls of units we are not getting events from
+        :type refresh_interval:     int
+        :param use_events:          if True subscribe to events from each unit
+        :type use_events:           bool
+        :param runtime:             SonosRuntime.Runtime to do the refreshes on, if None we use our own thread
+        :type runtime:              object
+        """
+        self.units = units
+        self.refresh_interval = refresh_interval
+        self.use_events = use_events
+        self.zones = {}
+        self.lock = threading.Lock()
+        self.events = queue.Queue()
+        self.subscriptions = {}                     # ip address: list of subscriptions for that unit
+        self.listeners = {}                         # field: functions called with (unit, value) on each update
+        self.event_listeners = []                   # functions called with each event
+        self.event_times = {}                       # ip address: time of the last event since we subscribed
+        self.last_refresh = 0
+        self.runtime = runtime
+        if runtime is not None:
+            runtime.every(refresh_interval, self.refresh, name='zone state refresh')
+        else:
+            refresh_loop = threading.Thread(target=self.refresh_loop, daemon=True)
+            refresh_loop.start()
+
+    def update(self, unit, **fields):
+        """
+        Puts new values in the cache, with the current time.
+
+        :param unit:        the sonos unit the values are for
+        :type unit:         soco object
+        :param fields:      field = value, fields are in ZoneStateCache.FIELDS
+        """
+        now = time.time()
+        with self.lock:
+            zone = self.zones.setdefault(unit.ip_address, {})
+            for field, value in fields.items():
+                zone[field] = (value, now)
+        for field, value in fields.items():
+            for listener in self.listeners.get(field, []):
+                listener(unit, value)
+
+    def add_listener(self, field, listener):
+        """
+        Adds a function that is called with (unit, value) every time field is updated.  It is called on whatever
+        thread did the update, so it has to be quick and thread safe.
+        """
+        self.listeners.setdefault(field, []).append(listener)
+
+    def add_event_listener(self, listener):
+        """
+        Adds a function that is called with every event from the subscriptions, after the values from it are in the
+        cache.  It is called on soco's event thread (or our refresh thread), so it has to be quick and thread safe.
+        """
+        self.event_listeners.append(listener)
+
+    def is_subscribed(self, unit):
+        """
+        :return:    True if our subscriptions to the unit's events are working, as far as soco knows
+        :rtype:     bool
+        """
+        subscriptions = self.subscriptions.get(unit.ip_address, [])
+        return bool(subscriptions) and all(sub.is_subscribed for sub in subscriptions)
+
+    def got_event(self, unit):
+        """
+        :return:    True if an event has come from the unit since we subscribed.  Sonos sends one as soon as we
+                    subscribe, so if none has come the events can't get through to us
+        :rtype:     bool
+        """
+        return unit.ip_address in self.event_times
+
+    def age(self, unit, field):
+        """
+        :return:    seconds since the field was updated, None if we have never had a value
+        :rtype:     float
+        """
+        with self.lock:
+            entry = self.zones.get(unit.ip_address, {}).get(field)
+        if entry is None:
+            return None
+        return time.time() - entry[1]
+
+    def is_fresh(self, unit, field, max_age = None):
+        """
+        Checks if the cached value can be used.  Values fed by a working event subscription are always fresh, otherwise
+        the value has to be younger than max_age.  If max_age is None any cached value will do.
+        """
+        age = self.age(unit, field)
+        if age is None:
+            return False
+        if max_age is None or age <= max_age:
+            return True
+        # the subscription only counts once an event has come through it
+        return self.is_subscribed(unit) and self.got_event(unit) and field not in ('coordinator', 'group',
+                                                                                   'player_name')
+
+    def get(self, unit, field, max_age = None, live = False):
+        """
+        Gets a value from the cache, reads it from the unit if live is True, if we don't have it, or if it is stale.
+
+        :param unit:        sonos unit
+        :type unit:         soco object
+        :param field:       one of ZoneStateCache.FIELDS
+        :type field:        str
+        :param max_age:     oldest value (seconds) the caller will accept, None for any age
+        :type max_age:      float
+        :param live:        if True always read the value from the unit
+        :type live:         bool
+        :return:            the value, None if the unit doesn't have one (ie no queue position when a stream is
+                            playing)
+        """
+        if live or not self.is_fresh(unit, field, max_age):
+            self.read_live(unit, field)
+        with self.lock:
+            return self.zones.get(unit.ip_address, {}).get(field, (None, 0))[0]
+
+    def transport_state(self, unit, max_age = None, live = False):
+        return self.get(unit, 'transport_state', max_age, live)
+
+    def track(self, unit, max_age = None, live = False):
+        return self.get(unit, 'track', max_age, live)
+
+    def volume(self, unit, max_age = None, live = False):
+        return self.get(unit, 'volume', max_age, live)
+
+    def mute(self, unit, max_age = None, live = False):
+        return self.get(unit, 'mute', max_age, live)
+
+    def coordinator(self, unit, max_age = None, live = False):
+        return self.get(unit, 'coordinator', max_age, live)
+
+    def group(self, unit, max_age = None, live = False):
+        return self.get(unit, 'group', max_age, live)
+
+    def player_name(self, unit, max_age = None, live = False):
+        return self.get(unit, 'player_name', max_age, live)
+
+    def queue_position(self, unit, max_age = None, live = False):
+        # 1 is the first track in the queue
+        return self.get(unit, 'queue_position', max_age, live)
+
+    def queue_length(self, unit, max_age = None, live = False):
+        return self.get(unit, 'queue_length', max_age, live)
+
+    def read_live(self, unit, field):
+        """
+        Reads a field from the sonos unit and puts it in the cache.
+        """
+        if field == 'transport_state':
+            self.update(unit, transport_state=unit.get_current_transport_info()['current_transport_state'])
+        elif field in ('track', 'queue_position'):
+            track = unit.get_current_track_info()
+            position = str(track.get('playlist_position', ''))
+            # not a number when the queue is empty or a stream is playing
+            self.update(unit, track=track, queue_position=int(position) if position.isdigit() else None)
+        elif field == 'queue_length':
+            self.update(unit, queue_length=unit.queue_size)
+        elif field == 'volume':
+            self.update(unit, volume=unit.volume)
+        elif field == 'mute':
+            self.update(unit, mute=unit.mute)
+        elif field in ('coordinator', 'group'):
+            group = unit.group
+            self.update(unit, coordinator=group.coordinator, group=group)
+        elif field == 'player_name':
+            self.update(unit, player_name=unit.player_name)
+        else:
+            raise ValueError("unknown zone state field: " + field)
+
+    def refresh_loop(self):
+        """
+        Runs in its own thread.  Processes events from the units, and every refresh_interval subscribes to new units,
+        polls the units we can't get events from, and refreshes the groups.
+        """
+        while True:
+            try:
+                if time.time() - self.last_refresh > self.refresh_interval:
+                    self.refresh()
+                    self.last_refresh = time.time()
+                try:
+                    event = self.events.get(timeout=self.refresh_interval)
+                except queue.Empty:
+                    continue
+                self.process_event(event)
+            except Exception as e:
+                print("Error updating zone state cache:", e)
+
+    def refresh(self):
+        """
+        Makes sure we have up to date state for all of the units.
+        """
+        for unit in list(self.units.units):
+            if self.use_events and self.subscribe(unit):
+                continue
+            for field in ('transport_state', 'track', 'volume', 'mute'):
+                try:
+                    self.read_live(unit, field)
+                except Exception as e:
+                    print("Could not refresh", field, "for", unit.ip_address, e)
+        # one call gets the groups for the whole household
+        for unit in list(self.units.units):
+            try:
+                for group in unit.all_groups:
+                    for member in group.members:
+                        self.update(member, coordinator=group.coordinator, group=group,
+                                    player_name=member.player_name)
+                break
+            except Exception as e:
+                print("Could not get sonos groups from", unit.ip_address, e)
+
+    def subscribe(self, unit):
+        """
+        Subscribes to the AVTransport and RenderingControl events of a unit, if we are not already subscribed.
+
+        :return:    True if we are getting events from the unit
+        :rtype:     bool
+        """
+        if self.is_subscribed(unit):
+            return True
+        subscriptions = self.subscriptions.get(unit.ip_address, [])
+        for subscription in subscriptions:
+            try:
+                subscription.unsubscribe()
+            except Exception:
+                pass
+        subscriptions = []
+        self.event_times.pop(unit.ip_address, None)
+        try:
+            for service in (unit.avTransport, unit.renderingControl):
+                subscription = service.subscribe(auto_renew=True, event_queue=self.events)
+                if self.runtime is not None:
+                    # no thread waiting on the queue, process the events as they come in
+                    subscription.callback = self.process_event
+                subscriptions.append(subscription)
+            self.subscriptions[unit.ip_address] = subscriptions
+            return True
+        except Exception as e:
+            print("Could not subscribe to events from", unit.ip_address, e)
+            for subscription in subscriptions:
+                try:
+                    subscription.unsubscribe()
+                except Exception:
+                    pass
+            self.subscriptions[unit.ip_address] = []
+            return False
+
+    def process_event(self, event):
+        """
+        Puts the values from an event into the cache, then passes the event on to the event listeners.
+        """
+        unit = event.service.soco
+        self.event_times[unit.ip_address] = time.time()
+        variables = event.variables
+        if event.service.service_type == "RenderingControl":
+            if 'volume' in variables:
+                self.update(unit, volume=int(variables['volume']['Master']))
+            if 'mute' in variables:
+                self.update(unit, mute=variables['mute']['Master'] == '1')
+        else:
+            if 'transport_state' in variables:
+                self.update(unit, transport_state=variables['transport_state'])
+            if 'current_track_meta_data' in variables:
+                meta = variables['current_track_meta_data']
+                # same keys as get_current_track_info, so readers don't care where the track came from
+                track = {'title': getattr(meta, 'title', ''), 'artist': getattr(meta, 'creator', ''),
+                         'album': getattr(meta, 'album', ''), 'album_art': getattr(meta, 'album_art_uri', ''),
+                         'uri': variables.get('current_track_uri', ''), 'metadata': meta,
+                         'position': '', 'duration': variables.get('current_track_duration', '')}
+                # radio stations put "artist - title" in the stream content, as get_current_track_info reads it
+                stream_content = getattr(meta, 'stream_content', '') or ''
+                if ' - ' in stream_content and 'TYPE=SNG|' not in stream_content:
+                    track['artist'], track['title'] = [part.strip() for part in stream_content.split(' - ', 1)]
+                self.update(unit, track=track)
+            if str(variables.get('av_transport_uri', '')).startswith('x-rincon-queue:'):
+                # playing from the queue, so the track number and number of tracks are the queue's
+                if 'current_track' in variables:
+                    self.update(unit, queue_position=int(variables['current_track']))
+                if 'number_of_tracks' in variables:
+                    self.update(unit, queue_length=int(variables['number_of_tracks']))
+        for listener in self.event_listeners:
+            listener(event)
+
+
 class SonosUnits:
     """
     The Sonos units available.  Selects the active unit using a pushbutton.
 
+    The last known units (uid, ip address, name, model and group) are saved in units_file.  At startup we use them
+    straight away, so the controller works in well under a second, then check them in the background; each saved
+    address is probed directly (unicast, in parallel), and a multicast discovery finds any new units.  Units that
+    have moved or gone are merged into the list without holding up any of the buttons.
+
     Methods:
         - get_sonos_units         gets a list of the sonos units, and makes a list of their names
         - select_sonos_unit       selects a sonos unit using the pushbutton.  This method is called from a GPIO interrupt
                                 generated by pushing a button.
     """
 
-    def __init__(self, display, default_name = 'Kitchen'):
+    def __init__(self, display, default_name = 'Kitchen', runtime = None, units_file = 'sonos_units.json',
+                 discover_timeout = 20, probe_timeout = 1, candidate_ips = ()):
         """
         :param display:             an display object
         :type display:              object
         :param default_name:    name of the default unit
         :type default_name:     str
+        :param runtime:         SonosRuntime.Runtime for background work (its io pool), if None threads are used
+        :type runtime:          object
+        :param units_file:      file the last known units are saved in
+        :type units_file:       str
+        :param discover_timeout:    seconds the background multicast discovery runs for
+        :type discover_timeout:     int
+        :param probe_timeout:   seconds to wait for each saved unit to answer when we check them
+        :type probe_timeout:    float
+        :param candidate_ips:   ip addresses the default unit is likely to be at, checked along with the saved units
+        :type candidate_ips:    list
         """
 
         self.unit_index = 0                 # counter for stepping through list
@@ -378,30 +1304,85 @@ class SonosUnits:
         self.display = display                      # the display display
         self.get_units_time = 0             # time that the sonos list was last updated
         self.first_time = True              # flag so that we get sonos list when button is pushed.
-        self.active_unit = self.get_default_unit(default_name, tries=3,wait=2)
-        self.units = list(soco.discover(timeout=20))
+        self.units_file = units_file
+        self.runtime = runtime
+        self.discover_timeout = discover_timeout
+        self.probe_timeout = probe_timeout
+        self.refreshing = threading.Lock()  # so only one background refresh runs at a time
+        # start with the units we found last time, no network needed
+        self.topology = self.load_units()
+        self.units = [soco.SoCo(entry['ip']) for entry in self.topology]
+        self.number_of_units = len(self.units)
+        # state of all the units, shared by everything that needs to know what the units are doing
+        self.zone_state = ZoneStateCache(self, runtime=runtime)
+        for entry, unit in zip(self.topology, self.units):
+            self.zone_state.update(unit, player_name=entry['name'])
+        # the saved default unit straight away, the background refresh checks it is still there and follows it if it
+        #   has moved
+        self.active_unit = self.cached_unit(default_name)
+        if self.active_unit is None:
+            # nothing saved for the default unit, have to go and find it
+            self.active_unit = self.get_default_unit(default_name, candidate_ips, tries=3, wait=2)
+        else:
+            print("Active unit:", default_name, self.active_unit.ip_address, "from", self.units_file)
         self.selected_unit = self.active_unit
         self.selected_unit_name = self.active_unit_name
+        # check the saved units and look for new ones in the background
+        self.get_units()
 
 
-    def get_default_unit(self,default_name, tries=3, wait=2):
+    def get_default_unit(self,default_name, candidate_ips = (), tries=3, wait=2):
         """
-        Gets the default unit, if result is 'None' the tries up to <tries> times and waits <wait> between tries
+        Gets the default unit.  Checks the candidate ip addresses and the saved units all at once (one short http
+        request each), and uses the first one that answers with the right name.  If none of them do, falls back to
+        multicast discovery, up to <tries> times with <wait> seconds between tries.
+
         :param default_name:    Name of the sonos unit we are looking for
         :type default_name:     str
+        :param candidate_ips:   ip addresses to check first
+        :type candidate_ips:    list
         :return:                Soco object
         :rtype:                 object
         """
-
-        for x in range(tries):
-            active = soco.discovery.by_name(default_name)
-            if active is not None:
-                break
-            time.sleep(wait)
-        # if we have  not found a unit then make the kitchen the active unit, set by ip address
-        active = soco.SoCo('192.168.1.8')
-
-        print("active Unit:", active.player_name, "tried ", x, 'times')
+        start_time = time.monotonic()
+        # saved address for the default unit first, then the others in case it has been renamed or moved
+        saved_ips = [entry['ip'] for entry in self.topology if entry['name'] == default_name]
+        saved_ips += [entry['ip'] for entry in self.topology if entry['name'] != default_name]
+        ips = list(dict.fromkeys(list(candidate_ips) + saved_ips))
+        active = None
+        if ips:
+            pool = self.io_pool(len(ips))
+            probes = [pool.submit(SonosUtils.probe_unit, ip, self.probe_timeout) for ip in ips]
+            try:
+                for probe in concurrent.futures.as_completed(probes, timeout=self.probe_timeout + 1):
+                    entry = probe.result()
+                    if entry is not None and entry['name'] == default_name:
+                        active = soco.SoCo(entry['ip'])
+                        break
+            except concurrent.futures.TimeoutError:
+                pass
+            # don't wait for the units that have not answered
+            if self.runtime is None:
+                pool.shutdown(wait=False)
+        if active is not None:
+            how = 'probe'
+        else:
+            # last resort, multicast discovery
+            how = 'discovery'
+            for x in range(tries):
+                active = soco.discovery.by_name(default_name)
+                if active is not None:
+                    break
+                time.sleep(wait)
+        if active is None:
+            if not self.units:
+                raise RuntimeError("Could not find sonos unit " + default_name)
+            active = self.units[0]
+            default_name = self.active_unit_name = self.zone_state.player_name(active)
+            print("Could not find the default unit, using", default_name)
+        self.zone_state.update(active, player_name=default_name)
+        print("Active unit:", default_name, active.ip_address, "found by", how, "in",
+              round(time.monotonic() - start_time, 2), "s")
         return active
 
     def group_units(self, duration):
@@ -421,27 +1402,31 @@ class SonosUnits:
                     self.get_units_time = time.time()
 
                 # cycle through units, make each one active
+                units = self.units  # the list can be replaced by a background refresh, use the one we have now
                 self.unit_index += 1  # go to next sonos unit
 
-                if self.unit_index >= self.number_of_units:
+                if self.unit_index >= len(units):
                     # if at end of units list set index back to 0
                     self.unit_index = 0
-                self.selected_unit = self.units[self.unit_index]
+                self.selected_unit = units[self.unit_index]
                 if self.selected_unit == self.active_unit:
                     # skip the active unit (kitchen or other "default" unit)
-                    self.unit_index += 1
-                    self.selected_unit = self.units[self.unit_index]
-                self.selected_unit_name = self.selected_unit.player_name
+                    self.unit_index = (self.unit_index + 1) % len(units)
+                    self.selected_unit = units[self.unit_index]
+                self.selected_unit_name = self.zone_state.player_name(self.selected_unit)
+                selected_coordinator = self.zone_state.coordinator(self.selected_unit, max_age=60)
                 print("Selected Unit:", self.unit_index, 'Name: ', self.selected_unit_name, "Unit: ", self.selected_unit)
-                print("is a member of:", self.selected_unit.group.coordinator)
+                print("is a member of:", selected_coordinator)
 
-                if self.selected_unit.group.coordinator == self.active_unit.group.coordinator:
+                if selected_coordinator == self.zone_state.coordinator(self.active_unit, max_age=60):
                     # if it is already in the group then give option to ungroup
                     print(self.selected_unit_name,"is already grouped")
                     self.display.display_text(self.selected_unit_name, "Hold > Un Group")
                 self.display.display_text(self.selected_unit_name, "Hold > Group")
             if duration == "long":
-                if self.selected_unit.group.coordinator == self.active_unit.group.coordinator:
+                # grouping changes the groups, so get the live coordinators
+                if self.zone_state.coordinator(self.selected_unit, live=True) == \
+                        self.zone_state.coordinator(self.active_unit, live=True):
                     self.selected_unit.unjoin()
                     print(self.selected_unit_name, "has left Kitchen")
                     self.display.display_text(self.selected_unit_name, "Un Grouped")
@@ -449,15 +1434,19 @@ class SonosUnits:
                     self.selected_unit.join(self.active_unit)
                     print(self.selected_unit_name,"joined to group")
                     self.display.display_text(self.selected_unit_name, "Added to Group")
+                self.zone_state.read_live(self.selected_unit, 'group')
             self.get_units_time = time.time()
 
         except:
             print('could not group or ungroup unit')
 
 
-    def select_unit_single_press(self):
+    def select_unit_single_press(self, channel = None):
         """
         Cycles through sonos units, making each one the active unit in turn.  Called when a button is pressed.
+
+        :param channel:     GPIO pin that triggered the callback, passed by the GPIO event detect, not used
+        :type channel:      int
         """
         try:
             if self.display.is_busy():
@@ -473,12 +1462,13 @@ class SonosUnits:
                     self.get_units()
             elif time_since_last < 30:
                 # cycle through units, make each one active
+                units = self.units  # the list can be replaced by a background refresh, use the one we have now
                 self.unit_index += 1  # go to next sonos unit
-                if self.unit_index >= self.number_of_units:
+                if self.unit_index >= len(units):
                     # if at end of units list set index back to 0
                     self.unit_index = 0
-                self.active_unit = self.units[self.unit_index]
-                self.active_unit_name = self.active_unit.player_name
+                self.active_unit = units[self.unit_index]
+                self.active_unit_name = self.zone_state.player_name(self.active_unit)
                 print("Active Unit:", self.unit_index, 'Name: ', self.active_unit_name, "Unit: ", self.active_unit)
                 self.display.display_text('Active Unit', self.active_unit_name)
 
@@ -489,30 +1479,495 @@ class SonosUnits:
 
     def get_units(self):
         """
-        Get list of sonos units
+        Refreshes the list of sonos units in the background, returns right away.  Prints the units we have now.
         :return:
         :rtype:
         """
-        self.units = list(soco.discover(timeout=20))
-        # nb soco.discover returns an unordered set, we need to convert to ordered list.
-        self.number_of_units = len(self.units)
         self.get_units_time = time.time()
+        # discovery takes up to discover_timeout seconds, so it goes in the runtime's io pool rather than tying up one
+        # of its (two) workers
+        if self.runtime is not None:
+            self.runtime.run_io(self.refresh_units)
+        else:
+            refresh_thread = threading.Thread(target=self.refresh_units, daemon=True)
+            refresh_thread.start()
+        self.print_units()
+
+    def io_pool(self, size):
+        """
+        :return:    the runtime's io pool, or a new pool of up to size threads (that the caller shuts down) if there is
+                    no runtime
+        :rtype:     concurrent.futures.Executor
+        """
+        if self.runtime is not None:
+            return self.runtime.io_executor
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(size, 8)))
+
+    def print_units(self):
         print()
         print('List of Sonos Units :')
-        for i in self.units:
-           print( '{0:20}{1:10}'.format( i.player_name, i.ip_address ))
+        for entry in self.topology:
+           print( '{0:20}{1:18}{2}'.format( entry['name'], entry['ip'], entry['model'] ))
         print()
 
+    def cached_unit(self, name):
+        """
+        :return:    the saved unit with this name, or None
+        :rtype:     soco object
+        """
+        for entry, unit in zip(self.topology, self.units):
+            if entry['name'] == name:
+                return unit
+        return None
+
+    def load_units(self):
+        """
+        Reads the units we found last time from units_file.
+
+        :return:    list of dictionaries with uid, ip, name, model and group (uid of the group coordinator)
+        :rtype:     list
+        """
+        try:
+            with open(self.units_file, 'r') as file:
+                topology = json.load(file)
+            print("Loaded", len(topology), "sonos units from", self.units_file)
+            return topology
+        except (OSError, ValueError) as e:
+            print("No saved sonos units:", e)
+            return []
+
+    def save_units(self, topology):
+        SonosUtils.atomic_write(self.units_file, json.dumps(topology, indent=2))
+
+    def refresh_units(self):
+        """
+        Checks the saved units and finds new ones, runs in the background.  Probes the saved addresses in parallel,
+        then does a multicast discovery, then merges what we found into the list of units and saves it.
+        """
+        if not self.refreshing.acquire(blocking=False):
+            # already refreshing
+            return
+        try:
+            start_time = time.time()
+            found = {}
+            pool = self.io_pool(len(self.topology))
+            try:
+                probes = pool.map(lambda ip: SonosUtils.probe_unit(ip, self.probe_timeout),
+                                  [entry['ip'] for entry in self.topology])
+                for entry in probes:
+                    if entry is not None:
+                        found[entry['uid']] = entry
+                print("Probed saved sonos units,", len(found), "of", len(self.topology), "answered in",
+                      round(time.time() - start_time, 2), "s")
+                # look for units that are new, or that have moved to an address we don't know about
+                discovered = soco.discover(timeout=self.discover_timeout) or set()
+                known_ips = set(entry['ip'] for entry in found.values())
+                new_ips = [unit.ip_address for unit in discovered if unit.ip_address not in known_ips]
+                for entry in pool.map(lambda ip: SonosUtils.probe_unit(ip, self.probe_timeout), new_ips):
+                    if entry is not None:
+                        # if a unit has moved this replaces its old address
+                        found[entry['uid']] = entry
+            finally:
+                if self.runtime is None:
+                    pool.shutdown(wait=False)
+            if not found:
+                print("Could not find any sonos units, keeping the saved ones")
+                return
+            topology = sorted(found.values(), key=lambda entry: entry['name'])
+            units = [soco.SoCo(entry['ip']) for entry in topology]
+            # one call gets the groups for the whole household
+            coordinators = {}
+            try:
+                for group in units[0].all_groups:
+                    for member in group.members:
+                        coordinators[member.ip_address] = group.coordinator.uid
+            except Exception as e:
+                print("Could not get sonos groups:", e)
+            for entry, unit in zip(topology, units):
+                entry['group'] = coordinators.get(entry['ip'])
+                self.zone_state.update(unit, player_name=entry['name'])
+            # swap in the new lists, readers see either the old list or the new one
+            self.topology = topology
+            self.units = units
+            self.number_of_units = len(units)
+            active = self.cached_unit(self.active_unit_name)
+            if active is not None and active is not self.active_unit:
+                print(self.active_unit_name, "has moved to", active.ip_address)
+                self.active_unit = active
+            self.save_units(topology)
+            print("Refreshed sonos units in", round(time.time() - start_time, 2), "s")
+            self.print_units()
+        except Exception as e:
+            print("Could not refresh sonos units:", e)
+        finally:
+            self.refreshing.release()
+
+
+class QueueMirror:
+    """
+    Our own copy of the active unit's queue, so the jukebox can tell what is queued, where, and what plays next
+    without asking the sonos.
+
+    Kept up to date by the WallboxPlayer telling us what it adds and clears, and by the ZoneStateCache; the track
+    number playing comes from AVTransport events, and if the number of tracks the sonos reports doesn't match ours
+    (ie someone changed the queue with the phone app) we read the whole queue again in the background.
+
+    Every question is answered from dictionaries, no network calls:
+        - length            number of tracks in the queue
+        - waiting           if a uri is in the queue after the track playing now
+        - position          where a uri is in the queue
+        - next_up           the track after the one playing now
+        - upcoming          the next few tracks after the one playing now
+    """
+
+    def __init__(self, unit, zone_state, runtime = None, settle = 3):
+        """
+        :param unit:        the sonos unit whose queue we mirror
+        :type unit:         soco object
+        :param zone_state:  ZoneStateCache, for the track number playing and the number of tracks in the queue
+        :type zone_state:   object
+        :param runtime:     SonosRuntime.Runtime to read the queue on, if None we use a thread
+        :type runtime:      object
+        :param settle:      seconds after we change the queue before we trust the length the sonos reports
+        :type settle:       float
+        """
+        self.unit = unit
+        self.zone_state = zone_state
+        self.runtime = runtime
+        self.settle = settle
+        self.lock = threading.Lock()
+        self.items = []                 # (uri, title, artist) for each track in the queue, in order
+        self.positions = {}             # uri: list of positions (0 is the first track) it is at
+        self.playing = 0                # position of the track playing, 0 is the first track
+        self.changed_time = 0           # time of our last change to the queue
+        self.syncing = threading.Lock() # only one read of the queue at a time
+        zone_state.add_listener('queue_position', self.position_changed)
+        zone_state.add_listener('queue_length', self.length_changed)
+
+    def clear(self):
+        with self.lock:
+            self.items = []
+            self.positions = {}
+            self.playing = 0
+            self.changed_time = time.time()
+
+    def add(self, entries):
+        """
+        Adds tracks to the end of the mirror, after we have added them to the queue.
+
+        :param entries:     (uri, title, artist) for each track, in queue order
+        :type entries:      list
+        """
+        with self.lock:
+            for entry in entries:
+                self.positions.setdefault(entry[0], []).append(len(self.items))
+                self.items.append(entry)
+            self.changed_time = time.time()
+
+    def length(self):
+        return len(self.items)
+
+    def position(self, uri):
+        """
+        :return:    position of the first time uri is in the queue (0 is the first track), None if it isn't
+        :rtype:     int
+        """
+        with self.lock:
+            positions = self.positions.get(uri)
+            return positions[0] if positions else None
+
+    def waiting(self, uri):
+        """
+        :return:    True if uri is in the queue after the track playing now
+        :rtype:     bool
+        """
+        with self.lock:
+            positions = self.positions.get(uri)
+            return bool(positions) and positions[-1] > self.playing
+
+    def next_up(self):
+        """
+        :return:    (uri, title, artist) of the track after the one playing, None if it is the last one
+        :rtype:     tuple
+        """
+        with self.lock:
+            if self.playing + 1 < len(self.items):
+                return self.items[self.playing + 1]
+        return None
+
+    def upcoming(self, count):
+        """
+        :return:    (uri, title, artist) of up to count tracks after the one playing
+        :rtype:     list
+        """
+        with self.lock:
+            return self.items[self.playing + 1:self.playing + 1 + count]
+
+    def position_changed(self, unit, position):
+        # called by the ZoneStateCache, position starts at 1.  None if the unit isn't playing from the queue
+        if position is not None and unit.ip_address == self.unit.ip_address:
+            self.playing = position - 1
+
+    def length_changed(self, unit, length):
+        # called by the ZoneStateCache; if the queue isn't what we think it is, read it again
+        if unit.ip_address != self.unit.ip_address or length == len(self.items):
+            return
+        if time.time() - self.changed_time < self.settle:
+            # our own change hasn't got there yet
+            return
+        self.resync_later()
+
+    def resync_later(self):
+        if self.runtime is not None:
+            self.runtime.call_from_thread(self.resync)
+        else:
+            sync_thread = threading.Thread(target=self.resync, daemon=True)
+            sync_thread.start()
+
+    def resync(self):
+        """
+        Reads the whole queue from the sonos, a page at a time, and replaces the mirror with it.
+        """
+        if not self.syncing.acquire(blocking=False):
+            return
+        try:
+            start_time = time.time()
+            items = []
+            positions = {}
+            for item in SonosUtils.browse_pages(self.unit, "Q:0"):
+                uri = item.resources[0].uri if item.resources else ''
+                positions.setdefault(uri, []).append(len(items))
+                items.append((uri, item.title, getattr(item, 'creator', '')))
+            with self.lock:
+                self.items = items
+                self.positions = positions
+            print("Read queue,", len(items), "tracks in", round(time.time() - start_time, 2), "s")
+        except Exception as e:
+            print("Could not read the queue:", e)
+        finally:
+            self.syncing.release()
+
+
+class SelectionPlan:
+    """
+    Everything needed to play one wallbox selection, worked out when the page set is loaded so playing a selection is
+    just sending the sonos commands.  The didl metadata is made here once, instead of every time the selection is
+    played.
+
+    A track sonos gives no resources for (ie it isn't available any more) has no uri, uri is None; it can't be played,
+    the rest of the page set can.
+    """
+
+    def __init__(self, track):
+        """
+        :param track:   the selection, from SonosUtils.make_pageset_tracklist
+        :type track:    dict
+        """
+        self.type = track['type']
+        self.song_title = track['song_title']
+        self.artist = track['artist']
+        # for the play history
+        self.title = track['title']
+        self.source = track['source']
+        self.letter_number = track.get('letter_number')
+        if self.type == 'sonos_favorites':
+            self.uri = track['uri']
+            self.meta = track['meta']
+        else:
+            # playlists and playlist tracks are added to the queue
+            resources = track['ddl_item'].resources
+            self.uri = resources[0].uri if resources else None
+            self.meta = to_didl_string(track['ddl_item'])
+        if self.uri is None:
+            print("Wallbox selection", self.letter_number, self.title, "has no uri, it can't be played")
+
+
+class PagesetSnapshot:
+    """
+    One wallbox page set, resolved and ready to play.  Never changed after it is made; when a page set changes a new
+    snapshot is made and swapped in, so anything reading a snapshot always sees a whole page set.
+    """
+
+    def __init__(self, pageset_id, name, wallbox_page_set):
+        """
+        :param pageset_id:          RFID tag of the page set
+        :type pageset_id:           str
+        :param name:                name of the page set
+        :type name:                 str
+        :param wallbox_page_set:    the "tracks" and "playlists" from SonosUtils.make_pageset_tracklist
+        :type wallbox_page_set:     dict
+        """
+        self.pageset_id = pageset_id
+        self.name = name
+        self.tracks = tuple(types.MappingProxyType(track) for track in wallbox_page_set['tracks'])
+        self.playlists = tuple(wallbox_page_set['playlists'])
+        # what to send to the sonos for each selection
+        self.plans = tuple(SelectionPlan(track) for track in wallbox_page_set['tracks'])
+        # the playlists this page set takes tracks from, so we know which library changes affect it
+        self.playlist_ids = tuple(playlist_id for playlist_id in wallbox_page_set.get('playlist_ids') or ()
+                                  if playlist_id is not None)
+
+    def plan(self, track_number):
+        return self.plans[track_number]
+
+    def plan_type(self, track_number):
+        """
+        :return:    the type of a selection, None if the page set doesn't have that many selections
+        :rtype:     str
+        """
+        return self.plans[track_number].type if track_number < len(self.plans) else None
+
+
+class LazyPageset:
+    """
+    A wallbox page set that is resolved a section at a time, the first time a selection in the section is played, for
+    slow controllers (ie a pi zero) where resolving every page set up front takes too long.  Making one is just
+    reading the json file, so a page swap takes milliseconds; the first press in a section pays for that section only
+    (the favorites, the list of playlists, or one playlist's tracks), after that the section is kept.
+
+    Has the same plan and plan_type methods as PagesetSnapshot.  The selections of a section are where the json file
+    says the section is (its number of selections, from start_list / end_list or start_label / end_label), so a
+    playlist shorter than its section leaves empty selections instead of moving the sections after it.
+    """
+
+    def __init__(self, pageset_id, unit):
+        """
+        :param pageset_id:      RFID tag of the page set
+        :type pageset_id:       str
+        :param unit:            sonos unit to get the library from
+        :type unit:             soco object
+        """
+        page_set = SonosUtils.load_page_set(pageset_id)
+        self.pageset_id = pageset_id
+        self.name = page_set['page_set_name']
+        self.unit = unit
+        self.sections = page_set['sections']
+        self.starts = []                # first selection of each section
+        start = 0
+        for section in self.sections:
+            self.starts.append(start)
+            start += SonosUtils.section_size(section)
+        self.size = start
+        self.resolved = {}              # section index: (tracks, plans, playlist id)
+        self.library = {}               # 'favorites' and 'playlists', got the first time a section needs them
+        self.lock = threading.Lock()
+
+    def section_of(self, track_number):
+        """
+        :return:    index of the section the selection is in, None if it isn't in one
+        :rtype:     int
+        """
+        if not 0 <= track_number < self.size:
+            return None
+        return bisect.bisect_right(self.starts, track_number) - 1
+
+    def plan_type(self, track_number):
+        section = self.section_of(track_number)
+        return self.sections[section]['type'] if section is not None else None
+
+    def plan(self, track_number):
+        """
+        :return:    the plan for a selection, resolving its section first if it hasn't been
+        :rtype:     SelectionPlan
+        """
+        section = self.section_of(track_number)
+        if section is None:
+            raise IndexError("no selection " + str(track_number) + " in page set " + self.name)
+        plans = self.resolve(section)[1]
+        offset = track_number - self.starts[section]
+        if offset >= len(plans):
+            raise IndexError("no selection " + str(track_number) + " in page set " + self.name)
+        return plans[offset]
+
+    def resolve(self, section):
+        resolved = self.resolved.get(section)
+        if resolved is not None:
+            return resolved
+        with self.lock:
+            resolved = self.resolved.get(section)
+            if resolved is not None:
+                # resolved while we waited for the lock
+                return resolved
+            start_time = time.time()
+            section_type = self.sections[section]['type']
+            if section_type == 'sonos_favorites' and 'favorites' not in self.library:
+                self.library['favorites'] = self.unit.get_sonos_favorites()["favorites"]
+            if 'playlists' not in self.library:
+                self.library['playlists'] = self.unit.music_library.get_music_library_information("sonos_playlists")
+            tracks, playlist_id = SonosUtils.compile_section(self.unit, self.sections[section],
+                                                             self.library.get('favorites'), self.library['playlists'])
+            for offset, track in enumerate(tracks):
+                track['letter_number'] = SonosUtils.letter_number(self.starts[section] + offset)
+            resolved = (tuple(types.MappingProxyType(track) for track in tracks),
+                        tuple(SelectionPlan(track) for track in tracks), playlist_id)
+            self.resolved[section] = resolved
+            print("Resolved", section_type, "section of", self.name, "in", round(time.time() - start_time, 2), "s")
+        return resolved
+
+    def invalidate(self, changed_ids):
+        """
+        Forgets the sections that use library containers that have changed, they are resolved again when they are next
+        played.
+
+        :param changed_ids:     ids of the containers that have changed, ie "FV:2", "SQ:", "SQ:12"
+        :type changed_ids:      set
+        """
+        with self.lock:
+            if "FV:2" in changed_ids:
+                self.library.pop('favorites', None)
+            if "SQ:" in changed_ids:
+                self.library.pop('playlists', None)
+            for section, (tracks, plans, playlist_id) in list(self.resolved.items()):
+                section_type = self.sections[section]['type']
+                if (section_type == 'sonos_favorites' and "FV:2" in changed_ids) or \
+                        (section_type != 'sonos_favorites' and "SQ:" in changed_ids) or \
+                        playlist_id in changed_ids:
+                    del self.resolved[section]
+
+    @property
+    def playlist_ids(self):
+        return tuple(resolved[2] for resolved in list(self.resolved.values()) if resolved[2] is not None)
+
+    @property
+    def tracks(self):
+        # only the sections that have been resolved, None for the others
+        tracks = [None] * self.size
+        for section, resolved in list(self.resolved.items()):
+            start = self.starts[section]
+            tracks[start:start + len(resolved[0])] = resolved[0]
+        return tuple(tracks)
+
+    @property
+    def playlists(self):
+        return tuple(self.library.get('playlists', ()))
+
 
 class WallboxPlayer:
     """
     Plays sonos tracks, main method called from SonosHW.Wallbox from GPIO threaded callback generated by the wallbox
     buttons - see Wallbox class in SonosHW for full explanation of how the wallbox interface works.
+
+    All the page sets are loaded in the background after startup and kept as PagesetSnapshots, so changing the page
+    set (RFID tag or button) just swaps which snapshot is in self.pageset.
     """
-    def __init__(self, units, display):
+    def __init__(self, units, display, updater = None, runtime = None, batch_window = 2, lazy = False,
+                 history = None):
         """
         :param units:               The Sonos units
         :type units:                object
+        :param runtime:             SonosRuntime.Runtime to send batches of jukebox tracks on, if None a
+                                    threading.Timer is used
+        :type runtime:              object
+        :param batch_window:        seconds to collect jukebox selections before adding them to the queue
+        :type batch_window:         float
+        :param lazy:                if True page sets are LazyPagesets, resolved a section at a time when they are
+                                    played, instead of all being resolved at startup
+        :type lazy:                 bool
+        :param history:             PlayHistory the selections are recorded in, if None one is made with the default
+                                    database file
+        :type history:              object
+        :param updater:             The display updater, poked when a selection is made so it checks the sonos right away
+        :type updater:              object
         :param current_track:       The current track / selection playing
         :type current_track:
         :param display:                 The display display
@@ -523,8 +1978,22 @@ class WallboxPlayer:
         self.units = units
         self.active_unit = self.units.active_unit
         self.display = display
-        self.wallbox_tracks = []
-        self.playlists = []
+        self.updater = updater
+        self.pageset = None             # the PagesetSnapshot being played
+        self.pagesets = {}              # PagesetSnapshots we have loaded, by pageset id
+        # so getting a selection ready, playing it and sending the batch don't overlap.  Reentrant, play_selection
+        #   sends the batch itself when the queue isn't playing
+        self.selection_lock = threading.RLock()
+        self.runtime = runtime
+        self.batch_window = batch_window
+        self.batch = []                 # plans of jukebox selections waiting to be added to the queue, in press order
+        self.batch_lock = threading.Lock()
+        # what is in the queue, so the jukebox doesn't have to ask the sonos
+        self.queue_mirror = QueueMirror(self.active_unit, self.units.zone_state, runtime=runtime)
+        self.queue_mirror.resync_later()
+        self.loading = threading.Lock() # so we only load one page set at a time
+        self.lazy = lazy
+        self.history = history if history is not None else PlayHistory.PlayHistory()
 
         #make list of available wallbox page sets
         json_file = open("wallbox_pages_nocomments.json", "r")
@@ -542,13 +2011,26 @@ class WallboxPlayer:
         self.last_pageset_id = self.get_pageset()
         # get the matching set of wallbox tracks
         self.get_wallbox_tracks(self.last_pageset_id)
+        if not lazy:
+            # then load the rest in the background
+            preload_thread = threading.Thread(target=self.preload_pagesets, daemon=True)
+            preload_thread.start()
+
+    @property
+    def wallbox_tracks(self):
+        return self.pageset.tracks if self.pageset is not None else ()
+
+    @property
+    def playlists(self):
+        return self.pageset.playlists if self.pageset is not None else ()
 
     def play_selection(self,track_number):
         '''
         New method for playing tracks, this is called when the wallbox selection is made.
-        it gets track info from the class attribute self.wallbox_tracks, which is
-        set by the get_wallbox_tracks method in SonosUtils. that is called by the read_page_rfid class in SonosHW, this
+        it gets the selection's SelectionPlan from the current page set, self.pageset, which is
+        set by the get_wallbox_tracks method. that is called by the read_page_rfid class in SonosHW, this
         in turn is triggered by a limit switch when a new page set is loaded.  It is also called when the program starts.
+        Only the sonos commands that are needed are sent, with the uri and metadata from the plan.
 
         :param: track_number:           The selected track from the wallbox
         :type: track_number:            int
@@ -556,61 +2038,216 @@ class WallboxPlayer:
 
         '''
 
-        # get information about the track
-        track = self.wallbox_tracks[track_number]
-        type = track["type"]
-        song_title = track["song_title"]
-        artist = track["artist"]
-        play_status = self.active_unit.get_current_transport_info()
-
-        if type == 'sonos_favorites':
-            #play a sonos favorite
-            uri = track['uri']
-            meta = track['meta']
-            print("playing sonos favorite",uri, meta)
-            #need both uri and meta to play a favorite siris xm or internet station
-            self.active_unit.play_uri(uri, meta)
-            self.display.display_text(song_title,artist)
-            # set flag so rest of def knows what is playing
-            self.playing = 'radio'
-            self.display.display_text("Now Playing Favorite", track('song_title'))
-
-        if type == 'sonos_playlists':
-            self.active_unit.stop()
-            self.active_unit.clear_queue()
-            playlist = self.playlists[track['playlist_number']]
-            print("playing playlist: ",playlist)
-            self.active_unit.add_to_queue(playlist)
-            # start playing at a random location in the playlist, might not need this?
-            queue_length = self.active_unit.queue_size
-            starting_song = random.randint(1, queue_length - 1)
-            self.active_unit.play_from_queue(starting_song)
-            # set playmode to shuffle, this also repeats the playlist
-            self.active_unit.play_mode = 'SHUFFLE'
-            self.display.display_text("Now Playing Playlist:",song_title)
-            self.playing = 'playlist'
-
-        if type == 'sonos_playlist_tracks':
-            time_since_last_added = time.time() - self.last_added_time
-            if not self.playing == 'jukebox':
-                # if radio or playlist was playing assume that we want  to start a new queue
-                self.active_unit.stop()
-                self.active_unit.clear_queue()
-                self.active_unit.add_to_queue(track['ddl_item'],position=0)
-                self.active_unit.play_from_queue(0)
-                self.active_unit.play_mode = "NORMAL"
-                self.display.display_text("Now Playing Jukebox",track['song_title'],track['artist'])
-
-            elif self.playing == "jukebox":
-                self.active_unit.add_to_queue(track['ddl_item'], position=0)
-                if not play_status =='PLAYING' or not play_status == "TRANSITIONING":
-                   #if queue is  not playing then add the track and start playing
-                    self.active_unit.play()
-                self.display.display_text("Added to Queue", track['song_title'], track['artist'])
-            self.playing = "jukebox"
-            self.save_played_song()
-            # save the current song to a file of played song, for future analysis!
+        with self.selection_lock:
+            if self.updater is not None:
+                self.updater.poke()
+            # use the same page set for the whole selection, even if it is swapped while we are playing it
+            pageset = self.pageset
+            # everything needed to play the selection was worked out when the page set was loaded
+            plan = pageset.plan(track_number)
+            if plan.uri is None:
+                self.display.display_text("Can't play", plan.song_title, plan.artist)
+                return
+            unit = self.active_unit
+            transport = unit.avTransport
+            batched = False
+            duplicate = False
+
+            if plan.type == 'sonos_favorites':
+                #play a sonos favorite
+                print("playing sonos favorite", plan.uri)
+                #need both uri and meta to play a favorite siris xm or internet station
+                transport.SetAVTransportURI([("InstanceID", 0), ("CurrentURI", plan.uri),
+                                             ("CurrentURIMetaData", plan.meta)])
+                transport.Play([("InstanceID", 0), ("Speed", 1)])
+                # set flag so rest of def knows what is playing
+                self.playing = 'radio'
+                self.display.display_text("Now Playing Favorite", plan.song_title)
+
+            elif plan.type == 'sonos_playlists':
+                print("playing playlist: ", plan.song_title)
+                # set playmode to shuffle, this also repeats the playlist
+                self.start_new_queue(transport, 'SHUFFLE')
+                # sonos tells us how many tracks it added, so we don't have to ask for the queue size
+                tracks_added = self.add_to_queue(transport, plan)
+                # start playing at a random location in the playlist, might not need this?
+                if tracks_added > 1:
+                    starting_song = random.randint(1, tracks_added - 1)
+                    transport.Seek([("InstanceID", 0), ("Unit", "TRACK_NR"), ("Target", starting_song + 1)])
+                transport.Play([("InstanceID", 0), ("Speed", 1)])
+                self.display.display_text("Now Playing Playlist:", plan.song_title)
+                self.playing = 'playlist'
+
+            elif plan.type == 'sonos_playlist_tracks':
+                if not self.playing == 'jukebox':
+                    # if radio or playlist was playing assume that we want  to start a new queue
+                    self.start_new_queue(transport, 'NORMAL')
+                    self.add_to_queue(transport, plan)
+                    transport.Play([("InstanceID", 0), ("Speed", 1)])
+                    self.display.display_text("Now Playing Jukebox", plan.song_title, plan.artist)
+
+                elif self.queue_mirror.waiting(plan.uri) or self.in_batch(plan):
+                    # it's already waiting to be played, don't add it again
+                    print(plan.song_title, "is already in the queue at", self.queue_mirror.position(plan.uri))
+                    self.display.display_text("Already in Queue", plan.song_title, plan.artist)
+                    batched = True
+                    duplicate = True
+
+                elif self.playing == "jukebox":
+                    play_status = self.units.zone_state.transport_state(unit, max_age=5)
+                    # collect selections made close together and add them all at once.  If the queue is not
+                    # playing, don't wait, add it and start playing
+                    self.add_to_batch(plan, 0 if play_status not in ('PLAYING', 'TRANSITIONING') else None)
+                    batched = True
+                    self.display.display_text("Added to Queue", plan.song_title, plan.artist)
+                self.playing = "jukebox"
+            if not duplicate:
+                # save the selection to the play history, for future analysis!
+                self.save_played_song(plan, pageset)
+            if not batched:
+                self.units.zone_state.update(unit, transport_state="PLAYING")
+
+    def prepare_selection(self):
+        """
+        Called at the first pulse from the wallbox, about 3 seconds before we know the selection.  Gets what
+        play_selection will need from the sonos now, so it doesn't have to wait for it; the transport state of the
+        active unit, and its uid for the queue uri.
+        """
+        try:
+            self.units.zone_state.read_live(self.active_unit, 'transport_state')
+            self.queue_uri()
+        except Exception as e:
+            print("Could not get ready for wallbox selection:", e)
+
+    def prepare_letter(self, letter):
+        """
+        Called when the letter is known, while the numbers are still coming in.  The selection will be one of the ten
+        with this letter, so the sections they are in are resolved now (lazy page sets) and the uid for the queue uri is
+        got, so play_selection doesn't have to wait for them.
 
+        Nothing is changed on the sonos here; the train could still be noise, or never finish, and the music that is
+        playing must not be stopped until we know the whole selection.
+
+        :param letter:      letter index, 0 - 19
+        :type letter:       int
+        """
+        with self.selection_lock:
+            pageset = self.pageset
+            if pageset is None or not 0 <= letter < 20:
+                return
+            if isinstance(pageset, LazyPageset):
+                # resolve the sections the selection could be in while the numbers are coming in
+                for section in set(pageset.section_of(track_number) for track_number in range(letter, 200, 20)):
+                    if section is not None:
+                        try:
+                            pageset.resolve(section)
+                        except Exception as e:
+                            print("Could not resolve section:", e)
+            try:
+                self.queue_uri()
+            except Exception as e:
+                print("Could not get ready for wallbox selection:", e)
+
+    def start_new_queue(self, transport, play_mode):
+        """
+        Clears the queue and makes it the source for the active unit.  Clearing the queue stops it, so we don't need
+        to stop first.  The play mode is set before anything is added so it starts in the right mode.
+        """
+        transport.RemoveAllTracksFromQueue([("InstanceID", 0)])
+        self.queue_mirror.clear()
+        with self.batch_lock:
+            # selections waiting to be added were for the old queue
+            self.batch = []
+        transport.SetPlayMode([("InstanceID", 0), ("NewPlayMode", play_mode)])
+        transport.SetAVTransportURI([("InstanceID", 0), ("CurrentURI", self.queue_uri()),
+                                     ("CurrentURIMetaData", "")])
+
+    def add_to_batch(self, plan, window = None):
+        """
+        Adds a jukebox selection to the batch, and schedules sending the batch if it is the first selection in it.
+
+        :param plan:        the selection
+        :type plan:         SelectionPlan
+        :param window:      seconds to wait before sending, None for batch_window
+        :type window:       float
+        """
+        with self.batch_lock:
+            self.batch.append(plan)
+            if len(self.batch) > 1:
+                # already scheduled
+                return
+        window = self.batch_window if window is None else window
+        if window == 0:
+            self.send_batch()
+        elif self.runtime is not None:
+            self.runtime.call_later(window, self.send_batch)
+        else:
+            timer = threading.Timer(window, self.send_batch)
+            timer.daemon = True
+            timer.start()
+
+    def in_batch(self, plan):
+        with self.batch_lock:
+            return plan in self.batch
+
+    def send_batch(self):
+        """
+        Adds the batch of jukebox selections to the end of the queue in the order they were pressed, with one
+        AddMultipleURIsToQueue for every 16 selections (the most sonos takes at once), then starts the queue if it is
+        not playing.  Holds the selection lock, so batches are added in order and a selection that starts a new queue
+        can't clear it while we are adding to it.
+        """
+        with self.selection_lock:
+            with self.batch_lock:
+                batch = self.batch
+                self.batch = []
+            if not batch:
+                return
+            if self.playing != 'jukebox':
+                # a favorite or playlist was selected after these, it replaced the queue
+                print("Not adding", len(batch), "selections, the queue has been replaced")
+                return
+            unit = self.active_unit
+            transport = unit.avTransport
+            try:
+                for index in range(0, len(batch), 16):
+                    chunk = batch[index:index + 16]
+                    transport.AddMultipleURIsToQueue([("InstanceID", 0), ("UpdateID", 0),
+                                                      ("NumberOfURIs", len(chunk)),
+                                                      ("EnqueuedURIs", " ".join(plan.uri for plan in chunk)),
+                                                      ("EnqueuedURIsMetaData", " ".join(plan.meta for plan in chunk)),
+                                                      ("ContainerURI", ""), ("ContainerMetaData", ""),
+                                                      ("DesiredFirstTrackNumberEnqueued", 0), ("EnqueueAsNext", 0)])
+                    self.queue_mirror.add([(plan.uri, plan.song_title, plan.artist) for plan in chunk])
+                print("Added", len(batch), "selections to the queue")
+                if self.units.zone_state.transport_state(unit, max_age=5) not in ('PLAYING', 'TRANSITIONING'):
+                    #if queue is  not playing then start playing
+                    transport.Play([("InstanceID", 0), ("Speed", 1)])
+                    self.units.zone_state.update(unit, transport_state="PLAYING")
+            except Exception as e:
+                print("Could not add selections to the queue:", e)
+                self.display.display_text("Could not add", str(len(batch)) + " selections")
+
+    def add_to_queue(self, transport, plan):
+        """
+        Adds a selection to the end of the queue, with the uri and metadata from its plan.
+
+        :return:    number of tracks added
+        :rtype:     int
+        """
+        response = transport.AddURIToQueue([("InstanceID", 0), ("EnqueuedURI", plan.uri),
+                                            ("EnqueuedURIMetaData", plan.meta),
+                                            ("DesiredFirstTrackNumberEnqueued", 0), ("EnqueueAsNext", 0)])
+        if plan.type == 'sonos_playlist_tracks':
+            self.queue_mirror.add([(plan.uri, plan.song_title, plan.artist)])
+        else:
+            # a whole playlist, we don't know its tracks so read the queue in the background
+            self.queue_mirror.resync_later()
+        return int(response["NumTracksAdded"])
+
+    def queue_uri(self):
+        # uri to play the active unit's queue.  The uid is looked up once then kept by soco
+        return "x-rincon-queue:" + self.active_unit.uid + "#0"
 
     def song_title(self,track_selection):
         # function to strip out song title from currently playing track
@@ -620,26 +2257,94 @@ class WallboxPlayer:
 
     def get_wallbox_tracks(self,page_set):
         '''
-        Opens wallbox_pages.json configuration file, and makes a dictionary of 200 wallbox selections, sets class
-        attribute wallbox_tracks to match loaded wallbox pages.
+        Changes to a page set.  Swaps in the preloaded snapshot of the page set, or loads it now if it has not been
+        preloaded yet.  Called by the RFID reader, the page set button, and when the class is initialized.
 
-        Also runs when class is initialized
+        :param page_set:    RFID tag of the page set
+        :type page_set:     str
         :return:
         :rtype:
         '''
         print("getting wallbox tracks ", page_set)
-        wallbox_pages =  SonosUtils.make_pageset_tracklist(page = page_set)
-        # make_pageset tracklist returns a tuple, first element is the tracklist, second is the name of the pageset
-        wallbox_page_set = wallbox_pages[0]
-        wallbox_page_set_name = wallbox_pages[1]
-        # get just the track information, set class attribute wallbox_tracks
-        self.wallbox_tracks = wallbox_page_set['tracks']
-        #also get playlists
-        self.playlists = wallbox_page_set['playlists']
-        print("pageset changed to:", wallbox_page_set_name)
-        self.display.display_text("New Page Set:", wallbox_page_set_name)
+        snapshot = self.pagesets.get(page_set)
+        if snapshot is None:
+            snapshot = self.load_pageset(page_set)
+        # one assignment, so play_selection sees either the old page set or the new one
+        self.pageset = snapshot
+        print("pageset changed to:", snapshot.name)
+        self.display.display_text("New Page Set:", snapshot.name)
         self.save_pageset(page_set)
 
+    def load_pageset(self, pageset_id):
+        '''
+        Resolves a page set and saves the snapshot in self.pagesets.  If it is the page set being played, it is swapped
+        in.
+
+        :param pageset_id:  RFID tag of the page set
+        :type pageset_id:   str
+        :return:            the new snapshot
+        :rtype:             PagesetSnapshot
+        '''
+        with self.loading:
+            if self.lazy:
+                snapshot = LazyPageset(pageset_id, self.active_unit)
+            else:
+                wallbox_page_set, name = SonosUtils.make_pageset_tracklist(page = pageset_id, unit = self.active_unit)
+                snapshot = PagesetSnapshot(pageset_id, name, wallbox_page_set)
+            self.pagesets[pageset_id] = snapshot
+            if self.pageset is not None and self.pageset.pageset_id == pageset_id:
+                self.pageset = snapshot
+        return snapshot
+
+    def preload_pagesets(self):
+        # load all the page sets we don't have yet, runs in the background after startup
+        start_time = time.time()
+        for pageset in self.pageset_list:
+            if pageset['id'] in self.pagesets:
+                continue
+            try:
+                self.load_pageset(pageset['id'])
+            except Exception as e:
+                print("Could not load page set", pageset['name'], ":", e)
+        print("Loaded", len(self.pagesets), "page sets in", round(time.time() - start_time, 1), "s")
+
+    def refresh_library(self, changed_ids):
+        '''
+        Updates the page sets we have loaded after the sonos library has changed.  Only the sections that use the changed
+        containers are updated, see SonosUtils.update_pageset.  Called by LibraryWatcher.
+
+        :param changed_ids:     ids of the containers that have changed, ie "FV:2", "SQ:", "SQ:12"
+        :type changed_ids:      set
+        '''
+        print("Sonos library changed:", ", ".join(sorted(changed_ids)))
+        for pageset_id in list(self.pagesets):
+            if isinstance(self.pagesets[pageset_id], LazyPageset):
+                # just forget the changed sections, they are resolved again when they are played
+                self.pagesets[pageset_id].invalidate(changed_ids)
+                continue
+            try:
+                with self.loading:
+                    result = SonosUtils.update_pageset(pageset_id, changed_ids, self.active_unit)
+                    if result is None:
+                        continue
+                    wallbox_page_set, name = result
+                    snapshot = PagesetSnapshot(pageset_id, name, wallbox_page_set)
+                    self.pagesets[pageset_id] = snapshot
+                    if self.pageset is not None and self.pageset.pageset_id == pageset_id:
+                        self.pageset = snapshot
+            except Exception as e:
+                print("Could not update page set", pageset_id, ":", e)
+
+    def library_ids(self):
+        """
+        :return:    the library containers the loaded page sets use
+        :rtype:     set
+        """
+        ids = {"FV:2", "SQ:"}
+        for snapshot in list(self.pagesets.values()):
+            ids.update(snapshot.playlist_ids)
+        return ids
+
     def select_wallbox_pageset(self):
         '''
         Uses the black pushbutton to manually select the pageset
@@ -689,16 +2394,124 @@ class WallboxPlayer:
         file.close()
         return pageset_id
 
-    def save_played_song(self):
-        # save info about the song to a file, so we can analyze how often songs are played
-        # open a file
-        print("saving played song information")
-        file = open("played_songs.txt", "a+")
-        track_info = self.active_unit.get_current_track_info()
-        title = track_info["title"]
-        artist = track_info["artist"]
-        album_art = track_info["album_art"]
-        playlist = self.pageset_list[self.pageset_number]['name']
-        data = title+";"+artist+";"+playlist+";"+album_art+"/n"
-        file.write(data)
-        file.close()
+    def save_played_song(self, plan, pageset):
+        """
+        Saves the selection to the play history, so we can analyze how often songs are played.  Everything comes from
+        the selection's plan, and the history is written in the background, so this doesn't go to the network or the
+        disk.
+
+        :param plan:        the selection played
+        :type plan:         SelectionPlan
+        :param pageset:     the page set it is from
+        :type pageset:      PagesetSnapshot
+        """
+        self.history.record(title=plan.title, artist=plan.artist, source=plan.source, type=plan.type, uri=plan.uri,
+                            letter_number=plan.letter_number, pageset=pageset.name,
+                            unit=self.units.active_unit_name)
+
+
+class LibraryWatcher:
+    """
+    Watches the sonos library (favorites and sonos playlists) for changes, and tells the WallboxPlayer which containers
+    have changed so it can update just the selections that use them.
+
+    Uses the update ids of the content directory containers; each container (FV:2 favorites, SQ: the list of sonos
+    playlists, SQ:12 a playlist) has an id that changes whenever the container is changed.  Sonos sends the ids of
+    changed containers in ContentDirectory events (ContainerUpdateIDs), if we can't get events we poll the update
+    ids of the containers the page sets use every poll_interval seconds.
+    """
+
+    def __init__(self, player, poll_interval = 60, use_events = True, runtime = None):
+        """
+        :param player:          the WallboxPlayer whose page sets we keep up to date
+        :type player:           object
+        :param poll_interval:   seconds between checks of the library
+        :type poll_interval:    int
+        :param use_events:      if True subscribe to ContentDirectory events, only poll if that doesn't work
+        :type use_events:       bool
+        :param runtime:         SonosRuntime.Runtime to do the checks on, if None we use our own thread
+        :type runtime:          object
+        """
+        self.player = player
+        self.poll_interval = poll_interval
+        self.use_events = use_events
+        self.runtime = runtime
+        self.update_ids = {}            # container id: last update id we saw
+        self.subscription = None
+        if runtime is not None:
+            runtime.every(poll_interval, self.check, first_delay=poll_interval, name='library watcher')
+        else:
+            watcher_thread = threading.Thread(target=self.watch, daemon=True)
+            watcher_thread.start()
+
+    def watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.check()
+            except Exception as e:
+                print("Error checking sonos library:", e)
+
+    def check(self):
+        """
+        Makes sure we are getting events, otherwise polls the update ids of the containers the page sets use.
+        """
+        if self.use_events and self.subscribe():
+            return
+        state = SonosUtils.get_library_state(self.player.active_unit,
+                                             [container for container in self.player.library_ids()
+                                              if container not in ("FV:2", "SQ:")])
+        self.containers_changed(state)
+
+    def subscribe(self):
+        """
+        :return:    True if we are getting ContentDirectory events
+        :rtype:     bool
+        """
+        if self.subscription is not None and self.subscription.is_subscribed:
+            return True
+        try:
+            self.subscription = self.player.active_unit.contentDirectory.subscribe(auto_renew=True)
+            self.subscription.callback = self.event_received
+            return True
+        except Exception as e:
+            print("Could not subscribe to sonos library events, polling instead:", e)
+            self.subscription = None
+            return False
+
+    def event_received(self, event):
+        """
+        Called by soco when there is a ContentDirectory event.  ContainerUpdateIDs is a list of container ids and their
+        update ids, ie "FV:2,18,SQ:,40,SQ:12,7"
+        """
+        update_ids = event.variables.get('container_update_i_ds')
+        if not update_ids:
+            return
+        values = update_ids.split(',')
+        self.containers_changed(dict(zip(values[0::2], values[1::2])))
+
+    def containers_changed(self, state):
+        """
+        Compares the update ids with the ones we saw last time, tells the player about the containers that changed.
+        The first time we see a container we just remember its update id, the page sets were checked when they were
+        loaded.
+
+        :param state:   container id: update id
+        :type state:    dict
+        """
+        changed = set()
+        for container, update_id in state.items():
+            if not (container == "FV:2" or container.startswith("SQ:")):
+                # music library shares etc, not used by the wallbox
+                continue
+            last_id = self.update_ids.get(container)
+            self.update_ids[container] = update_id
+            if last_id is not None and last_id != update_id:
+                changed.add(container)
+        if changed:
+            # don't hold up soco's event thread while we browse
+            if self.runtime is not None:
+                self.runtime.call_from_thread(self.player.refresh_library, changed)
+            else:
+                refresh_thread = threading.Thread(target=self.player.refresh_library, args=(changed,), daemon=True)
+                refresh_thread.start()
@@ -21,6 +21,7 @@ import time
 import threading
 import gpiozero
 import RFIDTagReader
+import WallboxDecoder
 
 class RotaryEncoder:
     """
@@ -695,39 +696,64 @@ class WallBox:
     Sometimes we get a noise spike about 500ms after the last pulse,
     it is very short - 1-2 ms, so we have to remove this in software, as the pi will read it.
 
+    The train is finished when there has been no valid pulse for QUIET seconds (a bit longer than the gap between the
+    letters and numbers), so a short selection like A1 is played as soon as it ends instead of waiting for the longest
+    possible train.  MAX_TRAIN is a safety cap in case the pulses never stop.  A train with no letter pulses is noise
+    (ie the spike after the last pulse) and is ignored; an edge on its own doesn't even start a train.
+
     Definitions:
         - pulse beginning:      the start of a pulse, falling from 3.3v to 0
         - pulse:                a single pulse from falling edge to next falling edge
 
+    The decoding is done by WallboxDecoder.PulseDecoder, which has no hardware in it, so it can be tested off the pi
+    (see wallbox_bench.py).  This class gets the edges from the GPIO pin and times the end of the train.
+
     Methods:
         - pulse_count           Threaded callback when buttons are pressed on the wallbox. Counts the letters and
-                                numbers pressed
-        - wait_for_pulses_end   loops waiting for last pulse from wallbox.
+                                numbers pressed.  Calls on_start when a train starts and on_letter when the letter is
+                                known, so the selection can be got ready while the numbers are still coming in
+        - wait_for_pulses_end   loops waiting for last pulse from wallbox, when we don't have a runtime
+        - check_train_end       ends the train if it has been quiet long enough, otherwise checks again later
         - convert_wb            converts the letter and number selection into a number 0- 199
     """
 
-    # constants for detecting and decoding wallbox pulses
-    LETTER_MAX = .275       # minimum and maximum gap between letters and numbers
-    LETTER_MIN = .260
-    PULSE_MAX = .085        # maximum duration of a letter or number pulse
-    PULSE_MIN = .070        # minimum duration of a letter or number pulse
     DEBOUNCE = 20           # don't need a big debounce - maybe not at all, signal is clean
 
-    def __init__(self, pin, callback):
+    def __init__(self, pin, callback, runtime = None, on_start = None, on_letter = None,
+                 quiet = WallboxDecoder.PulseDecoder.QUIET, max_train = WallboxDecoder.PulseDecoder.MAX_TRAIN,
+                 trace_file = None):
         """
         :param pin:         GPIO pin for the wallbox input.
         :type pin:          int
         :param callback:    name of the method that does something with the wallbox pulses
         :type callback:     object (method name)
+        :param runtime:     SonosRuntime.Runtime used to time the end of the pulses, if None we start a thread for
+                            each train of pulses
+        :type runtime:      object
+        :param on_start:    called with no parameters when a train starts, at the end of the first pulse (an edge on
+                            its own is not a train).  Called on the GPIO thread, so it must return quickly (ie use
+                            Runtime.bridge)
+        :type on_start:     function
+        :param on_letter:   called with the letter index (0-19) when the letters are finished, before the numbers
+                            start.  Called on the GPIO thread.
+        :type on_letter:    function
+        :param quiet:       seconds with no pulses before the train is finished
+        :type quiet:        float
+        :param max_train:   seconds after the first pulse that the train is finished, even if the pulses haven't stopped
+        :type max_train:    float
+        :param trace_file:  if not None, the edges of each train are added to this file, see WallboxDecoder
+        :type trace_file:   str
         """
         self.pin = pin                      # used to be gpio 20, will change
         self.callback = callback
-        self.first_pulse = True
-        self.last_pulse_start = 0
-        self.counting_numbers = False
-        self.letter_count = 0
-        self.number_count = 0
-        self.pulse_start_time = 0
+        self.on_start = on_start
+        self.on_letter = on_letter
+        self.runtime = runtime
+        self.decoder = WallboxDecoder.PulseDecoder(quiet, max_train)
+        self.trace_file = trace_file
+        self.edges = []                     # times of the edges in this train, for the trace file
+        self.last_traced_edge = None        # last edge written to the trace file, so we can save the gap
+        self.lock = threading.Lock()        # pulses are counted on the GPIO thread, the end is found on another
 
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
@@ -745,97 +771,120 @@ class WallBox:
         :param cb:      the GPIO pin that triggered the callback.  passed automatically from the gpio event detect
         :type cb:       integer
         """
-        # get the time the pulse started
-        self.pulse_start_time = time.time()
-        # calculate the duration from the last pulse
-        duration = time.time() - self.last_pulse_start
-        print('duration: ', round(duration, 3))
-
-
-        if self.first_pulse:
-            # if it is the first pulse then don't count it yet, just record the time of the pulse,
-            print('******************* PULSES STARTED ***********************')
-            # reset first pulse flag
-            self.first_pulse = False
-            # run method to wait for the end of pulse train in separate thread
-            pulses_end = threading.Thread(target=self.wait_for_pulses_end)
-            pulses_end.start()
-            # next check to see if it is a valid pulse, ie not noise, or the very long pulse between sets of pulses
-            # if either a regular pulse or the gap between letters and numbers then start (or continue) counting
-            # this filters out any short duration noise spikes, which usually occur after pulses are finished.            
-        elif self.LETTER_MAX > duration > self.LETTER_MIN or self.PULSE_MAX > duration > self.PULSE_MIN:
-            # print('valid pulse')
-            # check for gap between the letters and numbers
-            if self.LETTER_MAX > duration > self.LETTER_MIN:
-                # if it matches the letter-number gap flag that we are now counting numbers, not letters
-                self.counting_numbers = True
-                print('================Now counting numbers ====================')
-            else:
-                if not self.counting_numbers:
-                    # we are counting letters
-                    self.letter_count += 1
-                    print('Letter count: ', str(self.letter_count))
+        # get the time the pulse started.  monotonic, so NTP changing the clock can't mess up the timing
+        now = time.monotonic()
+        noise = None
+        with self.lock:
+            in_train = not self.decoder.first_pulse
+            started, letter = self.decoder.edge(now)
+            if not in_train and not started and self.edges:
+                # the edge before this one was on its own, not the start of a train
+                noise = self.edges
+                self.edges = []
+            self.edges.append(now)
+            if started:
+                print('******************* PULSES STARTED ***********************')
+                train = self.decoder.train
+                if self.runtime is not None:
+                    # have the runtime call us back when the pulses might be finished, no need for a thread
+                    self.runtime.call_later(self.decoder.quiet, self.check_train_end, train)
                 else:
-                    self.number_count += 1
-                    print('Number count: ', str(self.number_count))
-
-        # record the time of this pulse
-        self.last_pulse_start = self.pulse_start_time
+                    # run method to wait for the end of pulse train in separate thread
+                    pulses_end = threading.Thread(target=self.wait_for_pulses_end, args=(train,))
+                    pulses_end.start()
+        if noise is not None:
+            self.save_trace(None, noise)
+        # call these outside the lock, they can take a while if they are not bridged
+        if started and self.on_start is not None:
+            self.on_start()
+        if letter is not None:
+            print('================Now counting numbers ====================')
+            if self.on_letter is not None:
+                self.on_letter(letter)
         return
 
-    def wait_for_pulses_end(self):
+    def check_train_end(self, train):
         """
-        Runs in a separate thread when  wallbox pulses start.  Pulse train lasts a maximum of 3 seconds.
-        When it is finished, call whatever method that does something with the pulses.
-        Also reset class counters and flags for next train of pulses.
-        """
-
-        # wait 3.5 seconds for the set of wallbox pulses to end (3 seconds is max duration for a series of pulses)
-        time.sleep(3.5)
-        print("**************  Pulses Ended ***********")
-        print("Letter Count: ", self.letter_count)
-        print("Number Count: ", self.number_count)
+        Called by the runtime after a quiet interval.  Finishes the train if there have been no pulses since, otherwise
+        checks again when the quiet interval after the last pulse is up.
 
-        # get the number of the selection
-        selection = self.convert_wb(self.letter_count, self.number_count)
+        :param train:   number of the train of pulses we are checking
+        :type train:    int
+        """
+        with self.lock:
+            wait = self.decoder.time_to_end(time.monotonic())
+            if train != self.decoder.train or wait is None:
+                # already finished
+                return
+            if wait > 0:
+                self.runtime.call_later(wait, self.check_train_end, train)
+                return
+        self.pulses_ended(train)
+
+    def wait_for_pulses_end(self, train):
+        """
+        Runs in a separate thread when  wallbox pulses start, when we don't have a runtime.  Waits until there have
+        been no pulses for the quiet interval, then calls whatever method that does something with the pulses.
+        """
+        while True:
+            with self.lock:
+                wait = self.decoder.time_to_end(time.monotonic())
+            if not wait:
+                break
+            time.sleep(wait)
+        self.pulses_ended(train)
+
+    def pulses_ended(self, train):
+        """
+        Called when the train of pulses is finished.  Converts the pulses to a selection, resets the counters and
+        calls the method that plays the selection.
+        """
+        with self.lock:
+            if train != self.decoder.train or self.decoder.first_pulse:
+                return
+            print("**************  Pulses Ended ***********",
+                  round(time.monotonic() - self.decoder.train_start, 3), "s")
+            print("Letter Count: ", self.decoder.letter_count)
+            print("Number Count: ", self.decoder.number_count)
+            # get the number of the selection, and reset the counters for the next train
+            selection = self.decoder.end_train()
+            edges = self.edges
+            self.edges = []
+
+        self.save_trace(selection, edges)
+        if selection is None:
+            # no letters, so it was noise not a selection
+            print("No letter pulses, ignoring")
+            return
         print("wallbox selection number is: ", selection)
 
-        # reset flags and counters
-        self.first_pulse = True
-        self.letter_count = 0
-        self.number_count = 0
-        self.counting_numbers = False
-
         # call the method that processes the wallbox selection
         self.callback(selection)
         return
 
-    def convert_wb(self,letter, number):
+    def save_trace(self, selection, edges):
         """
-        Turns letter and number into a single number 0-199.
-
-        It's a base 20 system; with the letters being numbers 0-19, then the number being the "20"'s digit,
-        so we have to multply the number by 20 then add the letter to it.  Number is the first digit, letter the second,
-        although on the wallbox the letter is selected first, number second.
-
-        Pulse detect algorithm returns numbers in range 0-9, letters in range 1 - 20; we adjust letters down by one so
-        that they are in the range 0-19 (ie, 'A' is 0, not 1)
+        Adds a train to the trace file, if we are recording one.
+        """
+        if self.trace_file is None:
+            return
+        try:
+            WallboxDecoder.write_trace(self.trace_file, [(selection, edges)], mode='a',
+                                       last_edge=self.last_traced_edge)
+            self.last_traced_edge = edges[-1]
+        except OSError as e:
+            print("Could not save wallbox trace:", e)
 
-        Examples:  wallbox selection is "B3", letter is 2, number is 3 = (3*20) +  (2-1) = 61
-                   wallbox selection is "A0", letter is 1, number is 9 = (19*20) + (1-1) = 180
+    def convert_wb(self,letter, number):
+        """
+        Turns letter and number into a single number 0-199, see WallboxDecoder.PulseDecoder.convert_wb
 
-        :param letter:      Number representing the letter pressed on the wallbox (0- 19)
+        :param letter:      Number representing the letter pressed on the wallbox (1 - 20)
         :type letter:       int
         :param number:      Number representing the number key pressed on the wallbox (0-9)
         :type number:       int
         """
-
-        #  Adjust the letter and number count to get the right tracks
-        #  because we look these up by index, python indexes start at 0, so we subtract 1 from letter count
-
-        letter -= 1
-        number = (number) * 20
-        conversion = letter + number
+        conversion = self.decoder.convert_wb(letter, number)
         print("Conversion is: ", conversion)
         return conversion
 
@@ -845,43 +894,61 @@ class RFIDReader:
     loops and checks to see if the RFID tag has been read, then calls
     '''
 
-    def __init__(self,callback, port="/dev/ttyUSB0"):
+    def __init__(self,callback, port="/dev/ttyUSB0", runtime = None, read_timeout = 0.1):
         '''
         :param callback:        function to call when tag is read
         :type callback:
         :param port:            USB port for the RFID reader.  I think is is always /dev/ttyUSB0
         :type port:             str
+        :param runtime:         SonosRuntime.Runtime to poll the reader on, if None we use our own thread
+        :type runtime:          object
+        :param read_timeout:    seconds each read waits for a tag
+        :type read_timeout:     float
         '''
         self.callback = callback
         self.port = port
-        # make threading object so rfid polling loops in its own thread
-        rfid_loop = threading.Thread(target=self.read_rfid)
-        rfid_loop.start()
+        self.read_timeout = read_timeout
+        self.reader = None
+        if runtime is not None:
+            # we only  need to check the port every 2 or 3 seconds
+            runtime.every(2, self.read_once, name='rfid reader')
+        else:
+            # make threading object so rfid polling loops in its own thread
+            rfid_loop = threading.Thread(target=self.read_rfid)
+            rfid_loop.start()
 
 
     def read_rfid(self):
         '''
         polls the rfid reader, if there is data then send the tag number to the handler.
         '''
-        # make reader object
-        reader = RFIDTagReader.TagReader(self.port)
-        taginfo = ""
         while True:
-            try:
-                taginfo = str(reader.readTag())
-                # tag is an integer, handler function needs a string
-                if  taginfo is not None:
-                    print("Read RFID Tag:", taginfo)
-                    print("Changing Pageset based on RFID read")
-                    self.callback(taginfo)
-                    #clear the memory of the tag reader so we don't read the tag over and over
-                    reader.serialPort.flushInput()
-                    taginfo = None
-            except Exception as e:
-                # sometimes we get a partial tag read, just loop around again and read tag, don't clear the port until
-                #   we get an error free read.
-                print("error reading tag:", e)
-                print("tag number:", taginfo)
+            self.read_once()
             # we only  need to check the port every 2 or 3 seconds, maybe even less frequently.
             time.sleep(2)
 
+    def read_once(self):
+        '''
+        checks the rfid reader once, if there is data then send the tag number to the handler.
+        '''
+        if self.reader is None:
+            # make reader object.  With a short time out, so a read never holds up the thread it is on; readTag
+            #   returns 0 if there is no tag
+            self.reader = RFIDTagReader.TagReader(self.port, timeOutSecs=self.read_timeout)
+        taginfo = ""
+        try:
+            tag = self.reader.readTag()
+            # tag is an integer, handler function needs a string
+            taginfo = str(tag)
+            if tag:
+                print("Read RFID Tag:", taginfo)
+                print("Changing Pageset based on RFID read")
+                self.callback(taginfo)
+                #clear the memory of the tag reader so we don't read the tag over and over
+                self.reader.serialPort.flushInput()
+        except Exception as e:
+            # sometimes we get a partial tag read, just loop around again and read tag, don't clear the port until
+            #   we get an error free read.
+            print("error reading tag:", e)
+            print("tag number:", taginfo)
+
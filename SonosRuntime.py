@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+asyncio runtime for the sonos controllers (wallbox.py and volctrl.py).
+
+Runs everything that used to loop in its own thread (display updater, display timeout, weather updates, rfid reader,
+zone state cache, wallbox pulse timer) as tasks on one asyncio event loop in the main thread.  Blocking calls (soco,
+requests, the display, the serial port) are run in a small, bounded thread pool, so there are only ever a couple of
+threads doing work instead of one per loop.  Calls that mostly wait on the network for a long time (discovery,
+probing units, sending to every member of a group) go in a second pool, so they never hold up the first.  GPIO
+callbacks, which come in on the GPIO library's own thread, are bridged into the event loop so the callback thread
+returns right away.
+
+Everything is cancelled and the thread pool is drained when the runtime stops (SIGINT, SIGTERM or stop()), so
+shutdown is deterministic.
+
+Classes:
+    Runtime:        the event loop, the thread pool, and methods for scheduling work on them
+    PeriodicJob:    a blocking function that is run over and over, with a (possibly changing) interval between runs
+    Pool:           a thread pool that can drop the calls that haven't started yet
+
+This module does not use any of the pi hardware, so it can be used off the pi.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import signal
+import threading
+
+
+class Pool(concurrent.futures.ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that keeps the futures that haven't finished, so the calls that haven't started yet can be
+    dropped at shutdown.  shutdown(cancel_futures=True) does that, but only from python 3.9 and the pi runs 3.7.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+
+    def submit(self, *args, **kwargs):
+        # map and run_in_executor use submit too
+        future = super().submit(*args, **kwargs)
+        with self.pending_lock:
+            self.pending.add(future)
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future):
+        with self.pending_lock:
+            self.pending.discard(future)
+
+    def cancel_pending(self):
+        """
+        Cancels the calls that haven't started yet, the ones that are running carry on.
+        """
+        with self.pending_lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+
+
+class PeriodicJob:
+    """
+    Runs a blocking function in the runtime's thread pool, waits interval seconds, runs it again, and so on.
+
+    interval can be a number, or a function that returns the number of seconds to wait (it is called after each run,
+    so the job can speed up or slow down).  wake() cuts the current wait short, it can be called from any thread.
+    """
+
+    def __init__(self, runtime, func, interval, first_delay = 0, name = None):
+        """
+        :param runtime:         the Runtime that runs the job
+        :type runtime:          object
+        :param func:            blocking function to run, takes no parameters
+        :type func:             function
+        :param interval:        seconds between runs, or a function that returns the seconds between runs
+        :type interval:         float or function
+        :param first_delay:     seconds to wait before the first run
+        :type first_delay:      float
+        :param name:            name of the job, for error messages
+        :type name:             str
+        """
+        self.runtime = runtime
+        self.func = func
+        self.interval = interval
+        self.first_delay = first_delay
+        self.name = name if name is not None else getattr(func, '__name__', 'job')
+        self.wake_event = None
+        self.task = None
+
+    async def run(self):
+        self.wake_event = asyncio.Event()
+        await self.sleep(self.first_delay)
+        while True:
+            try:
+                await self.runtime.run_blocking(self.func)
+            except Exception as e:
+                print("Error in", self.name, ":", e)
+            interval = self.interval() if callable(self.interval) else self.interval
+            await self.sleep(interval)
+
+    async def sleep(self, seconds):
+        # wait for the interval, or until we are woken up
+        try:
+            await asyncio.wait_for(self.wake_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        self.wake_event.clear()
+
+    def wake(self):
+        """
+        Runs the job now instead of waiting for the rest of the interval.  Can be called from any thread.
+        """
+        if self.wake_event is not None:
+            self.runtime.loop.call_soon_threadsafe(self.wake_event.set)
+
+
+class Runtime:
+    """
+    One asyncio event loop plus a bounded thread pool for blocking calls.
+
+    Methods:
+        - every             run a blocking function periodically
+        - call_later        run a blocking function once, after a delay.  Thread safe.
+        - call_from_thread  run a blocking function as soon as possible.  Thread safe, used for GPIO callbacks
+        - bridge            wraps a GPIO callback so it runs in the thread pool instead of on the GPIO thread
+        - run_blocking      await a blocking function from a coroutine
+        - run_io            run a function that waits on the network in the io pool.  Thread safe
+        - run               runs the loop until stop() is called or we get SIGINT / SIGTERM
+        - stop              stops the runtime.  Thread safe.
+    """
+
+    def __init__(self, max_workers = 2, io_workers = 8):
+        """
+        :param max_workers:     most threads running blocking calls at once.  2 is plenty for a pi zero
+        :type max_workers:      int
+        :param io_workers:      most threads waiting on the network at once, for run_io
+        :type io_workers:       int
+        """
+        self.loop = asyncio.new_event_loop()
+        self.executor = Pool(max_workers=max_workers, thread_name_prefix='sonos')
+        self.io_executor = Pool(max_workers=io_workers, thread_name_prefix='sonos io')
+        self.loop.set_default_executor(self.executor)
+        self.jobs = []
+        self.tasks = set()
+        self.shutdown_callbacks = []
+        self.running = False
+
+    def run_blocking(self, func, *args, **kwargs):
+        """
+        :return:    awaitable result of func(*args, **kwargs), run in the thread pool
+        """
+        return self.loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def run_io(self, func, *args):
+        """
+        Runs func(*args) in the io pool, for calls that spend a long time waiting on the network.  Can be called from
+        any thread, and before run().
+
+        :return:    future for the result
+        :rtype:     concurrent.futures.Future
+        """
+        return self.io_executor.submit(func, *args)
+
+    def every(self, interval, func, first_delay = 0, name = None):
+        """
+        Runs func every interval seconds in the thread pool.  Can be called before run().
+
+        :param interval:        seconds between runs, or a function that returns the seconds between runs
+        :type interval:         float or function
+        :param func:            blocking function to run
+        :type func:             function
+        :param first_delay:     seconds to wait before the first run
+        :type first_delay:      float
+        :return:                the job, call job.wake() to run it right away
+        :rtype:                 PeriodicJob
+        """
+        job = PeriodicJob(self, func, interval, first_delay, name)
+        self.jobs.append(job)
+        if self.running:
+            self.loop.call_soon_threadsafe(self.start_job, job)
+        return job
+
+    def start_job(self, job):
+        job.task = self.loop.create_task(job.run())
+
+    def call_from_thread(self, func, *args):
+        """
+        Runs func(*args) in the thread pool as soon as possible.  Can be called from any thread.
+        """
+        self.loop.call_soon_threadsafe(self.submit, func, args)
+
+    def call_later(self, delay, func, *args):
+        """
+        Runs func(*args) in the thread pool after delay seconds.  Can be called from any thread.
+
+        :return:    a Timer, call cancel() on it to stop func being run
+        :rtype:     object
+        """
+        timer = Timer(self)
+        self.loop.call_soon_threadsafe(timer.start, delay, func, args)
+        return timer
+
+    def submit(self, func, args, lock = None):
+        # must be called in the loop thread
+        task = self.loop.create_task(self.run_job(func, args, lock))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run_job(self, func, args, lock = None):
+        try:
+            if lock is None:
+                await self.run_blocking(func, *args)
+            else:
+                async with lock:
+                    await self.run_blocking(func, *args)
+        except Exception as e:
+            print("Error in", getattr(func, '__name__', func), ":", e)
+
+    def bridge(self, callback, serial = True):
+        """
+        Wraps a callback that is called from the GPIO library's thread, so the real work is done in the thread pool
+        and the GPIO thread returns right away.
+
+        :param callback:    the method that processes the input
+        :type callback:     function
+        :param serial:      if True calls to the callback are run one at a time, in the order they came in
+        :type serial:       bool
+        :return:            function to give to the GPIO library (or SonosHW class) as the callback
+        :rtype:             function
+        """
+        lock = asyncio.Lock() if serial else None
+
+        def bridged(*args, **kwargs):
+            if kwargs:
+                self.loop.call_soon_threadsafe(self.submit, functools.partial(callback, **kwargs), args, lock)
+            else:
+                self.loop.call_soon_threadsafe(self.submit, callback, args, lock)
+        return bridged
+
+    def on_shutdown(self, func):
+        """
+        Adds a function that is called (in the main thread) after everything has stopped, ie GPIO.cleanup
+        """
+        self.shutdown_callbacks.append(func)
+
+    def run(self):
+        """
+        Runs the event loop in this thread until stop() is called or we get SIGINT or SIGTERM, then shuts down.
+        """
+        asyncio.set_event_loop(self.loop)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # not in the main thread, or not supported on this platform
+                pass
+        self.running = True
+        for job in self.jobs:
+            self.start_job(job)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """
+        Stops the runtime.  Can be called from any thread.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def shutdown(self):
+        print("Shutting down")
+        self.running = False
+        tasks = [job.task for job in self.jobs if job.task is not None] + list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        # don't wait for the network, but do wait for blocking calls that are already running to finish; they all
+        #   have short time outs.  Calls that haven't started yet are dropped
+        self.io_executor.cancel_pending()
+        self.io_executor.shutdown(wait=False)
+        self.executor.cancel_pending()
+        self.executor.shutdown(wait=True)
+        for func in self.shutdown_callbacks:
+            try:
+                func()
+            except Exception as e:
+                print("Error shutting down:", e)
+        self.loop.close()
+
+
+class Timer:
+    """
+    Handle for Runtime.call_later, so the call can be cancelled from any thread.
+    """
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self.handle = None
+        self.cancelled = False
+
+    def start(self, delay, func, args):
+        # runs in the loop thread
+        if not self.cancelled:
+            self.handle = self.runtime.loop.call_later(delay, self.runtime.submit, func, args)
+
+    def cancel(self):
+        self.cancelled = True
+        self.runtime.loop.call_soon_threadsafe(self.cancel_handle)
+
+    def cancel_handle(self):
+        if self.handle is not None:
+            self.handle.cancel()
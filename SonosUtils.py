@@ -8,6 +8,14 @@ import requests
 import json
 import unicodedata
 import html
+import hashlib
+import os
+import collections
+import concurrent.futures
+import itertools
+import xml.etree.ElementTree as ElementTree
+from soco.data_structures import to_didl_string
+from soco.data_structures_entry import from_didl_string
 
 # from jsoncomment import JsonComment
 
@@ -78,12 +86,29 @@ def center_text(text, display_char=16):
 def getTitleArtist(unit):
     """
     Returns a dictionary "currently_playing" with "title" and "from"
-        (ie, station, artist) for the currently playing track
+        (ie, station, artist) for the currently playing track, plus its uri and album art url
         this is used to update the display, such as after adding a track to the queue or pausing / playing
     :param unit:    a sonos unit
     :type   unit:   soco object
     """
-    return_info = {'track_title': '', 'track_from': '', 'meta': ''}
+    try:
+        current = unit.get_current_track_info()
+    except:
+        current = {}
+    return title_artist(current)
+
+
+def title_artist(current):
+    """
+    Same as getTitleArtist, from a track we already have; the result of get_current_track_info, or the track the
+    ZoneStateCache made from an event (same keys, the metadata is a didl object).  No network.
+
+    :param current:     the track
+    :type current:      dict
+    :return:            dictionary with track_title, track_from, meta, uri and album_art
+    :rtype:             dict
+    """
+    return_info = {'track_title': '', 'track_from': '', 'meta': '', 'uri': '', 'album_art': ''}
 
     def is_siriusxm(current):
         """
@@ -118,6 +143,9 @@ def getTitleArtist(unit):
             # title and artist stored in track-info dictionary
 
             meta = current_xm['metadata']
+            if not isinstance(meta, str):
+                # from an event, the station's text is in the didl
+                meta = to_didl_string(meta)
             title_index = meta.find('TITLE') + 6
             title_end = meta.find('ARTIST') - 1
             title = meta[title_index:title_end]
@@ -141,8 +169,6 @@ def getTitleArtist(unit):
             return track_info
 
     try:
-
-        current = unit.get_current_track_info()
         if current is None:
             print('got no track info')
             return_info['track_title'] = 'Title N/A'
@@ -164,6 +190,8 @@ def getTitleArtist(unit):
         if return_info['track_title'] == return_info['track_from']:  # if title and from are same just display title
             return_info['track_from'] = "                "
         return_info['meta'] = current['metadata']
+        return_info['uri'] = current.get('uri', '')
+        return_info['album_art'] = current.get('album_art', '')
         # print('updated track info:', return_info['track_title'],"  ", return_info['track_from'])
         return return_info
     except:
@@ -172,6 +200,48 @@ def getTitleArtist(unit):
         return return_info
 
 
+def time_to_seconds(hms):
+    """
+    Converts a sonos time string (position or duration of a track, ie "0:03:12") to seconds.
+
+    :param hms:     time in hours:minutes:seconds
+    :type hms:      str
+    :return:        seconds, or None if the time is not known (radio stations return "NOT_IMPLEMENTED" or "")
+    :rtype:         int
+    """
+    try:
+        hours, minutes, seconds = hms.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except (AttributeError, ValueError):
+        return None
+
+
+def probe_unit(ip, timeout=1):
+    """
+    Checks if there is a sonos unit at an ip address, with one http request (the unit's device description).  Much
+    quicker than discovery, and does not use multicast.
+
+    :param ip:          ip address to check
+    :type ip:           str
+    :param timeout:     seconds to wait for the unit to answer
+    :type timeout:      float
+    :return:            dictionary with the unit's uid, ip, name and model, or None if there is no sonos unit there
+    :rtype:             dict
+    """
+    namespace = "{urn:schemas-upnp-org:device-1-0}"
+    try:
+        response = requests.get("http://" + ip + ":1400/xml/device_description.xml", timeout=timeout)
+        device = ElementTree.fromstring(response.content).find(namespace + "device")
+    except (requests.RequestException, ElementTree.ParseError):
+        return None
+    if device is None:
+        return None
+    return {'uid': device.findtext(namespace + "UDN", "").replace("uuid:", ""),
+            'ip': ip,
+            'name': device.findtext(namespace + "roomName"),
+            'model': device.findtext(namespace + "modelName")}
+
+
 def get_cpu_temp():
     cpu = gpiozero.CPUTemperature()
     return cpu.temperature
@@ -189,10 +259,171 @@ def get_outside_temp(city_key = "5913490", api_key="1b2c8e00bfa16ce7a48f76c3570f
     return(str(current_temperature))
 
 
-def make_pageset_tracklist(page = "64426258266"):
+PAGESET_FILE = "wallbox_pages_nocomments.json"
+PAGESET_CACHE_DIR = "pageset_cache"
+
+
+def make_pageset_tracklist(page = "64426258266", unit = None, cache_dir = PAGESET_CACHE_DIR):
     '''
-    Opens json configuration file, gets the specified page set, and makes a list of dictionaries with the information
-    from each track needed to play them, display track info, and make labels, etc.
+    Gets the wallbox selections for a page set, from the compiled page set in cache_dir if it is still good, otherwise
+    compiles it from the sonos favorites and playlists and saves it for next time.
+
+    The compiled page set is good as long as the page set in the json file and the sonos library have not changed.
+    Checking the library is a few very small requests (the update ids of the favorites, the playlists, and each
+    playlist the page set uses) instead of getting all the favorites, playlists and up to 300 tracks, so a page
+    swap takes a fraction of a second instead of several seconds.  If we can't reach a sonos unit to check, the
+    compiled page set is used anyway.
+
+    :param page:         The RFID tag number of the desired wallbox page set - usually from the rfid reader
+    :type page:          str
+    :param unit:            The sonos unit to get the library from, if None we find one
+    :type unit:             object
+    :param cache_dir:       directory the compiled page sets are saved in, None to always compile
+    :type cache_dir:        str
+    :return:                A tuple, first element is a dictionary: "tracks" is the list of the tracks in the page set,
+                            each list item is a dictionary with position, wallbox letter&number, song title, artist,
+                            source, didl item that can be played. "playlists" is the list of sonos playlists.
+                            Second element is the name of the list
+    :rtype:                 tuple
+    '''
+    start_time = time.time()
+    page_set = load_page_set(page)
+    page_set_name = page_set["page_set_name"]
+    if unit is None:
+        # we can use any sonos unit for this, they all have duplicate favorites, playlist info
+        unit = get_any_sonos()
+    content_hash = pageset_hash(page_set)
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, page + ".json")
+        compiled = load_compiled_pageset(cache_file)
+        if compiled is not None and compiled['content_hash'] == content_hash and 'section_sizes' in compiled:
+            playlist_ids = [playlist_id for playlist_id in compiled['playlist_ids'] if playlist_id is not None]
+            try:
+                library_state = get_library_state(unit, playlist_ids)
+            except Exception as e:
+                print("Could not check sonos library, using compiled page set:", e)
+                library_state = compiled['library_state']
+            if library_state == compiled['library_state']:
+                wallbox_page_set = unpack_compiled_pageset(compiled)
+                print("Loaded compiled page set", page_set_name, "in", round(time.time() - start_time, 3), "s")
+                return wallbox_page_set, page_set_name
+    # page set or library has changed, or not compiled yet
+    library_state = {}
+    wallbox_page_set = compile_pageset(unit, page_set, library_state)
+    if cache_file is not None:
+        try:
+            save_compiled_pageset(cache_file, wallbox_page_set, content_hash, library_state)
+        except Exception as e:
+            print("Could not save compiled page set:", e)
+    print("Compiled page set", page_set_name, "in", round(time.time() - start_time, 3), "s")
+    return wallbox_page_set, page_set_name
+
+
+def update_pageset(page, changed_ids, unit, cache_dir = PAGESET_CACHE_DIR):
+    '''
+    Updates a compiled page set after the sonos library has changed.  Only the sections that use a changed container
+    are compiled again, and only the changed containers are read from the sonos; ie if one playlist has been edited we
+    browse just that playlist.  The rest of the page set is kept as it is.
+
+    :param page:            The RFID tag number of the page set
+    :type page:             str
+    :param changed_ids:     ids of the containers that have changed; "FV:2" favorites, "SQ:" the list of playlists,
+                            "SQ:12" a playlist
+    :type changed_ids:      set
+    :param unit:            The sonos unit to get the library from
+    :type unit:             object
+    :param cache_dir:       directory the compiled page sets are saved in
+    :type cache_dir:        str
+    :return:                same as make_pageset_tracklist, or None if none of the page set has changed
+    :rtype:                 tuple
+    '''
+    start_time = time.time()
+    page_set = load_page_set(page)
+    page_set_name = page_set["page_set_name"]
+    content_hash = pageset_hash(page_set)
+    cache_file = os.path.join(cache_dir, page + ".json")
+    compiled = load_compiled_pageset(cache_file)
+    if compiled is None or compiled['content_hash'] != content_hash or 'section_sizes' not in compiled:
+        # nothing to patch, compile the whole thing
+        return make_pageset_tracklist(page, unit, cache_dir)
+    old_page_set = unpack_compiled_pageset(compiled)
+    old_state = compiled['library_state']
+    # the update id of each container we read again is got before we read it, the ones we keep are from when they
+    #   were read before.  So if a container changes while we read it, the update id is old and it is read again
+    library_state = {"FV:2": old_state.get("FV:2"), "SQ:": old_state.get("SQ:")}
+    favorites = None
+    playlists = old_page_set['playlists']
+    if "FV:2" in changed_ids:
+        library_state["FV:2"] = container_update_id(unit, "FV:2")
+        favorites = unit.get_sonos_favorites()["favorites"]
+    if "SQ:" in changed_ids:
+        library_state["SQ:"] = container_update_id(unit, "SQ:")
+        playlists = unit.music_library.get_music_library_information("sonos_playlists")
+    tracks = []
+    playlist_ids = []
+    section_sizes = []
+    position = 0
+    patched = 0
+    for section, size, old_playlist_id in zip(page_set['sections'], old_page_set['section_sizes'],
+                                              old_page_set['playlist_ids']):
+        type = section['type']
+        playlist_id = old_playlist_id
+        if type == "sonos_playlist_tracks" and "SQ:" in changed_ids:
+            # the playlist could have been renamed, or another one given its name
+            playlist_id = find_playlist(playlists, section['playlist_name']).item_id
+        if type == "sonos_favorites":
+            changed = "FV:2" in changed_ids
+        elif type == "sonos_playlists":
+            changed = "SQ:" in changed_ids
+        else:
+            changed = playlist_id in changed_ids or playlist_id != old_playlist_id
+        if changed:
+            section_tracks, playlist_id = compile_section(unit, section, favorites, playlists, library_state)
+            patched += 1
+        else:
+            section_tracks = old_page_set['tracks'][position:position + size]
+            if playlist_id is not None and playlist_id not in library_state:
+                library_state[playlist_id] = old_state.get(playlist_id)
+        position += size
+        tracks.extend(section_tracks)
+        section_sizes.append(len(section_tracks))
+        playlist_ids.append(playlist_id)
+    if patched == 0 and "SQ:" not in changed_ids:
+        if set(changed_ids) & set(compiled['library_state']):
+            # none of our selections changed, but save the new update ids so we don't compile at the next startup
+            save_compiled_pageset(cache_file, old_page_set, content_hash, library_state)
+        return None
+    add_letter_numbers(tracks)
+    wallbox_page_set = {"playlists": playlists, "tracks": tracks, "section_sizes": section_sizes,
+                        "playlist_ids": playlist_ids}
+    save_compiled_pageset(cache_file, wallbox_page_set, content_hash, library_state)
+    print("Updated", patched, "of", len(section_sizes), "sections of page set", page_set_name, "in",
+          round(time.time() - start_time, 3), "s")
+    return wallbox_page_set, page_set_name
+
+
+def load_page_set(page, pageset_file = PAGESET_FILE):
+    '''
+    :return:    the page set for an RFID tag, from the json configuration file
+    :rtype:     dict
+    '''
+    # json = JsonComment()
+    # allows use of python style comments in json file
+    with open(pageset_file, "r") as json_file:
+        # parse and load into python object (nested dictionary & list)
+        page_sets = json.load(json_file)
+    return page_sets[page]
+
+
+def pageset_hash(page_set):
+    return hashlib.sha1(json.dumps(page_set, sort_keys=True).encode()).hexdigest()
+
+
+def compile_pageset(unit, page_set, library_state = None):
+    '''
+    Makes a list of dictionaries with the information from each track needed to play them, display track info, and
+    make labels, etc.
 
     todo: add error handling.  currently if JSON file is not perfect app will hang.
     Structure of the JSON file:
@@ -200,109 +431,312 @@ def make_pageset_tracklist(page = "64426258266"):
         dictionary -    ["playlists"] : list of sonos playlists, this so we don't have to be getting it all the time
                         ["track_list"] : list of wallbox tracks (favorites, playlists, and individual tracks
 
-
-    :param page:         The RFID tag number of the desired wallbox page set - usually from the rfid reader
-    :type page:          str
-    :param unit:            The name of the sonos unit to use.  currently not used
-    :type unit:             str
-    :param unit_ip:         The ip of the sonos unit, in case we can't find it by name.  currently not used
-    :type unit_ip:          str
-    :return:                A tuple, first element is a list of the tracks in the page set, each list item is a
-                            dictionary with position, wallbox letter&number, song title, artist, source, didl item
-                            that can be played.  Second element is the name of the list
-    :rtype:                 list
+    :param unit:            The sonos unit to get the favorites and playlists from
+    :type unit:             object
+    :param page_set:        The page set, from the json file
+    :type page_set:         dict
+    :param library_state:   if not None, the update ids of the containers are put in it, each got before the container
+                            is read, see get_library_state
+    :type library_state:    dict
+    :return:                page set dictionary; "playlists" and "tracks", plus "section_sizes" (number of tracks from
+                            each section) and "playlist_ids" (item id of the playlist each section takes tracks from,
+                            None if it doesn't) so the page set can be updated a section at a time
+    :rtype:                 dict
     '''
 
     wallbox_tracks = []
-    # get a sonos unit.  We can use any sonos unit for this, the all have duplicate favorites, playlist info
-    # we don't care which one we use
-    unit = get_any_sonos()
-    letter_number =[]
-    # make list of letters. nb jukebox has no "i" or "o"
-    letters = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'J', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'U', 'V']
-    numbers = [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]
-    # make combined list of letters and numbers
-    for num in numbers:
-        for letter in letters:
-            letter_number.append(letter + str(num))
+    playlist_ids = []
+    section_sizes = []
 
     # get sonos favorites and playlists
+    if library_state is not None:
+        library_state["FV:2"] = container_update_id(unit, "FV:2")
+        library_state["SQ:"] = container_update_id(unit, "SQ:")
     favorites = unit.get_sonos_favorites()["favorites"]
     playlists = unit.music_library.get_music_library_information("sonos_playlists")
 
-    # get current page set from json file
-    # json = JsonComment()
-    # allows use of python style comments in json file
-    json_file = open("wallbox_pages_nocomments.json", "r")
-    # parse and load into python object (nested dictionary & list)
-    page_sets = json.load(json_file)
-    # get current page set as read from rfid tag passed as parameter into def
-    print(page_sets)
-    page_set = page_sets[page]
-    page_set_name = page_sets[page]["page_set_name"]
-
-    # initialize wallbox_selection number
-    # loop through sections in page_set
+    # loop through sections in page_set, each section fills the next selections
     for section in page_set['sections']:
-        # calculate number of selections in section
-        type = section['type']
-        page_set_label_number = int(section['start_label'])
-
-        if type == "sonos_favorites" or type == 'sonos_playlists':
-            num_selections = int(section['end_list']) - int(section['start_list']) + 1
-            start = int(section['start_list'])
-            for selection in range(num_selections):
-                page_set_label_number += 1
-                if type == 'sonos_favorites':
-
-                    track = favorites[start+selection]
-
-                    page_set_item = {'title': track['title'], "song_title": track['title'],
-                                     'artist': "Sonos Favorite",
-                                     'source': track['title'], 'type': type, 'ddl_item': None,"uri":track['uri'],
-                                     'meta':track['meta']}
-                    # print("page set item for favorites", page_set_item)
-                elif type == 'sonos_playlists':
-                    track = playlists[start+selection]
-                    playlist_number = int(section["start_list"])+ selection
-                    page_set_item = {'title': track.title, "song_title": track.title, 'artist': 'Sonos Playlist',
-                                     'source': "Sonos Playlist", 'type': type,
-                                     'ddl_item': track, 'playmode': section['play_mode'],
-                                     'playlist_number':playlist_number}
-                # add to page_set_items list
-                wallbox_tracks.insert(page_set_label_number, page_set_item)
-
-        elif type == "sonos_playlist_tracks":
-            playlist = unit.get_sonos_playlist_by_attr("title", section['playlist_name'])
-            # get the tracks for the playlist we found
-            # playlist should only be 200 tracks long but get up to 300 in case there are extra tracks, but have to
-            #   add error handling for this@!
-            tracks = unit.music_library.browse(playlist, max_items=300)
-            for selection in tracks:
-                page_set_label_number += 1
-                track = selection
-                if track.title.find("(") > 1 :
-                    # just take part of title to the left of the (
-                    song_title = track.title[0:track.title.find("(")]
-                elif track.title.find("-") > 1:
-                    song_title = track.title[0:track.title.find("-")]
-                else:
-                    song_title = track.title
-                page_set_item = {'title': track.title, 'song_title': song_title, 'artist': track.creator,
-                                 'source': track.album, 'type': type, 'ddl_item': track}
-                # todo try to figure out how to get album art, this would be good for labels!
-                wallbox_tracks.insert(page_set_label_number, page_set_item)
+        section_tracks, playlist_id = compile_section(unit, section, favorites, playlists, library_state)
+        wallbox_tracks.extend(section_tracks)
+        section_sizes.append(len(section_tracks))
+        playlist_ids.append(playlist_id)
 
     print("Number of tracks in Wallbox pageset ", len(wallbox_tracks) )
-    # add the wallbox page numbering to each tracklist dictionary
-    for index, letter_number_item in enumerate(letter_number):
-        wallbox_tracks[index]['letter_number'] = letter_number_item
+    add_letter_numbers(wallbox_tracks)
 
     # add playlists and tracks to wallbox_page_set dictionary
     # include playlists so this does not have to be called everytime we want to play a playlist.
 
-    wallbox_page_set = {"playlists": playlists,"tracks":wallbox_tracks}
-    return wallbox_page_set, page_set_name
+    wallbox_page_set = {"playlists": playlists, "tracks": wallbox_tracks, "section_sizes": section_sizes,
+                        "playlist_ids": playlist_ids}
+    return wallbox_page_set
+
+
+def compile_section(unit, section, favorites, playlists, library_state = None):
+    '''
+    Makes the wallbox selections for one section of a page set.
+
+    :param unit:            The sonos unit, to browse playlist tracks
+    :type unit:             object
+    :param section:         The section, from the json file
+    :type section:          dict
+    :param favorites:       sonos favorites, only needed for sonos_favorites sections
+    :type favorites:        list
+    :param playlists:       sonos playlists
+    :type playlists:        list
+    :param library_state:   if not None, the update id of the playlist the tracks come from is put in it, got before
+                            the playlist is browsed
+    :type library_state:    dict
+    :return:                A tuple, first element is the list of selections, second is the item id of the playlist
+                            the tracks came from (None if the section is not sonos_playlist_tracks)
+    :rtype:                 tuple
+    '''
+    section_tracks = []
+    playlist_id = None
+    # calculate number of selections in section
+    type = section['type']
+
+    if type == "sonos_favorites" or type == 'sonos_playlists':
+        num_selections = int(section['end_list']) - int(section['start_list']) + 1
+        start = int(section['start_list'])
+        for selection in range(num_selections):
+            if type == 'sonos_favorites':
+
+                track = favorites[start+selection]
+
+                page_set_item = {'title': track['title'], "song_title": track['title'],
+                                 'artist': "Sonos Favorite",
+                                 'source': track['title'], 'type': type, 'ddl_item': None,"uri":track['uri'],
+                                 'meta':track['meta']}
+                # print("page set item for favorites", page_set_item)
+            elif type == 'sonos_playlists':
+                track = playlists[start+selection]
+                playlist_number = int(section["start_list"])+ selection
+                page_set_item = {'title': track.title, "song_title": track.title, 'artist': 'Sonos Playlist',
+                                 'source': "Sonos Playlist", 'type': type,
+                                 'ddl_item': track, 'playmode': section['play_mode'],
+                                 'playlist_number':playlist_number}
+            # add to page_set_items list
+            section_tracks.append(page_set_item)
+
+    elif type == "sonos_playlist_tracks":
+        playlist = find_playlist(playlists, section['playlist_name'])
+        playlist_id = playlist.item_id
+        # get the tracks for the playlist we found, only as many as the section has selections for.  The playlist can
+        #   be any length, the tracks are fetched a page at a time and we stop when the section is full
+        num_selections = int(section['end_label']) - int(section['start_label']) + 1
+        if library_state is not None and playlist_id not in library_state:
+            library_state[playlist_id] = container_update_id(unit, playlist_id)
+        tracks = browse_pages(unit, playlist.item_id, max_items=num_selections)
+        for selection in tracks:
+            track = selection
+            if track.title.find("(") > 1 :
+                # just take part of title to the left of the (
+                song_title = track.title[0:track.title.find("(")]
+            elif track.title.find("-") > 1:
+                song_title = track.title[0:track.title.find("-")]
+            else:
+                song_title = track.title
+            page_set_item = {'title': track.title, 'song_title': song_title, 'artist': track.creator,
+                             'source': track.album, 'type': type, 'ddl_item': track}
+            # todo try to figure out how to get album art, this would be good for labels!
+            section_tracks.append(page_set_item)
+    return section_tracks, playlist_id
+
+
+def browse_pages(unit, object_id, page_size = 100, workers = 3, max_items = None):
+    '''
+    Browses a content directory container (ie a sonos playlist) a page at a time, and yields the items in order as the
+    pages come in.  The first page tells us how many items there are, then up to <workers> pages are fetched at once.
+    Only the pages being fetched and the one being yielded are held in memory, so it works for playlists of any length.
+    Prints how long each page took.
+
+    If the caller stops early (ie breaks out of the loop) the pages that haven't been fetched are not fetched.
+
+    :param unit:            sonos unit to browse
+    :type unit:             object
+    :param object_id:       id of the container, ie SQ:12
+    :type object_id:        str
+    :param page_size:       items per request.  sonos won't send more than 100
+    :type page_size:        int
+    :param workers:         most pages fetched at once
+    :type workers:          int
+    :param max_items:       stop after this many items, None for all of them
+    :type max_items:        int
+    :return:                generator of DidlObjects
+    :rtype:                 generator
+    '''
+    def get_page(start):
+        page_start_time = time.time()
+        count = page_size if max_items is None else min(page_size, max_items - start)
+        response = unit.contentDirectory.Browse([
+            ("ObjectID", object_id),
+            ("BrowseFlag", "BrowseDirectChildren"),
+            ("Filter", "*"),
+            ("StartingIndex", start),
+            ("RequestedCount", count),
+            ("SortCriteria", ""),
+        ])
+        items = from_didl_string(response["Result"]) if response["Result"] else []
+        print("Browsed", object_id, "items", start, "to", start + len(items), "in",
+              round(time.time() - page_start_time, 3), "s")
+        return items, int(response["TotalMatches"])
+
+    if max_items is not None and max_items <= 0:
+        # a RequestedCount of 0 asks the sonos for as many as it will send, so don't ask at all
+        return
+    items, total = get_page(0)
+    if max_items is not None:
+        total = min(total, max_items)
+    yield from items
+    starts = iter(range(len(items), total, page_size))
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    pages = collections.deque()
+    try:
+        # keep <workers> pages on the way, yield them in order
+        for start in itertools.islice(starts, workers):
+            pages.append(pool.submit(get_page, start))
+        while pages:
+            items, _ = pages.popleft().result()
+            for start in itertools.islice(starts, 1):
+                pages.append(pool.submit(get_page, start))
+            yield from items
+    finally:
+        for page in pages:
+            page.cancel()
+        pool.shutdown(wait=False)
+
+
+def section_size(section):
+    '''
+    :return:    the number of selections a page set section has, from the json file without asking the sonos
+    :rtype:     int
+    '''
+    if section['type'] == "sonos_playlist_tracks":
+        return int(section['end_label']) - int(section['start_label']) + 1
+    return int(section['end_list']) - int(section['start_list']) + 1
+
+
+def letter_number(index):
+    '''
+    :return:    the wallbox letter & number for a selection, same as add_letter_numbers; 0 is A1, 20 is A2, 199 is V0
+    :rtype:     str
+    '''
+    # nb jukebox has no "i" or "o"
+    letters = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'J', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'U', 'V']
+    numbers = [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]
+    return letters[index % 20] + str(numbers[index // 20])
+
+
+def find_playlist(playlists, name):
+    # we already have the playlists, so don't get them all again with get_sonos_playlist_by_attr
+    for playlist in playlists:
+        if playlist.title == name:
+            return playlist
+    raise ValueError("No sonos playlist called " + name)
+
+
+def add_letter_numbers(wallbox_tracks):
+    '''
+    Adds the wallbox letter & number (A1, B1 ... V0) to each selection.
+    '''
+    # add the wallbox page numbering to each tracklist dictionary
+    for index, track in enumerate(wallbox_tracks[:200]):
+        track['letter_number'] = letter_number(index)
+
+
+def container_update_id(unit, object_id):
+    '''
+    :return:    the update id of a sonos content directory container, it changes whenever the container changes.
+                Only asks for one item so the reply is small.
+    :rtype:     str
+    '''
+    response = unit.contentDirectory.Browse([
+        ("ObjectID", object_id),
+        ("BrowseFlag", "BrowseDirectChildren"),
+        ("Filter", "dc:title"),
+        ("StartingIndex", 0),
+        ("RequestedCount", 1),
+        ("SortCriteria", ""),
+    ])
+    return response["UpdateID"]
+
+
+def get_library_state(unit, playlist_ids = ()):
+    '''
+    :param unit:            sonos unit to ask
+    :type unit:             object
+    :param playlist_ids:    item ids of the playlists whose tracks are used, ie SQ:12
+    :type playlist_ids:     list
+    :return:                update ids of the favorites, the playlists, and each of the playlists in playlist_ids
+    :rtype:                 dict
+    '''
+    state = {"FV:2": container_update_id(unit, "FV:2"), "SQ:": container_update_id(unit, "SQ:")}
+    for playlist_id in playlist_ids:
+        state[playlist_id] = container_update_id(unit, playlist_id)
+    return state
+
+
+def atomic_write(path, data):
+    '''
+    Writes a file to a temporary file then renames it, so anything reading the file never sees a half written one,
+    even if the power goes.
+
+    :param path:    the file
+    :type path:     str
+    :param data:    what to write, text or bytes
+    :type data:     str or bytes
+    '''
+    temp_file = path + ".tmp"
+    with open(temp_file, "wb" if isinstance(data, bytes) else "w") as file:
+        file.write(data)
+    os.replace(temp_file, path)
+
+
+def load_compiled_pageset(cache_file):
+    try:
+        with open(cache_file, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_compiled_pageset(cache_file, wallbox_page_set, content_hash, library_state):
+    '''
+    Saves a compiled page set, with the library state it was compiled from.  The state has to be got before the
+    library is read (see compile_pageset), not after, or a change made while we were reading would never be noticed.
+    Didl items are saved as didl xml, the same as sonos sends them.
+    '''
+    playlist_ids = wallbox_page_set['playlist_ids']
+    tracks = []
+    for track in wallbox_page_set['tracks']:
+        item = dict(track)
+        if item['ddl_item'] is not None:
+            item['ddl_item'] = to_didl_string(item['ddl_item'])
+        tracks.append(item)
+    compiled = {'content_hash': content_hash, 'library_state': library_state, 'playlist_ids': playlist_ids,
+                'section_sizes': wallbox_page_set['section_sizes'],
+                'playlists': [to_didl_string(playlist) for playlist in wallbox_page_set['playlists']],
+                'tracks': tracks}
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    atomic_write(cache_file, json.dumps(compiled))
+
+
+def unpack_compiled_pageset(compiled):
+    '''
+    :return:    page set dictionary from a saved compiled page set, same as compile_pageset returns
+    :rtype:     dict
+    '''
+    tracks = []
+    for item in compiled['tracks']:
+        track = dict(item)
+        if track['ddl_item'] is not None:
+            track['ddl_item'] = from_didl_string(track['ddl_item'])[0]
+        tracks.append(track)
+    playlists = [from_didl_string(playlist)[0] for playlist in compiled['playlists']]
+    return {"playlists": playlists, "tracks": tracks, "section_sizes": compiled.get('section_sizes'),
+            "playlist_ids": compiled['playlist_ids']}
 
 
 def get_any_sonos(ip = "192.168.1.35"):
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Decodes the pulses from the Seeburg wallbox into a selection 0 - 199.  No hardware in here, so it can be tested and
+benchmarked off the pi; SonosHW.WallBox feeds it the times of the falling edges from the GPIO pin, wallbox_bench.py
+feeds it edges from trace files or made up trains.
+
+See SonosHW.WallBox for how the wallbox pulses work.  All times are time.monotonic() seconds, which NTP can't step.
+
+Trace files:
+    Recorded (or made up) trains of edges, one train per line:
+
+        <selection> <gap> <interval> <interval> ...
+
+    selection is what the train should decode to, as the wallbox label (ie B3), or - for a train that is only noise.
+    gap is the microseconds from the last edge of the train before to the first edge of this one, each interval is the
+    microseconds from the edge before.  Lines starting with # are comments.
+
+Classes:
+    PulseDecoder:   state machine that counts letters and numbers from the edge times, and says when a train is
+                    finished
+
+Functions:
+    read_trace, write_trace, label, selection_number
+"""
+
+LETTERS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'J', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'U', 'V']
+NUMBERS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]
+
+
+class PulseDecoder:
+    """
+    Counts the pulses in a train from the wallbox, first the letters, then the numbers, and filters out what is not a
+    valid pulse.
+
+    A train only starts when an edge is followed by another a letter pulse later (every selection has at least one
+    letter pulse); an edge on its own, like the spike about 500ms after the last pulse of a train, is ignored and
+    doesn't start a train.  The train is finished when there has been no valid pulse for quiet seconds (a bit longer
+    than the gap between the letters and numbers), or max_train seconds after it started.
+
+    Methods:
+        - edge          a falling edge, at a time.  Says if a train has started, or the letters are finished
+        - time_to_end   how long until the train could be finished
+        - end_train     finishes the train, returns the selection
+        - convert_wb    converts the letter and number counts into a number 0- 199
+    """
+
+    # constants for detecting and decoding wallbox pulses
+    LETTER_MAX = .275       # minimum and maximum gap between letters and numbers
+    LETTER_MIN = .260
+    PULSE_MAX = .085        # maximum duration of a letter or number pulse
+    PULSE_MIN = .070        # minimum duration of a letter or number pulse
+    QUIET = .4              # no valid pulse for this long and the train is finished
+    MAX_TRAIN = 3.5         # longest a train can be, 3 seconds is max duration for a series of pulses
+
+    def __init__(self, quiet = QUIET, max_train = MAX_TRAIN):
+        """
+        :param quiet:       seconds with no pulses before the train is finished
+        :type quiet:        float
+        :param max_train:   seconds after the first pulse that the train is finished, even if the pulses haven't stopped
+        :type max_train:    float
+        """
+        self.quiet = quiet
+        self.max_train = max_train
+        self.first_pulse = True             # True until a train has started
+        self.candidate = None               # time of an edge that may be the first of a train
+        self.last_pulse_start = 0
+        self.counting_numbers = False
+        self.letter_count = 0
+        self.number_count = 0
+        self.train = 0                      # number of the current train of pulses
+        self.train_start = 0                # time of the first pulse in the train
+        self.last_valid_pulse = 0           # time of the last pulse that was not noise
+
+    def edge(self, now):
+        """
+        A falling edge from the wallbox.
+
+        :param now:     time of the edge
+        :type now:      float
+        :return:        a tuple; True if this edge started a train (it is the end of the first letter pulse, the train
+                        started at the edge before), and the letter index (0 - 19) if this edge is the gap between the
+                        letters and numbers, otherwise None
+        :rtype:         tuple
+        """
+        # calculate the duration from the last pulse
+        duration = now - self.last_pulse_start
+        started = False
+        letter = None
+
+        if self.first_pulse:
+            if self.candidate is not None and self.PULSE_MAX > duration > self.PULSE_MIN:
+                # the edge before was the first pulse of a train, this one ends the first letter pulse
+                self.first_pulse = False
+                started = True
+                self.train += 1
+                self.train_start = self.candidate
+                self.last_valid_pulse = now
+                self.letter_count = 1
+            else:
+                # could be the first pulse of a train, or a spike on its own; the next edge will tell.  Don't count it
+                #   yet, just record the time of the pulse
+                self.candidate = now
+            # next check to see if it is a valid pulse, ie not noise, or the very long pulse between sets of pulses
+            # if either a regular pulse or the gap between letters and numbers then start (or continue) counting
+            # this filters out any short duration noise spikes, which usually occur after pulses are finished.
+        elif self.LETTER_MAX > duration > self.LETTER_MIN or self.PULSE_MAX > duration > self.PULSE_MIN:
+            self.last_valid_pulse = now
+            # check for gap between the letters and numbers
+            if self.LETTER_MAX > duration > self.LETTER_MIN:
+                # if it matches the letter-number gap flag that we are now counting numbers, not letters
+                self.counting_numbers = True
+                # letters are 1 - 20, same adjustment as convert_wb
+                letter = self.letter_count - 1
+            elif not self.counting_numbers:
+                # we are counting letters
+                self.letter_count += 1
+            else:
+                self.number_count += 1
+
+        # record the time of this pulse
+        self.last_pulse_start = now
+        return started, letter
+
+    def time_to_end(self, now):
+        """
+        :param now:     the time now
+        :type now:      float
+        :return:        seconds to wait before the train could be finished, 0 if it is finished now, None if there is
+                        no train
+        :rtype:         float
+        """
+        if self.first_pulse:
+            return None
+        if now - self.train_start >= self.max_train:
+            return 0
+        return max(0, self.quiet - (now - self.last_valid_pulse))
+
+    def end_train(self):
+        """
+        Finishes the train and resets the counters for the next one.
+
+        :return:        the selection 0 - 199, or None if the train was noise
+        :rtype:         int
+        """
+        letter_count = self.letter_count
+        number_count = self.number_count
+        # reset flags and counters
+        self.first_pulse = True
+        self.candidate = None
+        self.letter_count = 0
+        self.number_count = 0
+        self.counting_numbers = False
+        if letter_count == 0:
+            # no letters, so it was noise not a selection
+            return None
+        return self.convert_wb(letter_count, number_count)
+
+    @staticmethod
+    def convert_wb(letter, number):
+        """
+        Turns letter and number into a single number 0-199.
+
+        It's a base 20 system; with the letters being numbers 0-19, then the number being the "20"'s digit,
+        so we have to multply the number by 20 then add the letter to it.  Number is the first digit, letter the second,
+        although on the wallbox the letter is selected first, number second.
+
+        Pulse detect algorithm returns numbers in range 0-9, letters in range 1 - 20; we adjust letters down by one so
+        that they are in the range 0-19 (ie, 'A' is 0, not 1)
+
+        Examples:  wallbox selection is "B3", letter is 2, number is 3 = (3*20) +  (2-1) = 61
+                   wallbox selection is "A0", letter is 1, number is 9 = (19*20) + (1-1) = 180
+
+        :param letter:      Number representing the letter pressed on the wallbox (0- 19)
+        :type letter:       int
+        :param number:      Number representing the number key pressed on the wallbox (0-9)
+        :type number:       int
+        """
+        #  Adjust the letter and number count to get the right tracks
+        #  because we look these up by index, python indexes start at 0, so we subtract 1 from letter count
+        return (letter - 1) + number * 20
+
+
+def label(selection):
+    """
+    :return:    the wallbox label for a selection number, ie 61 is B4, or - for None
+    :rtype:     str
+    """
+    if selection is None:
+        return '-'
+    return LETTERS[selection % 20] + str(NUMBERS[selection // 20])
+
+
+def selection_number(selection_label):
+    """
+    :return:    the selection number for a wallbox label, ie B4 is 61, None for -
+    :rtype:     int
+    """
+    if selection_label == '-':
+        return None
+    return LETTERS.index(selection_label[0]) + NUMBERS.index(int(selection_label[1:])) * 20
+
+
+def read_trace(file_name):
+    """
+    Reads a trace file.
+
+    :return:    list of trains; each is a tuple of the selection it should decode to (None for noise) and the list of
+                edge times in seconds, from the start of the trace
+    :rtype:     list
+    """
+    trains = []
+    now = 0
+    with open(file_name, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            edges = []
+            for interval in fields[1:]:
+                now += int(interval) / 1000000
+                edges.append(now)
+            trains.append((selection_number(fields[0]), edges))
+    return trains
+
+
+def write_trace(file_name, trains, mode = 'w', last_edge = None):
+    """
+    Writes trains to a trace file.
+
+    :param trains:      list of trains, each a tuple of the selection number (or None) and the list of edge times in
+                        seconds
+    :type trains:       list
+    :param mode:        'w' to start a new file, 'a' to add to one
+    :type mode:         str
+    :param last_edge:   time of the last edge already in the file, when adding to one
+    :type last_edge:    float
+    """
+    with open(file_name, mode) as file:
+        for selection, edges in trains:
+            if not edges:
+                continue
+            if last_edge is None:
+                last_edge = edges[0]
+            intervals = []
+            for edge_time in edges:
+                intervals.append(str(round((edge_time - last_edge) * 1000000)))
+                last_edge = edge_time
+            file.write(label(selection) + ' ' + ' '.join(intervals) + '\n')
@@ -13,7 +13,8 @@ import math
 class UpdateWeather:
 
     def __init__(self, location_id = "5913490", auth_key = "1b2c8e00bfa16ce7a48f76c3570fd3a2",
-                 disp_lines=3, disp_width=22, fcst_period = 1, update_freq = 10, time_zone = "Canada/Mountain"):
+                 disp_lines=3, disp_width=22, fcst_period = 1, update_freq = 10, time_zone = "Canada/Mountain",
+                 runtime = None, timeout = 10):
         '''
         Gets weather update from openweathermap.org, methods for converting temperature to c and getting forecast
 
@@ -29,6 +30,11 @@ class UpdateWeather:
         :type fcst_period:          int
         :param update_freq:         time between forecast updates in minutes
         :type: update_freq:         int
+        :param runtime:             SonosRuntime.Runtime to run the updates on, if None we use our own thread
+        :type runtime:              object
+        :param timeout:             seconds to wait for openweathermap.org to answer; the updates run on one of the
+                                    runtime's workers, which must not be held up for good
+        :type timeout:              float
         '''
 
         self.location_id = location_id
@@ -38,18 +44,30 @@ class UpdateWeather:
         self.fcst_period = fcst_period
         self.update_freq = update_freq
         self.time_zone = time_zone
-        # note openweathermap.org updates weather data every 10 minutes, no need to check more often than that.
-        #set up thread to run weather update loop in
-        weather_loop = threading.Thread(target=self.weather_update)
-        weather_loop.start()
+        self.timeout = timeout
         # make dictionary to hold weather info, see description in weather_update
         self.weather_info = {"current":{"time":0,"desc":"","temp":0,"wind":0,"wind_dir":" "},
                              "forecast":{"time":0,"desc":"","temp":0,"wind":0,"wind_dir":" "}}
+        # note openweathermap.org updates weather data every 10 minutes, no need to check more often than that.
+        if runtime is not None:
+            runtime.every(self.update_freq*60, self.get_weather, name='weather update')
+        else:
+            #set up thread to run weather update loop in
+            weather_loop = threading.Thread(target=self.weather_update)
+            weather_loop.start()
 
     def weather_update(self):
         '''
+        loops every update_freq and gets updated current weather and forecast, runs in its own thread
+        '''
+        while True:
+            self.get_weather()
+            time.sleep(self.update_freq*60)
 
-        loops every update_freq and gets updated current weather and forecast from openweathermap.org
+    def get_weather(self):
+        '''
+
+        gets updated current weather and forecast from openweathermap.org
         puts weather info into a nested dictionary called weather_info
                 [current][forecast]
                     [time][desc][temp][wind][wind_dir] (for both current and forecast]
@@ -64,69 +82,68 @@ class UpdateWeather:
         :type timezone:     int
         '''
 
-        while True:
-
-            # make urls to get weather data. go to openweathermap.org for details
-            current_url = "http://api.openweathermap.org/data/2.5/weather?id=" + \
-                          self.location_id + "&appid=" + self.auth_key
-            forecast_url = "http://api.openweathermap.org/data/2.5/forecast?id=" +\
-                           self.location_id + "&appid=" + self.auth_key
-
-            # get current weather data, json format
-            current_json = requests.get(current_url).json()
-            # get current weather time, put in weather_info
-            current_time = datetime.datetime.fromtimestamp(current_json["dt"]).strftime('%Hh')
-            self.weather_info["current"]["time"] = current_time
-            self.weather_info["current"]["desc"] = current_json["weather"][0]["description"]
-            self.weather_info["current"]["temp"] = round(current_json["main"]["temp"] - 273)
-            self.weather_info["current"]["wind"] = round(current_json["wind"]["speed"] * 3.6)
-            # get wind direction, have to convert from degrees to cardinal
-            #   multiply by 3.6 to convert from m/sec to km/hr
-            # get wind direction.  if wind speed is 0 then there is no wind direction in the json, if so make windspeed 0
-            try:
-                current_wind_deg = current_json["wind"]["dir"]
-            except:
-                current_wind_deg = 0
-            # convert to cardinal
-            self.weather_info["current"]["wind_dir"] = self.degrees_to_cardinal(deg=current_wind_deg)
-
-            # get forecast json
-            forecast_json = requests.get(forecast_url).json()
-            # put forecast weather time, description, temperature and put in weather_info dictionary
-            # get current time of forecast un unix utc format
-            forecast_time_unix_utc = forecast_json["list"][self.fcst_period]["dt"]
-            # convert timestamp into a python datetime object
-            forecast_time = datetime.datetime.fromtimestamp(forecast_time_unix_utc)
-
-            # add timezone information, so daylight savings time works properly
-            forecast_time_local = pytz.timezone(self.time_zone).localize(forecast_time)
-
-            print("**********getting forecast*******")
-            print("forecast time:", forecast_time_local)
-            #check to see if it is not dst, is so add 1 hour to the time
-            # openweathermap.org gets dst backwards, in winter we have to add one hour to get the correct forecast time
-            if self.is_not_dst():
-                forecast_time_local =forecast_time_local + datetime.timedelta(hours=1)
-                print ("adding one hour to adjust for no dst")
-            forecast_time_hour = forecast_time_local.strftime('%H')
-            print("just the hour: ", forecast_time_hour)
-            # convert time to local and format and put into weather_info
-            self.weather_info["forecast"]["time"] = forecast_time_hour
-
-            # put forecast desc and temp into weather_info
-            self.weather_info["forecast"]["desc"] = \
-                forecast_json["list"][self.fcst_period]["weather"][0]["description"]
-            self.weather_info["forecast"]["temp"] = \
-                round(forecast_json["list"][self.fcst_period]["main"]["temp"] - 273)
-            #   temperatures are in kelvin, subtract 273 to get celsius and round to one decimal place
-            # get wind direction and speed
-            self.weather_info["forecast"]["wind"] = round(forecast_json["list"][self.fcst_period]["wind"]["speed"] *3.6)
-            fcst_wind_dir_deg = round(forecast_json["list"][self.fcst_period]["wind"]["deg"])
-            fcst_wind_dir_arrows = self.degrees_to_arrows(deg=fcst_wind_dir_deg)
-            fcst_wind_dir_card = self.degrees_to_cardinal(deg = fcst_wind_dir_deg)
-            self.weather_info["forecast"]["wind_dir"] = fcst_wind_dir_card
-
-            time.sleep(self.update_freq*60)
+        # make urls to get weather data. go to openweathermap.org for details
+        current_url = "http://api.openweathermap.org/data/2.5/weather?id=" + \
+                      self.location_id + "&appid=" + self.auth_key
+        forecast_url = "http://api.openweathermap.org/data/2.5/forecast?id=" +\
+                       self.location_id + "&appid=" + self.auth_key
+
+        # get current weather data, json format.  If we can't get it keep the weather we have
+        try:
+            current_json = requests.get(current_url, timeout=self.timeout).json()
+            forecast_json = requests.get(forecast_url, timeout=self.timeout).json()
+        except (requests.RequestException, ValueError) as e:
+            print("Could not get the weather:", e)
+            return
+        # get current weather time, put in weather_info
+        current_time = datetime.datetime.fromtimestamp(current_json["dt"]).strftime('%Hh')
+        self.weather_info["current"]["time"] = current_time
+        self.weather_info["current"]["desc"] = current_json["weather"][0]["description"]
+        self.weather_info["current"]["temp"] = round(current_json["main"]["temp"] - 273)
+        self.weather_info["current"]["wind"] = round(current_json["wind"]["speed"] * 3.6)
+        # get wind direction, have to convert from degrees to cardinal
+        #   multiply by 3.6 to convert from m/sec to km/hr
+        # get wind direction.  if wind speed is 0 then there is no wind direction in the json, if so make windspeed 0
+        try:
+            current_wind_deg = current_json["wind"]["dir"]
+        except:
+            current_wind_deg = 0
+        # convert to cardinal
+        self.weather_info["current"]["wind_dir"] = self.degrees_to_cardinal(deg=current_wind_deg)
+
+        # put forecast weather time, description, temperature and put in weather_info dictionary
+        # get current time of forecast un unix utc format
+        forecast_time_unix_utc = forecast_json["list"][self.fcst_period]["dt"]
+        # convert timestamp into a python datetime object
+        forecast_time = datetime.datetime.fromtimestamp(forecast_time_unix_utc)
+
+        # add timezone information, so daylight savings time works properly
+        forecast_time_local = pytz.timezone(self.time_zone).localize(forecast_time)
+
+        print("**********getting forecast*******")
+        print("forecast time:", forecast_time_local)
+        #check to see if it is not dst, is so add 1 hour to the time
+        # openweathermap.org gets dst backwards, in winter we have to add one hour to get the correct forecast time
+        if self.is_not_dst():
+            forecast_time_local =forecast_time_local + datetime.timedelta(hours=1)
+            print ("adding one hour to adjust for no dst")
+        forecast_time_hour = forecast_time_local.strftime('%H')
+        print("just the hour: ", forecast_time_hour)
+        # convert time to local and format and put into weather_info
+        self.weather_info["forecast"]["time"] = forecast_time_hour
+
+        # put forecast desc and temp into weather_info
+        self.weather_info["forecast"]["desc"] = \
+            forecast_json["list"][self.fcst_period]["weather"][0]["description"]
+        self.weather_info["forecast"]["temp"] = \
+            round(forecast_json["list"][self.fcst_period]["main"]["temp"] - 273)
+        #   temperatures are in kelvin, subtract 273 to get celsius and round to one decimal place
+        # get wind direction and speed
+        self.weather_info["forecast"]["wind"] = round(forecast_json["list"][self.fcst_period]["wind"]["speed"] *3.6)
+        fcst_wind_dir_deg = round(forecast_json["list"][self.fcst_period]["wind"]["deg"])
+        fcst_wind_dir_arrows = self.degrees_to_arrows(deg=fcst_wind_dir_deg)
+        fcst_wind_dir_card = self.degrees_to_cardinal(deg = fcst_wind_dir_deg)
+        self.weather_info["forecast"]["wind_dir"] = fcst_wind_dir_card
 
     def degrees_to_cardinal(self,deg = 0):
         '''
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+"""
+Reports on the wallbox play history (PlayHistory, play_history.db): the top selections in each page set, plays by
+hour of the day and day of the week, the selections in each page set that have never been played, and the most played
+artists and songs.
+
+The reports come from running totals kept in the same database (the agg_ tables).  Each run adds only the plays
+recorded since the last run to the totals, with SQLite doing the counting, so it is quick and doesn't use more memory
+however long the history gets.  The wallbox can keep recording while this runs.
+
+Never played needs the compiled page sets in pageset_cache, which the wallbox makes the first time it loads each page
+set, for the titles of the selections.
+
+Examples:
+    python3 history.py
+    python3 history.py top --pageset Party -n 20
+    python3 history.py hours weekdays
+    python3 history.py --rebuild artists
+"""
+
+import argparse
+import json
+import os
+import time
+import PlayHistory
+
+PAGESET_FILE = "wallbox_pages_nocomments.json"
+PAGESET_CACHE_DIR = "pageset_cache"
+WEEKDAYS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+REPORTS = ('top', 'hours', 'weekdays', 'never', 'artists', 'songs')
+
+# empty strings instead of NULLs in the keys, NULLs are never equal so they would never be added together
+AGGREGATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS agg_state (
+    name            TEXT PRIMARY KEY,
+    value           INTEGER
+);
+CREATE TABLE IF NOT EXISTS agg_selections (
+    pageset         TEXT NOT NULL,
+    letter_number   TEXT NOT NULL,
+    title           TEXT NOT NULL,
+    artist          TEXT NOT NULL,
+    plays           INTEGER NOT NULL,
+    last_played     REAL,
+    PRIMARY KEY (pageset, letter_number, title, artist)
+);
+CREATE TABLE IF NOT EXISTS agg_hours (
+    hour            INTEGER PRIMARY KEY,    -- local time, 0 - 23
+    plays           INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS agg_weekdays (
+    weekday         INTEGER PRIMARY KEY,    -- local time, 0 is sunday
+    plays           INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS agg_artists (
+    artist          TEXT PRIMARY KEY,
+    plays           INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS agg_songs (
+    title           TEXT NOT NULL,
+    artist          TEXT NOT NULL,
+    plays           INTEGER NOT NULL,
+    PRIMARY KEY (title, artist)
+);
+"""
+
+# each adds the plays with ids between the two parameters to one of the agg_ tables.  Plays without a time (imported
+# from played_songs.txt) are not in the hours and weekdays
+AGGREGATE_UPDATES = (
+    """INSERT INTO agg_selections (pageset, letter_number, title, artist, plays, last_played)
+       SELECT coalesce(pageset, ''), coalesce(letter_number, ''), coalesce(title, ''), coalesce(artist, ''),
+              count(*), max(time)
+       FROM plays WHERE id > ? AND id <= ?
+       GROUP BY 1, 2, 3, 4
+       ON CONFLICT (pageset, letter_number, title, artist)
+       DO UPDATE SET plays = plays + excluded.plays, last_played = max(last_played, excluded.last_played)""",
+    """INSERT INTO agg_hours (hour, plays)
+       SELECT CAST(strftime('%H', time, 'unixepoch', 'localtime') AS INTEGER), count(*)
+       FROM plays WHERE id > ? AND id <= ? AND time IS NOT NULL
+       GROUP BY 1
+       ON CONFLICT (hour) DO UPDATE SET plays = plays + excluded.plays""",
+    """INSERT INTO agg_weekdays (weekday, plays)
+       SELECT CAST(strftime('%w', time, 'unixepoch', 'localtime') AS INTEGER), count(*)
+       FROM plays WHERE id > ? AND id <= ? AND time IS NOT NULL
+       GROUP BY 1
+       ON CONFLICT (weekday) DO UPDATE SET plays = plays + excluded.plays""",
+    """INSERT INTO agg_artists (artist, plays)
+       SELECT coalesce(artist, ''), count(*)
+       FROM plays WHERE id > ? AND id <= ?
+       GROUP BY 1
+       ON CONFLICT (artist) DO UPDATE SET plays = plays + excluded.plays""",
+    """INSERT INTO agg_songs (title, artist, plays)
+       SELECT coalesce(title, ''), coalesce(artist, ''), count(*)
+       FROM plays WHERE id > ? AND id <= ?
+       GROUP BY 1, 2
+       ON CONFLICT (title, artist) DO UPDATE SET plays = plays + excluded.plays""",
+)
+
+
+def connect(db_file):
+    """
+    :return:    a connection to the history database, with the plays and agg_ tables made if they are not there yet
+    :rtype:     sqlite3.Connection
+    """
+    connection = PlayHistory.connect(db_file)
+    connection.executescript(AGGREGATE_SCHEMA)
+    return connection
+
+
+def update_aggregates(connection, rebuild = False):
+    """
+    Adds the plays recorded since the last update to the agg_ tables, all in one transaction.
+
+    :param connection:  connection to the history database
+    :type connection:   sqlite3.Connection
+    :param rebuild:     if True the totals are started again from the first play
+    :type rebuild:      bool
+    :return:            number of plays added to the totals
+    :rtype:             int
+    """
+    start_time = time.time()
+    with connection:
+        if rebuild:
+            for table in ('agg_state', 'agg_selections', 'agg_hours', 'agg_weekdays', 'agg_artists', 'agg_songs'):
+                connection.execute("DELETE FROM " + table)
+        row = connection.execute("SELECT value FROM agg_state WHERE name = 'last_id'").fetchone()
+        last_id = row[0] if row is not None else 0
+        # the wallbox may be adding plays while we count, so only count up to the last play there is now
+        top_id = connection.execute("SELECT max(id) FROM plays").fetchone()[0] or 0
+        if top_id <= last_id:
+            return 0
+        added = connection.execute("SELECT count(*) FROM plays WHERE id > ? AND id <= ?",
+                                   (last_id, top_id)).fetchone()[0]
+        for update in AGGREGATE_UPDATES:
+            connection.execute(update, (last_id, top_id))
+        connection.execute("INSERT OR REPLACE INTO agg_state (name, value) VALUES ('last_id', ?)", (top_id,))
+    print("Added", added, "plays to the totals in", round(time.time() - start_time, 2), "s")
+    return added
+
+
+def print_table(rows, headings):
+    """
+    Prints rows in columns, each as wide as its widest value.
+    """
+    rows = [[str(value) for value in row] for row in rows]
+    widths = [max([len(heading)] + [len(row[column]) for row in rows]) for column, heading in enumerate(headings)]
+    for row in [headings] + rows:
+        print("  " + "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def report_top(connection, count, pageset = None):
+    pagesets = [pageset] if pageset is not None else \
+        [row[0] for row in connection.execute("SELECT DISTINCT pageset FROM agg_selections ORDER BY pageset")]
+    for name in pagesets:
+        rows = connection.execute("""SELECT letter_number, title, artist, plays, last_played FROM agg_selections
+                                     WHERE pageset = ? ORDER BY plays DESC, last_played DESC LIMIT ?""",
+                                  (name, count)).fetchall()
+        print("\nTop selections,", name or "no page set")
+        # plays imported from played_songs.txt have no time
+        print_table([(letter_number, title, artist, plays,
+                      time.strftime("%Y-%m-%d", time.localtime(last_played)) if last_played is not None else "")
+                     for letter_number, title, artist, plays, last_played in rows],
+                    ["", "Title", "Artist", "Plays", "Last played"])
+
+
+def report_hours(connection):
+    plays = dict(connection.execute("SELECT hour, plays FROM agg_hours"))
+    most = max(plays.values(), default=0)
+    print("\nPlays by hour of the day")
+    for hour in range(24):
+        count = plays.get(hour, 0)
+        print("  {:02d}:00 {:>8}  {}".format(hour, count, "#" * round(40 * count / most) if most else "").rstrip())
+
+
+def report_weekdays(connection):
+    plays = dict(connection.execute("SELECT weekday, plays FROM agg_weekdays"))
+    most = max(plays.values(), default=0)
+    print("\nPlays by day of the week")
+    for weekday, name in enumerate(WEEKDAYS):
+        count = plays.get(weekday, 0)
+        print("  {:<9} {:>8}  {}".format(name, count, "#" * round(40 * count / most) if most else "").rstrip())
+
+
+def report_never(connection, pageset_file, cache_dir, pageset = None):
+    try:
+        with open(pageset_file, "r") as json_file:
+            page_sets = json.load(json_file)
+    except (OSError, ValueError) as e:
+        print("\nNever played\n  could not read the page sets,", e)
+        return
+    for page, page_set in page_sets.items():
+        name = page_set['page_set_name']
+        if pageset is not None and name != pageset:
+            continue
+        print("\nNever played,", name)
+        try:
+            with open(os.path.join(cache_dir, page + ".json"), "r") as file:
+                tracks = json.load(file)['tracks']
+        except (OSError, ValueError, KeyError):
+            print("  not compiled yet, load it on the wallbox first")
+            continue
+        played = set(connection.execute("SELECT letter_number, title FROM agg_selections WHERE pageset = ?",
+                                        (name,)))
+        never = [(track['letter_number'], track['title'], track['artist']) for track in tracks
+                 if (track['letter_number'], track['title']) not in played]
+        print_table(never, ["", "Title", "Artist"])
+        print("  {} of {} selections".format(len(never), len(tracks)))
+
+
+def report_artists(connection, count):
+    print("\nMost played artists")
+    print_table(connection.execute("SELECT artist, plays FROM agg_artists ORDER BY plays DESC LIMIT ?", (count,)),
+                ["Artist", "Plays"])
+
+
+def report_songs(connection, count):
+    print("\nMost played songs")
+    print_table(connection.execute("SELECT title, artist, plays FROM agg_songs ORDER BY plays DESC LIMIT ?",
+                                   (count,)),
+                ["Title", "Artist", "Plays"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports on the wallbox play history")
+    # the reports are checked below, some versions of argparse check an empty list against the choices and fail
+    parser.add_argument('reports', nargs='*', metavar='report',
+                        help="reports to print, any of " + ", ".join(REPORTS + ('all',)) +
+                             ", default is all of them")
+    parser.add_argument('--db', default='play_history.db', help="play history database")
+    parser.add_argument('--pageset', help="only this page set, by name, for the top and never reports")
+    parser.add_argument('-n', '--count', type=int, default=10, help="number of rows in the top, artists and songs "
+                                                                     "reports")
+    parser.add_argument('--pages', default=PAGESET_FILE, help="page set json file, for the never report")
+    parser.add_argument('--cache-dir', default=PAGESET_CACHE_DIR, help="compiled page sets, for the never report")
+    parser.add_argument('--rebuild', action='store_true', help="start the totals again from the first play")
+    # reports and options in any order
+    args = parser.parse_intermixed_args()
+    for report in args.reports:
+        if report not in REPORTS + ('all',):
+            parser.error("unknown report " + report + ", choose from " + ", ".join(REPORTS + ('all',)))
+
+    reports = REPORTS if not args.reports or 'all' in args.reports else args.reports
+    connection = connect(args.db)
+    update_aggregates(connection, rebuild=args.rebuild)
+    for report in reports:
+        if report == 'top':
+            report_top(connection, args.count, args.pageset)
+        elif report == 'hours':
+            report_hours(connection)
+        elif report == 'weekdays':
+            report_weekdays(connection)
+        elif report == 'never':
+            report_never(connection, args.pages, args.cache_dir, args.pageset)
+        elif report == 'artists':
+            report_artists(connection, args.count)
+        elif report == 'songs':
+            report_songs(connection, args.count)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
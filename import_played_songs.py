@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""
+Imports the old played_songs.txt into the play history database (PlayHistory, play_history.db), so history.py can
+report on it.
+
+The old file is one long line.  Each play was written as
+
+    title;artist;page set;album art url/n
+
+with a "/n" (not a newline) at the end, and nothing escaped.  So a title or an album art url can have ; in it, and an
+album art url can even have /n in it.  The file is memory mapped and the plays are found with find(), one small slice
+at a time, instead of reading the whole file into one string; the plays are written in batches, all in one
+transaction.  The old file has no times, so the plays are imported without one (they aren't in the hours and weekdays
+reports), with the type "played_songs.txt".
+
+Records that can't be read are counted, and listed with where they are in the file.
+
+Examples:
+    python3 import_played_songs.py
+    python3 import_played_songs.py old/played_songs.txt --db play_history.db --bad bad_records.txt
+"""
+
+import argparse
+import mmap
+import os
+import time
+import PlayHistory
+
+SEPARATOR = b'/n'
+IMPORT_TYPE = 'played_songs.txt'
+
+
+def read_records(file_name):
+    """
+    Finds the plays in the old file.
+
+    The album art url always starts with http, so the fields are split at the first ";http": the url is everything
+    after it, and title;artist;page set is everything before it, split at the last two ; (so a title can have ; in
+    it).  A piece between two "/n" that is the rest of an album art url that had "/n" in it is put back on the url,
+    see is_url_rest.
+
+    :param file_name:   the old played songs file
+    :type file_name:    str
+    :return:            generator of tuples; the offset of the record in the file, and either the fields (title,
+                        artist, page set, album art url) or None if the record couldn't be read
+    :rtype:             generator
+    """
+    with open(file_name, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pending = None              # (offset, bytes) of the record before, until we know it is finished
+            start = 0
+            while start < len(data):
+                end = data.find(SEPARATOR, start)
+                if end == -1:
+                    end = len(data)
+                record = data[start:end]
+                if pending is not None and is_url_rest(pending[1], record):
+                    # a /n in an album art url, not the end of the record
+                    pending = (pending[0], pending[1] + SEPARATOR + record)
+                else:
+                    if pending is not None:
+                        yield pending[0], parse_record(pending[1])
+                    pending = (start, record) if record.strip() else None
+                start = end + len(SEPARATOR)
+            if pending is not None:
+                yield pending[0], parse_record(pending[1])
+
+
+def is_url_rest(record, piece):
+    """
+    :return:    True if piece is the rest of the album art url at the end of record, cut off by a /n in the url; the
+                record has a url, the piece can't be read as a record, and it has no spaces, which a url can't have
+    :rtype:     bool
+    """
+    return b';http' in record and piece.split() == [piece] and parse_record(piece) is None
+
+
+def parse_record(record):
+    """
+    :return:    the fields of a record from the old file; title, artist, page set, album art url.  None if it can't be
+                read
+    :rtype:     tuple
+    """
+    try:
+        text = record.decode('utf-8').strip()
+    except UnicodeDecodeError:
+        return None
+    art_start = text.find(';http')
+    if art_start != -1:
+        head, album_art = text[:art_start], text[art_start + 1:]
+    elif text.endswith(';'):
+        # no album art
+        head, album_art = text[:-1], ''
+    else:
+        return None
+    fields = head.rsplit(';', 2)
+    if len(fields) != 3 or not fields[0]:
+        return None
+    title, artist, pageset = fields
+    return title, artist, pageset, album_art
+
+
+def import_played_songs(file_name, db_file, batch_size = 10000, bad_file = None, force = False):
+    """
+    Imports the old file into the history database.
+
+    :param file_name:   the old played songs file
+    :type file_name:    str
+    :param db_file:     the history database
+    :type db_file:      str
+    :param batch_size:  plays written with one executemany
+    :type batch_size:   int
+    :param bad_file:    file to write the records that couldn't be read to, with their offsets, if not None
+    :type bad_file:     str
+    :param force:       import even if plays have been imported before
+    :type force:        bool
+    :return:            a tuple; the number of plays imported, and the number of bad records
+    :rtype:             tuple
+    """
+    start_time = time.time()
+    connection = PlayHistory.connect(db_file)
+    if not force and connection.execute("SELECT 1 FROM plays WHERE type = ? LIMIT 1", (IMPORT_TYPE,)).fetchone():
+        print("played_songs.txt has already been imported, use --force to import it again")
+        connection.close()
+        return 0, 0
+    insert = "INSERT INTO plays (" + ", ".join(PlayHistory.COLUMNS) + ") VALUES (" + \
+             ", ".join("?" * len(PlayHistory.COLUMNS)) + ")"
+    imported = 0
+    bad = []
+    batch = []
+    with connection:
+        for offset, fields in read_records(file_name):
+            if fields is None:
+                bad.append(offset)
+                continue
+            title, artist, pageset, album_art = fields
+            play = {'title': title, 'artist': artist, 'pageset': pageset, 'type': IMPORT_TYPE}
+            batch.append(tuple(play.get(column) for column in PlayHistory.COLUMNS))
+            if len(batch) >= batch_size:
+                connection.executemany(insert, batch)
+                imported += len(batch)
+                batch = []
+                print("\rImported", imported, "plays,", len(bad), "bad records", end="", flush=True)
+        connection.executemany(insert, batch)
+        imported += len(batch)
+    connection.close()
+    elapsed = time.time() - start_time
+    print("\rImported", imported, "plays,", len(bad), "bad records, in", round(elapsed, 2), "s",
+          "({:.0f} plays/s)".format(imported / elapsed if elapsed else 0))
+    if bad:
+        report_bad(file_name, bad, bad_file)
+    return imported, len(bad)
+
+
+def report_bad(file_name, offsets, bad_file = None):
+    """
+    Prints the first few bad records, and writes them all to bad_file if it is given.
+    """
+    with open(file_name, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        def record_at(offset):
+            end = data.find(SEPARATOR, offset)
+            return data[offset:end if end != -1 else len(data)].decode('utf-8', 'replace')
+
+        print("Bad records (offset in the file, record):")
+        for offset in offsets[:10]:
+            print("  ", offset, record_at(offset)[:100])
+        if len(offsets) > 10:
+            print("   ... and", len(offsets) - 10, "more")
+        if bad_file is not None:
+            with open(bad_file, 'w') as out:
+                for offset in offsets:
+                    out.write(str(offset) + '\t' + record_at(offset) + '\n')
+            print("All the bad records are in", bad_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the old played_songs.txt into the play history database")
+    parser.add_argument('file', nargs='?', default='played_songs.txt', help="the old played songs file")
+    parser.add_argument('--db', default='play_history.db', help="play history database")
+    parser.add_argument('--bad', help="write the records that couldn't be read to this file")
+    parser.add_argument('--force', action='store_true', help="import even if it has been imported before")
+    args = parser.parse_args()
+    import_played_songs(args.file, args.db, bad_file=args.bad, force=args.force)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""
+Makes a "Most Played" page set from the play history (PlayHistory, play_history.db): a sonos playlist of the most
+played tracks, and a page set for it in wallbox_pages_nocomments.json, ready for the wallbox
+(SonosUtils.make_pageset_tracklist) and LabelMaker.py.
+
+The page set starts with the favorites and playlists sections of a base page set (Great Songs, A1 - F2) and the rest
+of the selections (185 of them) are the most played tracks, most played first.  The tracks are ranked with
+heapq.nlargest over the play counts, which keeps only the top ones, so it doesn't use more memory however long the
+history is.  Only tracks from playlist sections can be put in a sonos playlist, so favorites and playlists that were
+played, and plays imported from played_songs.txt (they have no uri), are not ranked.  If not enough different tracks
+have been played, the rest are filled with tracks from the base page set.
+
+The tracks are added to the sonos playlist with the metadata from the compiled page sets in pageset_cache, the same
+metadata the wallbox plays them with.  The sonos playlist is made again each time, and the page set is replaced.
+
+Examples:
+    python3 make_most_played.py --tag 0005
+    python3 make_most_played.py --tag 0005 --base 64426259543 --name "Party Hits" --dry-run
+"""
+
+import argparse
+import heapq
+import json
+import os
+import SonosUtils
+import PlayHistory
+from soco.data_structures_entry import from_didl_string
+
+SELECTIONS = 200        # selections on a wallbox page set
+
+
+def rank_tracks(connection, count):
+    """
+    :param connection:  connection to the history database
+    :type connection:   sqlite3.Connection
+    :param count:       number of tracks to rank
+    :type count:        int
+    :return:            the most played tracks, most played first; each is a tuple of the plays, the time it was last
+                        played, uri, title and artist
+    :rtype:             list
+    """
+    # sqlite counts the plays of each track, and hands them over a row at a time
+    rows = connection.execute("""SELECT count(*), max(time), uri, max(title), max(artist) FROM plays
+                                 WHERE type = 'sonos_playlist_tracks' AND uri IS NOT NULL GROUP BY uri""")
+    return heapq.nlargest(count, rows, key=lambda row: (row[0], row[1] or 0))
+
+
+def cached_items(uris, cache_dir):
+    """
+    :return:    the didl xml for each of the uris that is in a compiled page set, by uri
+    :rtype:     dict
+    """
+    items = {}
+    for file_name in sorted(os.listdir(cache_dir)) if os.path.isdir(cache_dir) else []:
+        compiled = SonosUtils.load_compiled_pageset(os.path.join(cache_dir, file_name))
+        if compiled is None:
+            continue
+        for track in compiled.get('tracks', []):
+            if track.get('type') == 'sonos_playlist_tracks' and track.get('ddl_item') is not None:
+                uri = from_didl_string(track['ddl_item'])[0].resources[0].uri
+                if uri in uris:
+                    items.setdefault(uri, track['ddl_item'])
+    return items
+
+
+def base_tracks(base, cache_dir):
+    """
+    :return:    the uri and didl xml of the playlist tracks in the compiled base page set, in order, to fill with
+    :rtype:     list
+    """
+    compiled = SonosUtils.load_compiled_pageset(os.path.join(cache_dir, base + ".json"))
+    if compiled is None:
+        return []
+    tracks = []
+    for track in compiled['tracks']:
+        if track['type'] == 'sonos_playlist_tracks' and track['ddl_item'] is not None:
+            item = track['ddl_item']
+            tracks.append((from_didl_string(item)[0].resources[0].uri, item))
+    return tracks
+
+
+def make_playlist(unit, name, items):
+    """
+    Makes the sonos playlist, replacing it if there is one with that name.
+
+    :param unit:        sonos unit
+    :type unit:         object
+    :param name:        name of the playlist
+    :type name:         str
+    :param items:       didl xml of each track, in order
+    :type items:        list
+    """
+    for old in unit.get_sonos_playlists():
+        if old.title == name:
+            unit.remove_sonos_playlist(old)
+    playlist = unit.create_sonos_playlist(name)
+    # each add gives us the update id for the next one, so we don't have to browse the playlist for it every time
+    update_id = SonosUtils.container_update_id(unit, playlist.item_id)
+    for item in items:
+        didl = from_didl_string(item)[0]
+        response = unit.avTransport.AddURIToSavedQueue([
+            ("InstanceID", 0),
+            ("UpdateID", update_id),
+            ("ObjectID", playlist.item_id),
+            ("EnqueuedURI", didl.resources[0].uri),
+            ("EnqueuedURIMetaData", item),
+            ("AddAtIndex", 4294967295),     # the end of the playlist
+        ])
+        update_id = response["NewUpdateID"]
+    print("Made sonos playlist", name, "with", len(items), "tracks")
+
+
+def make_pageset(base_set, name, playlist_name):
+    """
+    :return:    the page set; the favorites and playlists sections of the base page set, then a playlist tracks
+                section for the rest of the selections.  And the number of selections the playlist section has.
+    :rtype:     tuple
+    """
+    sections = [dict(section) for section in base_set['sections'] if section['type'] != 'sonos_playlist_tracks']
+    # the playlist tracks start after the last label the other sections use
+    start = max([int(section['end_label']) + 1 for section in sections], default=0)
+    sections.append({"name": "Main", "type": "sonos_playlist_tracks", "playlist_name": playlist_name,
+                     "repeat": "False", "start_label": str(start), "end_label": str(SELECTIONS - 1)})
+    return {"page_set_name": name, "sections": sections}, SELECTIONS - start
+
+
+def save_pageset(pageset_file, tag, page_set):
+    """
+    Adds or replaces the page set in the json file.
+    """
+    with open(pageset_file, "r") as json_file:
+        page_sets = json.load(json_file)
+    page_sets[tag] = page_set
+    SonosUtils.atomic_write(pageset_file, json.dumps(page_sets, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Make a Most Played page set and sonos playlist from the play history")
+    parser.add_argument('--tag', required=True, help="rfid tag number for the page set")
+    parser.add_argument('--name', default="Most Played", help="name of the page set and the sonos playlist")
+    parser.add_argument('--base', default="64426258266",
+                        help="page set to take the favorites and playlists sections, and tracks to fill with, from")
+    parser.add_argument('--db', default='play_history.db', help="play history database")
+    parser.add_argument('--pages', default=SonosUtils.PAGESET_FILE, help="page set json file")
+    parser.add_argument('--cache-dir', default=SonosUtils.PAGESET_CACHE_DIR, help="compiled page sets")
+    parser.add_argument('--ip', default="192.168.1.35", help="sonos unit to use if none are found")
+    parser.add_argument('--dry-run', action='store_true', help="print the tracks, don't change anything")
+    args = parser.parse_args()
+
+    page_set, count = make_pageset(SonosUtils.load_page_set(args.base, args.pages), args.name, args.name)
+    connection = PlayHistory.connect(args.db)
+    ranked = rank_tracks(connection, count)
+    connection.close()
+    items = cached_items({uri for plays, last_played, uri, title, artist in ranked}, args.cache_dir)
+
+    tracks = []
+    for plays, last_played, uri, title, artist in ranked:
+        if uri in items:
+            tracks.append((uri, items[uri]))
+            print("{:>3} {:>6}  {} - {}".format(len(tracks), plays, title, artist))
+        else:
+            print("   not in a compiled page set, left out:", title, "-", artist)
+    if len(tracks) < count:
+        used = {uri for uri, item in tracks}
+        fill = [track for track in base_tracks(args.base, args.cache_dir) if track[0] not in used]
+        print("Only", len(tracks), "played tracks, filling", min(count - len(tracks), len(fill)), "from the base page set")
+        tracks.extend(fill[:count - len(tracks)])
+    if len(tracks) < count:
+        # the wallbox needs all the selections filled
+        print("Not enough tracks for the page set, need", count, "have", len(tracks))
+        return
+    if args.dry_run:
+        print(json.dumps({args.tag: page_set}, indent=2))
+        return
+
+    make_playlist(SonosUtils.get_any_sonos(args.ip), args.name, [item for uri, item in tracks])
+    save_pageset(args.pages, args.tag, page_set)
+    print("Saved page set", args.name, "as", args.tag, "in", args.pages)
+
+
+if __name__ == '__main__':
+    main()
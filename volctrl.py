@@ -2,49 +2,64 @@
 
 import SonosHW                  # has the hardware bits - rotary encoder, display, etc
 import SonosControl             # has classes for controlling the sonos system
+import SonosRuntime             # event loop and thread pool everything runs on
 import RPi.GPIO as GPIO
 import time
 import OLEDDisplay
+from Weather import UpdateWeather
 
 '''
 Raspberry pi zero based Sonos music system controller.
 
 See modules SonosHW and SonosControl for class details
 
+The loops that check the sonos unit, the weather and the display timer all run on one asyncio event loop
+(SonosRuntime), and the GPIO callbacks are passed to it, so the pi zero is not switching between a pile of threads.
+
 https://github.com/gshorten/volcontrol
 https://sites.google.com/shortens.ca/sonoswallbox/portable-sonos-volume-control
       
 '''
 
+# event loop and thread pool that everything runs on
+Runtime = SonosRuntime.Runtime(max_workers=2)
+
+# weather, shown when the button is pushed and nothing is playing
+Weather = UpdateWeather(update_freq=10, runtime=Runtime)
+
 # instance LCD display
-Display = OLEDDisplay.OLED(char_width=22)
+Display = OLEDDisplay.OLED(char_width=22, runtime=Runtime)
 
 # All sonos units; methods to change unit with pushbutton
-Units = SonosControl.SonosUnits(default_name="Garage", display=Display)
+Units = SonosControl.SonosUnits(default_name="Garage", display=Display, runtime=Runtime)
 
 # create play state change LED object and playstate control
 # it changes the colour of the VolCtrlLED based on if the sonos is paused or playing
 VCBPlaystateLED = SonosControl.PlaystateLED(Units, green=6, blue=13, red=5, on="low")
 
+# Display updater
+Updater = SonosControl.SonosDisplayUpdater(Units, Display, VCBPlaystateLED, Weather, runtime=Runtime)
+
 # class instance for the volume control; methods to change volume
-VCBRotaryControl = SonosControl.SonosVolCtrl(units=Units, updater=, display=Display, vol_ctrl_led=VCBPlaystateLED,
-                                             weather=, up_increment=4, down_increment=5)
+VCBRotaryControl = SonosControl.SonosVolCtrl(units=Units, updater=Updater, display=Display, vol_ctrl_led=VCBPlaystateLED,
+                                             weather=Weather, up_increment=4, down_increment=5, runtime=Runtime)
 # instance of the rotary encoder
-VolumeKnob = SonosHW.RotaryEncoder(pinA=9, pinB=8, rotary_callback=VCBRotaryControl.change_volume)
+VolumeKnob = SonosHW.RotaryEncoder(pinA=9, pinB=8, rotary_callback=Runtime.bridge(VCBRotaryControl.change_volume))
 
 # instance of the volume control button
-VolumeButton = SonosHW.PushButtonShortLong(button_pin=12, callback=VCBRotaryControl.pause_play_skip,
-                                  gpio_up_down='down', long_press=1, debounce=25)
+VolumeButton = SonosHW.TimedButtonPress(pin=12, callback=Runtime.bridge(VCBRotaryControl.pause_play_skip),
+                                        long_press_sec=1)
 
 # little black button on front of volume control box; used to change sonos unit
-SelectUnitButton = SonosHW.SinglePressButton(pin=24, callback=Units.select_unit_single_press, gpio_up=1)
+SelectUnitButton = SonosHW.SinglePressButton(pin=24, callback=Runtime.bridge(Units.select_unit_single_press),
+                                             gpio_up=1)
 
 # Something to show on the screen when vol control box starts up
 Display.display_text("Volume Control", Units.active_unit_name, sleep=3)
-# Display updater
-Updater = SonosControl.SonosDisplayUpdater(Units, Display, VCBPlaystateLED)
 
 # get list of sonos units, print list
 Units.get_units()
-
-
+# release the GPIO pins when we shut down
+Runtime.on_shutdown(GPIO.cleanup)
+# run until we get SIGINT or SIGTERM
+Runtime.run()
@@ -5,8 +5,9 @@ Plays and controls a Sonos music system with inputs from a 1957 Seeburg wallbox.
 
 Has an 2x16 OLED display, rotary encoder for volume control, rgb playstate_led on the rotary control to indicate playstate,
 and a pushbutton for selecting the pageset that is loaded on the wallbox - ie, the selections that can be played.
-It's completely event driven, except for some loops that
-run in separate threads that listen for changes on the currently selected sonos unit.
+It's completely event driven.  The things that have to check on the sonos units, the weather, the display timer and the
+rfid reader all run on one asyncio event loop (SonosRuntime), blocking calls run in a small thread pool, and the
+GPIO callbacks are passed to the event loop so the GPIO thread is never held up by the network.
 
 When nothing is playing on the Sonos and the display is timed out the display shows the current and forecast weather.
 """
@@ -14,40 +15,64 @@ When nothing is playing on the Sonos and the display is timed out the display sh
 from SonosControl import *
 from SonosHW import *
 import OLED128X64
+import SonosRuntime
+import PlayHistory
+import AlbumArt
 from Weather import UpdateWeather
 
+# event loop and thread pool that everything runs on
+Runtime = SonosRuntime.Runtime(max_workers=2)
 # weather updater
-WeatherUpdater = UpdateWeather(update_freq=10)
+WeatherUpdater = UpdateWeather(update_freq=10, runtime=Runtime)
 # LCD on the wallbox
 WallboxLCD = OLED128X64.OLED(WeatherUpdater, showing_weather=False, char_width=24, pixels_high=64)
 # Sonos units
-Units = SonosUnits(display=WallboxLCD, default_name='Kitchen')
-#on start up trigger rfid read of loaded page manually
-# Wallbox sonos player
-SeeburgWallboxPlayer = WallboxPlayer(units=Units, display=WallboxLCD)
-# The Seeburg wallbox
-SeeburgWallbox = SonosHW.WallBox(pin=9, callback=SeeburgWallboxPlayer.play_selection)
+Units = SonosUnits(display=WallboxLCD, default_name='Kitchen', runtime=Runtime,
+                   candidate_ips=['192.168.1.8'])
 # Playstate change LED
 WallboxPlaystateLED = PlaystateLED(Units, green=6, blue=13, red=5, on="low")
+# album art thumbnails for the display, fetched before the tracks play
+WallboxArt = AlbumArt.AlbumArtCache(size=(64, 64))
 # Display updater
-Updater = SonosDisplayUpdater(Units, WallboxLCD, WallboxPlaystateLED, WeatherUpdater)
+Updater = SonosDisplayUpdater(Units, WallboxLCD, WallboxPlaystateLED, WeatherUpdater, runtime=Runtime,
+                              album_art=WallboxArt)
+#on start up trigger rfid read of loaded page manually
+# Wallbox sonos player
+# history of the selections played, written in the background
+History = PlayHistory.PlayHistory('play_history.db')
+SeeburgWallboxPlayer = WallboxPlayer(units=Units, display=WallboxLCD, updater=Updater, runtime=Runtime,
+                                     history=History)
+# fetch the art for the current track, and the next tracks in the jukebox queue
+WallboxArt.follow(Units.zone_state, SeeburgWallboxPlayer.queue_mirror)
+# keeps the page sets up to date when the sonos favorites or playlists are changed
+Library = LibraryWatcher(SeeburgWallboxPlayer, runtime=Runtime)
+# The Seeburg wallbox.  The pulses are counted on the GPIO thread, the selection is played in the thread pool
+# and the selection is got ready while the pulses are still coming in
+SeeburgWallbox = SonosHW.WallBox(pin=9, callback=SeeburgWallboxPlayer.play_selection, runtime=Runtime,
+                                 on_start=Runtime.bridge(SeeburgWallboxPlayer.prepare_selection),
+                                 on_letter=Runtime.bridge(SeeburgWallboxPlayer.prepare_letter))
 # Volume Control
 WallboxRotaryControl = SonosVolCtrl(units=Units, updater=Updater, display=WallboxLCD,
                                                  vol_ctrl_led=WallboxPlaystateLED, weather=WeatherUpdater,
-                                                 up_increment=4, down_increment=5)
+                                                 up_increment=4, down_increment=5, runtime=Runtime)
 # Rotary Encoder (for the volume control)
-VolumeKnob = RotaryEncoder(pinA=11, pinB=7, rotary_callback=WallboxRotaryControl.change_volume)
+VolumeKnob = RotaryEncoder(pinA=11, pinB=7, rotary_callback=Runtime.bridge(WallboxRotaryControl.change_volume))
 # button on the volume control
-PausePlayButton = TimedButtonPress(pin=12, callback=WallboxRotaryControl.pause_play_skip, long_press_sec=1)
+PausePlayButton = TimedButtonPress(pin=12, callback=Runtime.bridge(WallboxRotaryControl.pause_play_skip),
+                                   long_press_sec=1)
 # Button that manually selects wallbox pages
-SelectPageSetButton = ButtonPress(pin = 18,callback = SeeburgWallboxPlayer.select_wallbox_pageset)
+SelectPageSetButton = ButtonPress(pin = 18,callback = Runtime.bridge(SeeburgWallboxPlayer.select_wallbox_pageset))
 # display time out loop
-OLEDTimeOut = DisplayTimeOut(WallboxLCD,Updater,timeout=5)
+OLEDTimeOut = DisplayTimeOut(WallboxLCD,Updater,timeout=5, runtime=Runtime)
 # RFID reader that gets the page tag number and switches the wallbox page set
-PageReader = RFIDReader(callback = SeeburgWallboxPlayer.get_wallbox_tracks, port = "/dev/ttyUSB0")
+PageReader = RFIDReader(callback = SeeburgWallboxPlayer.get_wallbox_tracks, port = "/dev/ttyUSB0", runtime=Runtime)
 
 # Something to show on the screen when vol control box starts up
 print('active unit: :', Units.active_unit_name)
 # get list of sonos units, print list to console
 Units.get_units()
-
+# write the last of the play history, and release the GPIO pins when we shut down
+Runtime.on_shutdown(History.close)
+Runtime.on_shutdown(GPIO.cleanup)
+# run until we get SIGINT or SIGTERM
+Runtime.run()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+Replays wallbox pulse traces through WallboxDecoder.PulseDecoder, off the pi, and reports how many selections were
+decoded correctly, how long after the last pulse each selection was decoded, and how long the decoder takes per edge.
+
+Uses recorded traces (SonosHW.WallBox(trace_file=...) records them), made up trains with timing jitter and noise
+spikes, or both.
+
+Examples:
+    python3 wallbox_bench.py --trains 5000 --jitter 1.5 --noise 0.2
+    python3 wallbox_bench.py --trace wallbox_trace.txt
+    python3 wallbox_bench.py --trains 100 --save synthetic_trace.txt
+"""
+
+import argparse
+import difflib
+import random
+import statistics
+import time
+import WallboxDecoder
+
+PULSE = .078            # letter and number pulses, edge to edge
+GAP = .268              # gap between the letters and numbers, edge to edge
+
+
+def make_trains(count, jitter = 1.0, noise = 0.0, seed = None):
+    """
+    Makes trains of edges for random selections.
+
+    :param count:       number of selections
+    :type count:        int
+    :param jitter:      standard deviation of each interval, in milliseconds
+    :type jitter:       float
+    :param noise:       chance of a noise spike about 500ms after a train
+    :type noise:        float
+    :param seed:        random seed, so a run can be repeated
+    :type seed:         int
+    :return:            trains in the same form as WallboxDecoder.read_trace
+    :rtype:             list
+    """
+    rand = random.Random(seed)
+    trains = []
+    now = 0
+    for i in range(count):
+        selection = rand.randrange(200)
+        # time between selections
+        now += rand.uniform(2, 10)
+        edges = [now]
+        intervals = [PULSE] * (selection % 20 + 1) + [GAP] + [PULSE] * (selection // 20)
+        for interval in intervals:
+            now += interval + rand.gauss(0, jitter / 1000)
+            edges.append(now)
+        trains.append((selection, edges))
+        if rand.random() < noise:
+            now += rand.uniform(.4, .6)
+            trains.append((None, [now]))
+    return trains
+
+
+def replay(trains, quiet = WallboxDecoder.PulseDecoder.QUIET, max_train = WallboxDecoder.PulseDecoder.MAX_TRAIN):
+    """
+    Feeds the edges to a decoder, with the clock moved on to each edge in turn.  The train is finished when the
+    decoder says so, the same as SonosHW.WallBox does with its timer.
+
+    :return:    a tuple; the selections decoded, the seconds from the last edge of each train to it being decoded, and the
+                decoder's time per edge in seconds
+    :rtype:     tuple
+    """
+    decoder = WallboxDecoder.PulseDecoder(quiet, max_train)
+    decoded = []
+    latencies = []
+    cpu_time = 0
+    edge_count = 0
+    last_edge = 0
+
+    def end_due(now):
+        # if the train would have been finished by now, finish it at the time it was due
+        wait = decoder.time_to_end(last_edge)
+        if wait is None or last_edge + wait > now:
+            return
+        selection = decoder.end_train()
+        if selection is not None:
+            decoded.append(selection)
+            latencies.append(wait)
+
+    for selection, edges in trains:
+        for edge_time in edges:
+            end_due(edge_time)
+            start = time.perf_counter()
+            decoder.edge(edge_time)
+            cpu_time += time.perf_counter() - start
+            edge_count += 1
+            last_edge = edge_time
+    end_due(float('inf'))
+    return decoded, latencies, cpu_time / max(edge_count, 1)
+
+
+def report(trains, decoded, latencies, edge_time):
+    expected = [selection for selection, edges in trains if selection is not None]
+    matcher = difflib.SequenceMatcher(None, expected, decoded, autojunk=False)
+    correct = sum(block.size for block in matcher.get_matching_blocks())
+    print("Selections:        ", len(expected))
+    print("Decoded:           ", len(decoded))
+    print("Correct:           ", correct, "({:.2f}%)".format(100 * correct / max(len(expected), 1)))
+    print("Missed:            ", len(expected) - correct)
+    print("Wrong or extra:    ", len(decoded) - correct)
+    if latencies:
+        print("Decode latency:     mean {:.0f} ms, max {:.0f} ms after the last pulse".format(
+            1000 * statistics.mean(latencies), 1000 * max(latencies)))
+    print("Decoder time:       {:.2f} us per edge".format(edge_time * 1000000))
+    for opcode, expected_start, expected_end, decoded_start, decoded_end in matcher.get_opcodes():
+        if opcode != 'equal':
+            print("  ", opcode, "expected", [WallboxDecoder.label(s) for s in expected[expected_start:expected_end]],
+                  "decoded", [WallboxDecoder.label(s) for s in decoded[decoded_start:decoded_end]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay wallbox pulse traces through the decoder")
+    parser.add_argument('--trace', action='append', default=[], help="trace file to replay, can be repeated")
+    parser.add_argument('--trains', type=int, default=0, help="number of made up trains to add")
+    parser.add_argument('--jitter', type=float, default=1.0, help="timing jitter of made up trains, ms")
+    parser.add_argument('--noise', type=float, default=0.1, help="chance of a noise spike after a made up train")
+    parser.add_argument('--seed', type=int, default=None, help="random seed for made up trains")
+    parser.add_argument('--quiet', type=float, default=WallboxDecoder.PulseDecoder.QUIET,
+                        help="seconds without pulses that finishes a train")
+    parser.add_argument('--save', help="save the made up trains to this trace file")
+    args = parser.parse_args()
+
+    trains = []
+    for file_name in args.trace:
+        trains.extend(WallboxDecoder.read_trace(file_name))
+    if args.trains:
+        # start the made up trains after the recorded ones
+        offset = trains[-1][1][-1] if trains else 0
+        made_up = make_trains(args.trains, args.jitter, args.noise, args.seed)
+        if args.save:
+            WallboxDecoder.write_trace(args.save, made_up)
+        trains.extend((selection, [edge + offset for edge in edges]) for selection, edges in made_up)
+    if not trains:
+        parser.error("nothing to replay, give --trace and/or --trains")
+    decoded, latencies, edge_time = replay(trains, quiet=args.quiet)
+    report(trains, decoded, latencies, edge_time)
+
+
+if __name__ == '__main__':
+    main()